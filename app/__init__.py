@@ -1,9 +1,11 @@
 import os
+import click
 from flask import Flask, url_for, render_template
 from config import config_by_name
 from extensions import db, migrate, login_manager
 from datetime import datetime
 from flask_wtf.csrf import generate_csrf
+from werkzeug.local import LocalProxy
 
 def create_app(config_name=None):
     app = Flask(__name__)
@@ -26,58 +28,50 @@ def create_app(config_name=None):
         return db.session.get(User, int(user_id))
     
     # --- PROCESSEURS DE CONTEXTE POUR LES VARIABLES GLOBALES ---
-    @app.context_processor
-    def inject_global_variables():
+    from app.stock.global_stats import GlobalStockStats
+    GlobalStockStats.install_listeners()
+    from app.products.search import ProductSearch
+    ProductSearch.install_listeners()
+    from app.products.catalogue import ProductCatalogue
+    ProductCatalogue.install_listeners()
+    from app.orders.changefeed import ChangeFeed
+    ChangeFeed.install_listeners()
+    from app.stock.levels import StockLevelStore
+    StockLevelStore.install_listeners()
+
+    def _global_stat(key):
         """
-        Injecte des variables globales dans tous les templates
+        Lit un compteur du cache de statistiques. Appelé uniquement quand un
+        template utilise réellement la variable (via LocalProxy).
         """
         try:
-            # Variables toujours disponibles
-            base_vars = {
-                # Tokens CSRF
-                'csrf_token': generate_csrf,
-                'manual_csrf_token': generate_csrf,
-                # Date courante
-                'current_year': datetime.now().year,
-            }
-            
-            # Variables nécessitant un context d'application
-            with app.app_context():
-                from models import Product
-                
-                # Statistiques pour dashboard (avec gestion d'erreur)
-                try:
-                    total_products = Product.query.count()
-                    low_stock = Product.query.filter(Product.quantity_in_stock <= 5).count()
-                    out_of_stock = Product.query.filter(Product.quantity_in_stock <= 0).count()
-                    
-                    base_vars.update({
-                        'total_products_count': total_products,
-                        'low_stock_products': low_stock,
-                        'out_of_stock_products': out_of_stock,
-                    })
-                except Exception as e:
-                    # En cas d'erreur DB, fournir des valeurs par défaut
-                    app.logger.warning(f"Erreur context processor statistiques: {e}")
-                    base_vars.update({
-                        'total_products_count': 0,
-                        'low_stock_products': 0,
-                        'out_of_stock_products': 0,
-                    })
-            
-            return base_vars
-            
+            stats = GlobalStockStats.get(
+                ttl=app.config.get('GLOBAL_STATS_CACHE_TTL', GlobalStockStats.DEFAULT_TTL),
+                low_stock_threshold=app.config.get('LOW_STOCK_THRESHOLD', 5)
+            )
         except Exception as e:
-            # Fallback minimal en cas d'erreur totale
-            app.logger.error(f"Erreur context processor: {e}")
-            return {
-                'csrf_token': generate_csrf,
-                'manual_csrf_token': generate_csrf,
-                'current_year': datetime.now().year,
-                'total_products_count': 0,
-                'low_stock_products': 0,
-                'out_of_stock_products': 0,
-            }
+            # En cas d'erreur DB, fournir des valeurs par défaut
+            app.logger.warning(f"Erreur context processor statistiques: {e}")
+            stats = GlobalStockStats.EMPTY_STATS
+        return stats[key]
+
+    @app.context_processor
+    def inject_global_variables():
+        """
+        Injecte des variables globales dans tous les templates.
+        Les statistiques produits sont évaluées paresseusement et mises en cache.
+        """
+        return {
+            # Tokens CSRF
+            'csrf_token': generate_csrf,
+            'manual_csrf_token': generate_csrf,
+            # Date courante
+            'current_year': datetime.now().year,
+            # Statistiques pour dashboard (requête unique, uniquement si utilisées)
+            'total_products_count': LocalProxy(lambda: _global_stat('total_products_count')),
+            'low_stock_products': LocalProxy(lambda: _global_stat('low_stock_products')),
+            'out_of_stock_products': LocalProxy(lambda: _global_stat('out_of_stock_products')),
+        }
     
     @app.template_filter('nl2br')
     def nl2br_filter(text):
@@ -176,6 +170,116 @@ def create_app(config_name=None):
         print("Email: admin@example.com")
         print("Mot de passe: password123")
 
+    # Commande CLI pour initialiser les coûts matérialisés des recettes
+    @app.cli.command("recompute-recipe-costs")
+    def recompute_recipe_costs_command():
+        """Recalcule le coût de revient stocké de toutes les recettes"""
+        from app.recipes.costing import recompute_all_recipe_costs
+
+        updated = recompute_all_recipe_costs()
+        db.session.commit()
+        print(f"{updated} recette(s) recalculée(s).")
+
+    # Commande CLI (à planifier, ex: cron quotidien) pour les instantanés de stock
+    @app.cli.command("snapshot-stock")
+    def snapshot_stock_command():
+        """Enregistre un instantané du stock (borne le rejeu du journal)"""
+        from app.stock.ledger import StockLedger
+
+        written = StockLedger.take_snapshot()
+        db.session.commit()
+        print(f"Instantané de stock enregistré ({written} ligne(s)).")
+
+    # Commande CLI (à planifier, ex: début de mois) pour le cumul des performances employés
+    @app.cli.command("rollup-employee-stats")
+    @click.option('--months', default=1, show_default=True, help="Nombre de mois clos à recalculer")
+    def rollup_employee_stats_command(months):
+        """Recalcule la table de cumul mensuel des performances employés"""
+        from app.employees.performance import EmployeePerformanceService
+
+        now = datetime.utcnow()
+        end = (now.year - 1, 12) if now.month == 1 else (now.year, now.month - 1)
+        start_index = end[0] * 12 + end[1] - 1 - (max(months, 1) - 1)
+        start = (start_index // 12, start_index % 12 + 1)
+        written = EmployeePerformanceService.refresh_rollup(start, end)
+        db.session.commit()
+        print(f"Cumul employés {start[0]}-{start[1]:02d} → {end[0]}-{end[1]:02d} : {written} ligne(s).")
+
+    # Commande CLI pour (re)construire les cumuls journaliers de ventes
+    @app.cli.command("rollup-sales")
+    @click.option('--since', default=None, help="Reconstruit depuis cette date (AAAA-MM-JJ) au lieu de l'incrémental")
+    def rollup_sales_command(since):
+        """Met à jour les cumuls journaliers ventes / production"""
+        from datetime import date
+        from app.orders.rollups import SalesRollup
+
+        if since:
+            days = SalesRollup.rebuild(date.fromisoformat(since), datetime.utcnow().date())
+        else:
+            days = SalesRollup.refresh()
+        db.session.commit()
+        print(f"{days} jour(s) recalculé(s).")
+
+    # Commande CLI pour recalculer les prévisions de consommation
+    @app.cli.command("refresh-stock-forecast")
+    @click.option('--full', is_flag=True, help="Recalcule tous les produits au lieu de l'incrémental")
+    def refresh_stock_forecast_command(full):
+        """Met à jour les points de commande et jours de couverture"""
+        from app.stock.forecast import ConsumptionForecast
+
+        written = ConsumptionForecast.rebuild() if full else ConsumptionForecast.refresh()
+        db.session.commit()
+        print(f"{written} prévision(s) écrite(s).")
+
+    # Commandes CLI des niveaux de stock normalisés
+    @app.cli.command("rebuild-stock-levels")
+    def rebuild_stock_levels_command():
+        """Recopie les colonnes de stock des produits dans stock_levels"""
+        from app.stock.levels import StockLevelStore
+
+        written = StockLevelStore.rebuild()
+        db.session.commit()
+        print(f"{written} niveau(x) de stock écrit(s).")
+
+    @app.cli.command("add-stock-location")
+    @click.argument('key')
+    @click.argument('name')
+    def add_stock_location_command(key, name):
+        """Déclare une nouvelle localisation de stock (sans migration)"""
+        from app.stock.models import StockLocation
+
+        if StockLocation.query.filter_by(key=key).first():
+            print(f"La localisation '{key}' existe déjà.")
+            return
+        display_order = (db.session.query(db.func.max(StockLocation.display_order)).scalar() or 0) + 1
+        db.session.add(StockLocation(key=key, name=name, display_order=display_order))
+        db.session.commit()
+        print(f"Localisation '{key}' ({name}) ajoutée.")
+
+    # Commandes CLI de la valorisation FIFO (couches de coût)
+    @app.cli.command("close-valuation")
+    @click.option('--period', default=None, help="Mois à clore (AAAA-MM), seul le mois courant est accepté")
+    @click.option('--force', is_flag=True, help="Réécrit un mois déjà clos")
+    def close_valuation_command(period, force):
+        """Fige la valorisation FIFO / PMP de fin de mois (à planifier le dernier jour du mois)"""
+        from app.stock.valuation import CostLayerEngine
+
+        try:
+            written = CostLayerEngine.close_period(period, overwrite=force)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        db.session.commit()
+        print(f"Valorisation {period or datetime.utcnow().strftime('%Y-%m')} : {written} produit(s).")
+
+    @app.cli.command("rebuild-cost-layers")
+    def rebuild_cost_layers_command():
+        """Repart d'une couche d'ouverture par produit (stock courant au PMP)"""
+        from app.stock.valuation import CostLayerEngine
+
+        written = CostLayerEngine.rebuild()
+        db.session.commit()
+        print(f"{written} couche(s) d'ouverture écrite(s).")
+
     # Commande CLI pour les statistiques
     @app.cli.command("stats")
     def show_stats():
@@ -12,7 +12,9 @@ from extensions import db
 order_employees = db.Table('order_employees',
     db.Column('order_id', db.Integer, db.ForeignKey('orders.id'), primary_key=True),
     db.Column('employee_id', db.Integer, db.ForeignKey('employees.id'), primary_key=True),
-    db.Column('created_at', db.DateTime, default=datetime.utcnow)
+    db.Column('created_at', db.DateTime, default=datetime.utcnow),
+    # La clé primaire commence par order_id : index inverse pour les agrégats par employé
+    db.Index('ix_order_employees_employee_order', 'employee_id', 'order_id')
 )
 
 class Employee(db.Model):
@@ -32,40 +34,19 @@ class Employee(db.Model):
     
     def get_monthly_revenue(self, year, month):
         """Calcule le CA généré par cet employé pour un mois donné"""
-        # Import local pour éviter la circularité
-        from models import Order
-        
-        orders = Order.query.filter(
-            Order.produced_by.contains(self),
-            db.extract('year', Order.due_date) == year,
-            db.extract('month', Order.due_date) == month,
-            Order.status.in_(['delivered', 'completed'])
-        ).all()
-        
-        return sum(float(order.total_amount or 0) for order in orders)
+        from app.employees.performance import EmployeePerformanceService
+        return EmployeePerformanceService.for_employee(self, year, month)['revenue']
     
     def get_productivity_score(self, year, month):
         """Calcule le score de productivité (CA / salaire)"""
-        revenue = self.get_monthly_revenue(year, month)
-        total_salary = float(self.salaire_fixe or 0) + float(self.prime or 0)
-        
-        if total_salary > 0:
-            return revenue / total_salary
-        return 0
+        from app.employees.performance import EmployeePerformanceService
+        return EmployeePerformanceService.for_employee(self, year, month)['productivity_score']
     
     def get_orders_count(self, year=None, month=None):
         """Compte le nombre de commandes produites"""
         if year and month:
-            # Import local pour éviter la circularité
-            from models import Order
-            from sqlalchemy import extract  # ← Import nécessaire
-            
-            count = Order.query.filter(
-                Order.produced_by.contains(self),
-                extract('year', Order.due_date) == year,
-                extract('month', Order.due_date) == month
-            ).count()
-            return count
+            from app.employees.performance import EmployeePerformanceService
+            return EmployeePerformanceService.for_employee(self, year, month)['orders_count']
         else:
             # Sans filtre, on compte directement
             return len(self.orders_produced)
@@ -86,3 +67,21 @@ class Employee(db.Model):
     
     def __repr__(self):
         return f'<Employee {self.name}>'
+
+class EmployeeMonthlyStats(db.Model):
+    """
+    Agrégat mensuel des performances par employé (table de cumul optionnelle).
+    Alimentée par EmployeePerformanceService.refresh_rollup : la vue annuelle
+    lit ces lignes pour les mois clos au lieu de réagréger les commandes.
+    """
+    __tablename__ = 'employee_monthly_stats'
+
+    employee_id = db.Column(db.Integer, db.ForeignKey('employees.id'), primary_key=True)
+    year = db.Column(db.Integer, primary_key=True)
+    month = db.Column(db.Integer, primary_key=True)
+    revenue = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    orders_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<EmployeeMonthlyStats {self.employee_id} {self.year}-{self.month:02d}>'
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+app/employees/performance.py
+Agrégation des performances employés (CA, nombre de commandes, productivité)
+
+Une seule requête groupée sur order_employees ⨝ orders calcule, pour tous
+les employés et une plage de mois, le CA (commandes livrées / terminées) et
+le nombre de commandes produites. La table employee_monthly_stats peut en
+conserver le résultat par mois clos pour une vue annuelle instantanée.
+"""
+
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy import case, extract, func
+
+from extensions import db
+from app.employees.models import Employee, EmployeeMonthlyStats, order_employees
+
+# Statuts de commande qui comptent dans le chiffre d'affaires
+REVENUE_STATUSES = ('delivered', 'completed')
+
+
+def month_start(year, month):
+    return datetime(year, month, 1)
+
+
+def next_month_start(year, month):
+    return datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+
+
+def iter_months(start, end):
+    """Mois (année, mois) de start à end inclus."""
+    year, month = start
+    while (year, month) <= end:
+        yield year, month
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+class EmployeePerformanceService:
+    """Statistiques de performance de tous les employés en requêtes groupées."""
+
+    @staticmethod
+    def monthly_totals(start, end, employee_ids=None):
+        """
+        CA et nombre de commandes par employé et par mois, en une requête.
+
+        :param start: (année, mois) de début inclus.
+        :param end: (année, mois) de fin inclus.
+        :param employee_ids: Restreint à ces employés (optionnel).
+        :return: dict {employee_id: {(année, mois): {'revenue': Decimal, 'orders_count': int}}}.
+        """
+        from models import Order
+
+        year_col = extract('year', Order.due_date)
+        month_col = extract('month', Order.due_date)
+        query = db.session.query(
+            order_employees.c.employee_id,
+            year_col,
+            month_col,
+            func.sum(case((Order.status.in_(REVENUE_STATUSES), Order.total_amount), else_=0)),
+            func.count(Order.id)
+        ).join(Order, Order.id == order_employees.c.order_id)\
+         .filter(Order.due_date >= month_start(*start),
+                 Order.due_date < next_month_start(*end))
+        if employee_ids is not None:
+            query = query.filter(order_employees.c.employee_id.in_(list(employee_ids)))
+        rows = query.group_by(order_employees.c.employee_id, year_col, month_col).all()
+
+        totals = defaultdict(dict)
+        for employee_id, year, month, revenue, orders_count in rows:
+            totals[employee_id][(int(year), int(month))] = {
+                'revenue': Decimal(revenue or 0),
+                'orders_count': int(orders_count or 0)
+            }
+        return totals
+
+    @classmethod
+    def performance(cls, start, end, employee_ids=None, active_only=True, use_rollup=False):
+        """
+        Performance agrégée de chaque employé sur une plage de mois.
+
+        :param use_rollup: Lit employee_monthly_stats pour les mois clos
+                           (le mois en cours est toujours calculé en direct).
+        :return: Liste de dicts (un par employé, triés par nom).
+        """
+        query = Employee.query
+        if active_only:
+            query = query.filter(Employee.is_active == True)
+        if employee_ids is not None:
+            query = query.filter(Employee.id.in_(list(employee_ids)))
+        employees = query.order_by(Employee.name).all()
+        ids = [employee.id for employee in employees]
+
+        if use_rollup:
+            totals = cls._totals_with_rollup(start, end, ids)
+        else:
+            totals = cls.monthly_totals(start, end, ids)
+
+        months = list(iter_months(start, end))
+        results = []
+        for employee in employees:
+            salary = employee.get_total_salary()
+            per_month = totals.get(employee.id, {})
+            breakdown = []
+            for year, month in months:
+                values = per_month.get((year, month), {'revenue': Decimal('0'), 'orders_count': 0})
+                revenue = float(values['revenue'])
+                breakdown.append({
+                    'year': year,
+                    'month': month,
+                    'revenue': revenue,
+                    'orders_count': values['orders_count'],
+                    'productivity_score': revenue / salary if salary > 0 else 0
+                })
+            revenue = sum(item['revenue'] for item in breakdown)
+            results.append({
+                'id': employee.id,
+                'name': employee.name,
+                'role': employee.role,
+                'total_salary': salary,
+                'monthly_revenue': revenue,
+                'orders_count': sum(item['orders_count'] for item in breakdown),
+                # Productivité = CA / salaire mensuel, moyenne sur la période
+                'productivity_score': revenue / (salary * len(months)) if salary > 0 and months else 0,
+                'months': breakdown
+            })
+        return results
+
+    @classmethod
+    def for_employee(cls, employee, year, month):
+        """Statistiques d'un seul employé pour un mois."""
+        values = cls.monthly_totals((year, month), (year, month), [employee.id])\
+            .get(employee.id, {}).get((year, month), {'revenue': Decimal('0'), 'orders_count': 0})
+        revenue = float(values['revenue'])
+        salary = employee.get_total_salary()
+        return {
+            'revenue': revenue,
+            'orders_count': values['orders_count'],
+            'productivity_score': revenue / salary if salary > 0 else 0
+        }
+
+    # ------------------------------------------------------------------ #
+    # Table de cumul mensuel
+    # ------------------------------------------------------------------ #
+
+    @classmethod
+    def refresh_rollup(cls, start, end):
+        """
+        Recalcule employee_monthly_stats pour une plage de mois.
+        L'appelant reste responsable du commit.
+
+        :return: Nombre de lignes écrites.
+        """
+        totals = cls.monthly_totals(start, end)
+        months = list(iter_months(start, end))
+
+        table = EmployeeMonthlyStats.__table__
+        for year, month in months:
+            db.session.execute(table.delete().where(table.c.year == year, table.c.month == month))
+
+        now = datetime.utcnow()
+        rows = [
+            {'employee_id': employee_id, 'year': year, 'month': month,
+             'revenue': values['revenue'], 'orders_count': values['orders_count'], 'updated_at': now}
+            for employee_id, per_month in totals.items()
+            for (year, month), values in per_month.items()
+        ]
+        if rows:
+            db.session.execute(table.insert(), rows)
+        return len(rows)
+
+    @classmethod
+    def _totals_with_rollup(cls, start, end, employee_ids):
+        """
+        Mois clos depuis la table de cumul, mois en cours (et suivants) en direct.
+        Un mois clos absent de la table (cumul pas encore calculé) est lui
+        aussi calculé en direct.
+        """
+        today = datetime.utcnow()
+        current = (today.year, today.month)
+
+        totals = defaultdict(dict)
+        if start < current:
+            closed_end = min(end, (current[0] - 1, 12) if current[1] == 1 else (current[0], current[1] - 1))
+            period = EmployeeMonthlyStats.year * 100 + EmployeeMonthlyStats.month
+            in_range = (period >= start[0] * 100 + start[1], period <= closed_end[0] * 100 + closed_end[1])
+
+            # refresh_rollup écrit tous les employés d'un mois : un mois présent est complet
+            rolled_up = {(year, month) for year, month in db.session.query(
+                EmployeeMonthlyStats.year, EmployeeMonthlyStats.month
+            ).filter(*in_range).distinct()}
+            rows = EmployeeMonthlyStats.query.filter(
+                EmployeeMonthlyStats.employee_id.in_(employee_ids), *in_range
+            ).all()
+            for row in rows:
+                totals[row.employee_id][(row.year, row.month)] = {
+                    'revenue': Decimal(row.revenue or 0),
+                    'orders_count': row.orders_count
+                }
+
+            missing = [key for key in iter_months(start, closed_end) if key not in rolled_up]
+            if missing:
+                missing_set = set(missing)
+                live = cls.monthly_totals(missing[0], missing[-1], employee_ids)
+                for employee_id, per_month in live.items():
+                    for key, values in per_month.items():
+                        if key in missing_set:
+                            totals[employee_id][key] = values
+        if end >= current:
+            live = cls.monthly_totals(max(start, current), end, employee_ids)
+            for employee_id, per_month in live.items():
+                totals[employee_id].update(per_month)
+        return totals
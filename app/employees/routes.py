@@ -8,6 +8,7 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
 from flask_login import login_required
 from models import db
 from app.employees.models import Employee
+from app.employees.performance import EmployeePerformanceService
 from app.employees.forms import EmployeeForm, EmployeeSearchForm
 from decorators import admin_required
 from datetime import datetime
@@ -106,15 +107,13 @@ def view_employee(employee_id):
     current_month = datetime.utcnow().month
     current_year = datetime.utcnow().year
     
-    monthly_revenue = employee.get_monthly_revenue(current_year, current_month)
-    productivity_score = employee.get_productivity_score(current_year, current_year)
-    orders_count = employee.get_orders_count(current_year, current_month)
+    performance = EmployeePerformanceService.for_employee(employee, current_year, current_month)
     
     return render_template('employees/view_employee.html',
                          employee=employee,
-                         monthly_revenue=monthly_revenue,
-                         productivity_score=productivity_score,
-                         orders_count=orders_count,
+                         monthly_revenue=performance['revenue'],
+                         productivity_score=performance['productivity_score'],
+                         orders_count=performance['orders_count'],
                          title=f"Employé - {employee.name}")
 
 @employees_bp.route('/<int:employee_id>/edit', methods=['GET', 'POST'])
@@ -188,23 +187,31 @@ def get_production_staff():
 @login_required
 @admin_required
 def get_employees_stats():
-    """API pour les statistiques employés"""
-    
-    current_month = datetime.utcnow().month
-    current_year = datetime.utcnow().year
-    
-    employees = Employee.query.filter(Employee.is_active == True).all()
-    
-    stats = []
-    for emp in employees:
-        stats.append({
-            'id': emp.id,
-            'name': emp.name,
-            'role': emp.role,
-            'monthly_revenue': emp.get_monthly_revenue(current_year, current_month),
-            'productivity_score': emp.get_productivity_score(current_year, current_month),
-            'orders_count': emp.get_orders_count(current_year, current_month),
-            'total_salary': emp.get_total_salary()
-        })
-    
+    """
+    API pour les statistiques employés.
+    Paramètres optionnels : from=AAAA-MM, to=AAAA-MM (mois courant par défaut),
+    rollup=1 pour lire les mois clos depuis la table de cumul.
+    """
+    
+    def parse_month(value, default):
+        if not value:
+            return default
+        year, month = value.split('-')
+        if not 1 <= int(month) <= 12:
+            raise ValueError(value)
+        return int(year), int(month)
+    
+    now = datetime.utcnow()
+    current = (now.year, now.month)
+    try:
+        start = parse_month(request.args.get('from'), current)
+        end = parse_month(request.args.get('to'), start if request.args.get('from') else current)
+    except ValueError:
+        return jsonify({'error': 'Mois invalide (format attendu : AAAA-MM)'}), 400
+    if start > end:
+        return jsonify({'error': 'La période est vide'}), 400
+    
+    stats = EmployeePerformanceService.performance(
+        start, end, use_rollup=request.args.get('rollup', type=int) == 1
+    )
     return jsonify(stats)
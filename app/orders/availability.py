@@ -0,0 +1,126 @@
+"""
+Vérification groupée de la disponibilité des ingrédients
+Module: app/orders/availability.py
+Auteur: ERP Fée Maison
+
+Les recettes d'une commande sont développées jusqu'aux ingrédients bruts via
+app.recipes.bom (une requête par niveau de sous-recette). Les besoins sont
+additionnés par (ingrédient, labo) sur l'ensemble de la commande avant d'être
+comparés au stock : deux lignes qui utilisent la même farine sont vérifiées
+ensemble.
+"""
+
+from collections import defaultdict
+from extensions import db
+from app.recipes.bom import BillOfMaterials
+from app.stock.stock_manager import StockLocationManager
+
+
+def aggregate_order_lines(form_items):
+    """
+    Regroupe les lignes d'un formulaire de commande par produit.
+
+    :param form_items: Liste de dicts {'product': id, 'quantity': qté}.
+    :return: dict {product_id: quantité totale}.
+    """
+    quantities = defaultdict(float)
+    for item_data in form_items:
+        product_id = item_data.get('product')
+        quantity = float(item_data.get('quantity') or 0)
+        if product_id and quantity > 0:
+            quantities[int(product_id)] += quantity
+    return dict(quantities)
+
+
+def load_recipe_lines(product_ids, bom=None):
+    """
+    Charge les recettes de plusieurs produits finis, développées jusqu'aux
+    ingrédients bruts (les sous-recettes sont explosées).
+
+    :param product_ids: Identifiants des produits finis.
+    :param bom: BillOfMaterials déjà chargé, si disponible.
+    :return: dict {product_id: [(ingredient_id, labo_key, quantité par unité produite)]}.
+    :raises BomError: si une recette se contient elle-même ou mélange des unités incompatibles.
+    """
+    if not product_ids:
+        return {}
+    if bom is None:
+        bom = BillOfMaterials.load(product_ids=product_ids)
+    else:
+        bom.ensure_loaded(product_ids=product_ids)
+
+    lines = {}
+    for finished_id in product_ids:
+        vector = bom.explode_product(finished_id)
+        if vector:
+            lines[finished_id] = [
+                (ingredient_id, labo_key, float(qty))
+                for (ingredient_id, labo_key), (qty, _) in vector.items()
+            ]
+    return lines
+
+
+def compute_ingredient_requirements(product_quantities, recipe_lines=None):
+    """
+    Calcule le besoin total en ingrédients pour des quantités de produits finis.
+
+    :param product_quantities: dict {product_id: quantité de produit fini}.
+    :param recipe_lines: Résultat de load_recipe_lines, si déjà chargé.
+    :return: dict {(ingredient_id, labo_key): quantité nécessaire}.
+    """
+    if recipe_lines is None:
+        recipe_lines = load_recipe_lines(product_quantities)
+
+    requirements = defaultdict(float)
+    for finished_id, quantity in product_quantities.items():
+        for ingredient_id, labo_key, qty_per_unit in recipe_lines.get(finished_id, ()):
+            requirements[(ingredient_id, labo_key)] += qty_per_unit * quantity
+    return dict(requirements)
+
+
+def find_shortages(requirements):
+    """
+    Compare des besoins agrégés au stock des labos en une seule requête.
+
+    :param requirements: dict {(ingredient_id, labo_key): quantité nécessaire}.
+    :return: Liste de dicts décrivant chaque ingrédient insuffisant.
+    """
+    from models import Product
+
+    if not requirements:
+        return []
+
+    ingredient_ids = {ingredient_id for ingredient_id, _ in requirements}
+    columns = {labo_key: StockLocationManager.get_stock_column(labo_key) for _, labo_key in requirements}
+    stock_attrs = [getattr(Product, col) for col in set(columns.values()) if col]
+
+    rows = db.session.query(Product.id, Product.name, *stock_attrs)\
+        .filter(Product.id.in_(ingredient_ids)).all()
+    ingredients = {row.id: row for row in rows}
+
+    shortages = []
+    for (ingredient_id, labo_key), needed_qty in sorted(requirements.items(), key=lambda kv: kv[0]):
+        row = ingredients.get(ingredient_id)
+        if row is None:
+            continue
+        column = columns.get(labo_key)
+        available = float(getattr(row, column, 0) or 0) if column else 0.0
+        if available < needed_qty:
+            shortages.append({
+                'product_id': ingredient_id,
+                'product_name': row.name,
+                'location': labo_key,
+                'needed': needed_qty,
+                'available': available
+            })
+    return shortages
+
+
+def check_order_availability(form_items):
+    """
+    Vérifie en une passe la disponibilité des ingrédients pour toute une commande.
+
+    :return: Liste des ruptures (vide si tout est disponible).
+    """
+    product_quantities = aggregate_order_lines(form_items)
+    return find_shortages(compute_ingredient_requirements(product_quantities))
@@ -0,0 +1,106 @@
+"""
+Flux d'événements du calendrier des commandes
+Module: app/orders/calendar.py
+Auteur: ERP Fée Maison
+
+FullCalendar demande les événements de la fenêtre affichée (start / end).
+La requête ne lit que les colonnes utiles, filtre la plage de due_date et les
+statuts en SQL (index orders(due_date, status)) : le coût dépend de la
+fenêtre, pas de l'historique. La réponse porte un ETag calculé sur son
+contenu pour que les rechargements identiques répondent 304.
+"""
+
+import hashlib
+import json
+from datetime import datetime, timedelta
+
+from flask import url_for
+
+from extensions import db
+
+
+class InvalidWindowError(ValueError):
+    """Fenêtre start / end illisible ou vide."""
+
+
+class CalendarFeed:
+    """Événements FullCalendar des commandes sur une fenêtre de dates."""
+
+    MAX_WINDOW_DAYS = 366
+    STATUS_COLORS = {
+        'in_production': '#ffc107',
+        'pending': '#6c757d',
+    }
+
+    def __init__(self, start, end, statuses=None):
+        from models import Order
+
+        if end <= start:
+            raise InvalidWindowError("La fin de la fenêtre doit suivre son début.")
+        if end - start > timedelta(days=self.MAX_WINDOW_DAYS):
+            raise InvalidWindowError(f"Fenêtre limitée à {self.MAX_WINDOW_DAYS} jours.")
+        self.start = start
+        self.end = end
+        self.statuses = tuple(statuses or Order.CALENDAR_STATUSES)
+
+    @staticmethod
+    def parse_datetime(value):
+        """
+        Lit une date FullCalendar (ISO 8601, avec ou sans fuseau).
+        Les due_date étant stockées sans fuseau, l'heure murale est conservée.
+        """
+        try:
+            parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except (AttributeError, ValueError) as e:
+            raise InvalidWindowError(f"Date invalide : {value!r}") from e
+        return parsed.replace(tzinfo=None)
+
+    @classmethod
+    def from_args(cls, args):
+        """Construit le flux depuis request.args (mois courant ± 1 semaine par défaut)."""
+        start_arg, end_arg = args.get('start'), args.get('end')
+        if start_arg and end_arg:
+            return cls(cls.parse_datetime(start_arg), cls.parse_datetime(end_arg))
+        month_start = datetime.utcnow().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        return cls(month_start - timedelta(days=7), month_start + timedelta(days=38))
+
+    def events(self):
+        from models import Order
+
+        rows = db.session.query(
+            Order.id,
+            Order.order_type,
+            Order.customer_name,
+            Order.due_date,
+            Order.status,
+            Order.total_amount
+        ).filter(
+            Order.due_date >= self.start,
+            Order.due_date < self.end,
+            Order.status.in_(self.statuses)
+        ).order_by(Order.due_date, Order.id).all()
+
+        # Un seul url_for : l'URL de détail ne varie que par l'identifiant
+        url_prefix = url_for('orders.view_order', order_id=0)[:-1]
+        return [{
+            'id': row.id,
+            'title': f"#{row.id} - {row.customer_name or 'Production'}",
+            'start': row.due_date.isoformat(),
+            'url': f"{url_prefix}{row.id}",
+            'backgroundColor': self.STATUS_COLORS.get(row.status, '#6c757d'),
+            'extendedProps': {
+                'orderType': Order.ORDER_TYPE_LABELS.get(row.order_type, row.order_type),
+                'status': Order.STATUS_LABELS.get(row.status, row.status),
+                'customerName': row.customer_name,
+                'totalAmount': float(row.total_amount or 0),
+            }
+        } for row in rows]
+
+    @staticmethod
+    def etag(payload):
+        return hashlib.sha1(payload.encode()).hexdigest()
+
+    def render(self):
+        """:return: (corps JSON, ETag)."""
+        payload = json.dumps(self.events(), ensure_ascii=False, separators=(',', ':'))
+        return payload, self.etag(payload)
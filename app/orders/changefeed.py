@@ -0,0 +1,252 @@
+"""
+Flux de changements pour les écrans de production et de magasin
+Module: app/orders/changefeed.py
+Auteur: ERP Fée Maison
+
+Chaque commit qui modifie une commande (ou ses lignes) ou un stock produit
+incrémente un numéro de version unique et enregistre les entités touchées
+dans change_events. Cette écriture a lieu juste après le commit, dans une
+courte transaction séparée : la ligne du compteur n'est verrouillée que le
+temps de l'incrément, et non pendant toute la transaction métier. Les écrans
+gardent la dernière version vue :
+
+- GET /dashboard/api/changes?since=V ne renvoie que les cartes des commandes
+  modifiées depuis V (une seule lecture de compteur si rien n'a changé) ;
+- GET /dashboard/api/changes/stream envoie un événement Server-Sent Events
+  à chaque nouvelle version.
+
+Le sujet « catalogue » (produit renommé, prix, recette...) sert aux caches
+en mémoire du catalogue et de la recherche : latest_version() leur donne,
+pour tous les processus, la dernière version qui l'a touché.
+
+Les événements de plus de RETENTION sont purgés ; un client plus ancien que
+la purge reçoit reset=True et recharge la page. Si l'incrément échoue après
+le commit, les écrans ne voient le changement qu'à la version suivante.
+"""
+
+import threading
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from extensions import db
+
+
+class ChangeFeed:
+    """Compteur de version et journal des entités modifiées."""
+
+    COUNTER = 'dashboards'
+    TOPICS = ('orders', 'stock', 'catalogue')
+    RETENTION = timedelta(hours=24)
+    PRUNE_EVERY = 200   # versions
+
+    _condition = threading.Condition()
+    _listeners_installed = False
+
+    # ------------------------------------------------------------------ #
+    # Écriture
+    # ------------------------------------------------------------------ #
+
+    @staticmethod
+    def mark(session, topic, entity_ids=None):
+        """
+        Signale des entités modifiées hors ORM (UPDATE en masse) ; la version
+        est incrémentée au commit.
+        """
+        pending = session.info.setdefault('change_feed', {})
+        ids = pending.setdefault(topic, set())
+        if entity_ids is None:
+            ids.add(None)
+        else:
+            ids.update(entity_ids)
+
+    @classmethod
+    def _bump(cls, connection, pending):
+        """
+        Réserve la version suivante et enregistre les entités, dans la
+        transaction courte de `connection` (verrou de ligne du compteur
+        jusqu'à son commit : les versions sont visibles dans l'ordre).
+        """
+        from models import ChangeFeedCounter, ChangeEvent
+
+        table = ChangeFeedCounter.__table__
+        dialect = connection.dialect.name
+        if dialect in ('postgresql', 'sqlite'):
+            if dialect == 'postgresql':
+                from sqlalchemy.dialects.postgresql import insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert
+            stmt = insert(table).values(name=cls.COUNTER, version=1, pruned_version=0)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[table.c.name],
+                set_={'version': table.c.version + 1}
+            ).returning(table.c.version, table.c.pruned_version)
+            version, pruned = connection.execute(stmt).one()
+        else:
+            row = connection.execute(
+                select(table.c.version, table.c.pruned_version)
+                .where(table.c.name == cls.COUNTER).with_for_update()
+            ).first()
+            if row is None:
+                version, pruned = 1, 0
+                connection.execute(table.insert().values(name=cls.COUNTER, version=1, pruned_version=0))
+            else:
+                version, pruned = row.version + 1, row.pruned_version
+                connection.execute(table.update().where(table.c.name == cls.COUNTER).values(version=version))
+
+        now = datetime.utcnow()
+        rows = [
+            {'version': version, 'topic': topic, 'entity_id': entity_id, 'created_at': now}
+            for topic, entity_ids in pending.items()
+            for entity_id in entity_ids
+        ]
+        connection.execute(ChangeEvent.__table__.insert(), rows)
+
+        if version - pruned >= cls.PRUNE_EVERY:
+            cls._prune(connection, now)
+        return version
+
+    @classmethod
+    def _prune(cls, connection, now):
+        from models import ChangeFeedCounter, ChangeEvent
+
+        events = ChangeEvent.__table__
+        cutoff = now - cls.RETENTION
+        pruned = connection.execute(
+            select(func.max(events.c.version)).where(events.c.created_at < cutoff)
+        ).scalar()
+        if pruned:
+            connection.execute(events.delete().where(events.c.version <= pruned))
+            counters = ChangeFeedCounter.__table__
+            connection.execute(counters.update().where(counters.c.name == cls.COUNTER)
+                               .values(pruned_version=pruned))
+
+    # ------------------------------------------------------------------ #
+    # Lecture
+    # ------------------------------------------------------------------ #
+
+    @classmethod
+    def current_version(cls, connection=None):
+        """Version courante (0 si rien n'a encore été enregistré)."""
+        from models import ChangeFeedCounter
+
+        table = ChangeFeedCounter.__table__
+        stmt = select(table.c.version).where(table.c.name == cls.COUNTER)
+        executor = connection if connection is not None else db.session
+        return executor.execute(stmt).scalar() or 0
+
+    @classmethod
+    def latest_version(cls, topic):
+        """Dernière version ayant touché `topic` (None si aucune depuis la purge)."""
+        from models import ChangeEvent
+
+        events = ChangeEvent.__table__
+        return db.session.execute(
+            select(func.max(events.c.version)).where(events.c.topic == topic)
+        ).scalar()
+
+    @classmethod
+    def changes(cls, since, topics=None):
+        """
+        Entités modifiées après la version `since`.
+
+        :return: dict {'version', 'reset', 'orders': set, 'stock': set, 'catalogue': set}.
+                 Un ensemble contenant None signifie « modifications non détaillées ».
+        """
+        from models import ChangeFeedCounter, ChangeEvent
+
+        row = db.session.query(ChangeFeedCounter.version, ChangeFeedCounter.pruned_version)\
+            .filter(ChangeFeedCounter.name == cls.COUNTER).first()
+        version, pruned = (row.version, row.pruned_version) if row else (0, 0)
+        result = {'version': version, 'reset': since < pruned or since > version}
+        for topic in cls.TOPICS:
+            result[topic] = set()
+        if result['reset'] or since == version:
+            return result
+
+        query = db.session.query(ChangeEvent.topic, ChangeEvent.entity_id)\
+            .filter(ChangeEvent.version > since, ChangeEvent.version <= version)
+        if topics:
+            query = query.filter(ChangeEvent.topic.in_(list(topics)))
+        for topic, entity_id in query.distinct().all():
+            result.setdefault(topic, set()).add(entity_id)
+        return result
+
+    @classmethod
+    def wait(cls, timeout):
+        """
+        Attend une nouvelle version (réveil immédiat pour les commits de ce
+        processus, relecture du compteur à l'expiration pour les autres).
+
+        :return: Version courante.
+        """
+        with cls._condition:
+            cls._condition.wait(timeout)
+        with db.engine.connect() as connection:
+            return cls.current_version(connection)
+
+    # ------------------------------------------------------------------ #
+    # Détection des changements
+    # ------------------------------------------------------------------ #
+
+    @classmethod
+    def install_listeners(cls):
+        """Incrémente la version au commit d'une commande ou d'un stock modifié."""
+        if cls._listeners_installed:
+            return
+        event.listen(Session, 'after_flush', cls._after_flush)
+        event.listen(Session, 'before_commit', cls._before_commit)
+        event.listen(Session, 'after_commit', cls._after_commit)
+        event.listen(Session, 'after_rollback', cls._after_rollback)
+        cls._listeners_installed = True
+
+    @classmethod
+    def _after_flush(cls, session, flush_context):
+        from models import Order, OrderItem, Product
+        from app.stock.stock_manager import StockLocationManager
+
+        stock_columns = StockLocationManager.LOCATION_COLUMNS.values()
+        for obj in (*session.new, *session.dirty, *session.deleted):
+            if isinstance(obj, Order):
+                if obj.id is not None:
+                    cls.mark(session, 'orders', [obj.id])
+            elif isinstance(obj, OrderItem):
+                if obj.order_id is not None:
+                    cls.mark(session, 'orders', [obj.order_id])
+            elif isinstance(obj, Product) and obj.id is not None:
+                state = inspect(obj)
+                if obj in session.dirty and not any(
+                        state.attrs[column].history.has_changes() for column in stock_columns):
+                    continue
+                cls.mark(session, 'stock', [obj.id])
+
+    @classmethod
+    def _before_commit(cls, session):
+        # Le flush final a lieu après before_commit : on le déclenche ici pour
+        # relever toutes les entités de la transaction avant son commit
+        session.flush()
+        pending = session.info.pop('change_feed', None)
+        if pending:
+            session.info['change_feed_committed'] = pending
+
+    @classmethod
+    def _after_commit(cls, session):
+        pending = session.info.pop('change_feed_committed', None)
+        if not pending:
+            return
+        try:
+            with session.get_bind().begin() as connection:
+                cls._bump(connection, pending)
+        except SQLAlchemyError as e:
+            current_app.logger.error(f"Erreur d'incrément du flux de changements : {e}", exc_info=True)
+            return
+        with cls._condition:
+            cls._condition.notify_all()
+
+    @staticmethod
+    def _after_rollback(session):
+        session.info.pop('change_feed', None)
+        session.info.pop('change_feed_committed', None)
@@ -1,17 +1,37 @@
-from flask import render_template, jsonify, Blueprint
+from flask import render_template, jsonify, Blueprint, request, Response, stream_with_context
 from flask_login import login_required
+from extensions import db
 from models import Order, Product
 from app.employees.models import Employee
+from app.orders.changefeed import ChangeFeed
+from app.orders.rollups import SalesRollup, parse_day
 from datetime import datetime, timedelta
 from decorators import admin_required
+import time
 
 dashboard_bp = Blueprint('dashboard', __name__)
 
+# Écrans mis à jour par cartes : partiel rendu et section par statut de commande
+CARD_VIEWS = {
+    'production': ('dashboards/_production_order_card.html',
+                   {'pending': 'production', 'in_production': 'production'}),
+    'shop': ('dashboards/_shop_order_card.html',
+             {'in_production': 'in_production', 'ready_at_shop': 'ready_at_shop'}),
+}
+
+# Flux SSE : relecture du compteur (changements des autres processus),
+# commentaire de maintien et durée maximale d'une connexion
+STREAM_POLL_SECONDS = 5
+STREAM_KEEPALIVE_SECONDS = 15
+STREAM_MAX_SECONDS = 300
+STREAM_RETRY_MS = 3000
+
 @dashboard_bp.route('/production')
 @login_required
 @admin_required
 def production_dashboard():
     """Dashboard de production pour Rayan"""
+    feed_version = ChangeFeed.current_version()
     
     # ### DEBUT DE LA CORRECTION ###
     # On récupère toutes les commandes qui doivent être produites
@@ -42,6 +62,7 @@ def production_dashboard():
                          orders_soon=orders_soon,
                          orders_overdue=orders_overdue,
                          total_orders=len(orders_to_produce),
+                         feed_version=feed_version,
                          title="Dashboard Production")
 
 # ... (le reste de tes routes de dashboard reste identique)
@@ -49,6 +70,7 @@ def production_dashboard():
 @login_required
 @admin_required
 def shop_dashboard():
+    feed_version = ChangeFeed.current_version()
     orders_in_production = Order.query.filter(
         Order.status == 'in_production'
     ).order_by(Order.due_date.asc()).all()
@@ -58,12 +80,14 @@ def shop_dashboard():
     return render_template('dashboards/shop_dashboard.html',
                          orders_in_production=orders_in_production,
                          orders_ready=orders_ready,
+                         feed_version=feed_version,
                          title="Dashboard Magasin")
 
 @dashboard_bp.route('/ingredients-alerts')
 @login_required
 @admin_required
 def ingredients_alerts():
+    feed_version = ChangeFeed.current_version()
     low_stock_ingredients = Product.query.filter(
         Product.product_type == 'ingredient',
         Product.quantity_in_stock <= 5
@@ -75,6 +99,7 @@ def ingredients_alerts():
     return render_template('dashboards/ingredients_alerts.html',
                          low_stock_ingredients=low_stock_ingredients,
                          out_of_stock_ingredients=out_of_stock_ingredients,
+                         feed_version=feed_version,
                          title="Alertes Ingrédients")
 
 @dashboard_bp.route('/admin')
@@ -102,15 +127,45 @@ def admin_dashboard():
 @login_required
 @admin_required
 def sales_dashboard():
-    current_month = datetime.now().replace(day=1)
-    delivered_orders = Order.query.filter(
-        Order.status == 'delivered',
-        Order.updated_at >= current_month
-    ).count()
+    today = datetime.utcnow().date()
+    month_totals = SalesRollup.totals(today.replace(day=1), today)
     return render_template('dashboards/sales_dashboard.html',
-                         delivered_orders=delivered_orders,
+                         delivered_orders=month_totals['orders_delivered'],
+                         month_totals=month_totals,
                          title="Dashboard Ventes")
 
+@dashboard_bp.route('/api/sales-daily')
+@login_required
+@admin_required
+def sales_daily_api():
+    """
+    Cumuls ventes / production lus dans les tables journalières.
+    Paramètres : from, to (AAAA-MM-JJ, 30 derniers jours par défaut),
+    group=day|product|category.
+    """
+    today = datetime.utcnow().date()
+    try:
+        end = parse_day(request.args.get('to'), today)
+        start = parse_day(request.args.get('from'), end - timedelta(days=29))
+    except ValueError:
+        return jsonify({'error': 'Date invalide (format attendu : AAAA-MM-JJ)'}), 400
+    if start > end:
+        return jsonify({'error': 'La période est vide'}), 400
+
+    group = request.args.get('group', 'day')
+    if group == 'product':
+        rows = SalesRollup.by_product(start, end)
+    elif group == 'category':
+        rows = SalesRollup.by_category(start, end)
+    else:
+        rows = SalesRollup.daily(start, end)
+    return jsonify({
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'totals': SalesRollup.totals(start, end),
+        'rows': rows
+    })
+
 @dashboard_bp.route('/api/orders-stats')
 @login_required
 @admin_required
@@ -121,4 +176,90 @@ def orders_stats_api():
         'ready_at_shop': Order.query.filter_by(status='ready_at_shop').count(),
         'delivered': Order.query.filter_by(status='delivered').count()
     }
-    return jsonify(stats)
\ No newline at end of file
+    return jsonify(stats)
+
+
+@dashboard_bp.route('/api/changes')
+@login_required
+@admin_required
+def changes_api():
+    """
+    Changements depuis une version du flux.
+    Paramètres : since (version connue de l'écran), view=production|shop pour
+    recevoir le HTML des cartes de commande modifiées.
+    Sans changement, une seule lecture du compteur.
+    """
+    try:
+        since = int(request.args.get('since', ''))
+    except ValueError:
+        return jsonify({'version': ChangeFeed.current_version(), 'reset': True})
+
+    feed = ChangeFeed.changes(since)
+    payload = {
+        'version': feed['version'],
+        'reset': feed['reset'],
+        'orders_changed': bool(feed['orders']),
+        'stock_changed': bool(feed['stock']),
+        'cards': [],
+        'removed': [],
+    }
+
+    view = CARD_VIEWS.get(request.args.get('view'))
+    if view and feed['orders'] and not feed['reset']:
+        order_ids = feed['orders']
+        if None in order_ids:
+            # Modification non détaillée : l'écran se recharge
+            payload['reset'] = True
+            return jsonify(payload)
+        template, sections = view
+        orders = Order.query.filter(
+            Order.id.in_(order_ids),
+            Order.status.in_(list(sections))
+        ).all()
+        payload['cards'] = [{
+            'id': order.id,
+            'section': sections[order.status],
+            'due': order.due_date.isoformat() if order.due_date else None,
+            'html': render_template(template, order=order),
+        } for order in orders]
+        payload['removed'] = sorted(order_ids - {order.id for order in orders})
+    return jsonify(payload)
+
+@dashboard_bp.route('/api/changes/stream')
+@login_required
+@admin_required
+def changes_stream():
+    """
+    Flux Server-Sent Events : un événement `change` (id = version) à chaque
+    nouvelle version du flux. Le client appelle ensuite /api/changes.
+    La connexion est fermée après STREAM_MAX_SECONDS ; EventSource se
+    reconnecte avec Last-Event-ID.
+    """
+    try:
+        known = int(request.headers.get('Last-Event-ID') or request.args.get('since', ''))
+    except ValueError:
+        known = None
+    current = ChangeFeed.current_version()
+    if known is None:
+        known = current
+    # Aucune connexion de la session n'est gardée pendant le flux
+    db.session.close()
+
+    def generate(current, known):
+        yield f"retry: {STREAM_RETRY_MS}\n\n"
+        started = last_sent = time.monotonic()
+        while True:
+            if current != known:
+                known = current
+                last_sent = time.monotonic()
+                yield f"id: {current}\nevent: change\ndata: {current}\n\n"
+            elif time.monotonic() - last_sent >= STREAM_KEEPALIVE_SECONDS:
+                last_sent = time.monotonic()
+                yield ": keepalive\n\n"
+            if time.monotonic() - started >= STREAM_MAX_SECONDS:
+                return
+            current = ChangeFeed.wait(STREAM_POLL_SECONDS)
+
+    return Response(stream_with_context(generate(current, known)),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
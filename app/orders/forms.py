@@ -12,10 +12,29 @@ from wtforms import (
 )
 from wtforms.validators import DataRequired, Optional, Length
 from models import Product
+from app.products.catalogue import ProductCatalogue
 
 def get_sellable_products():
     return Product.query.filter_by(product_type='finished').order_by(Product.name).all()
 
+def _priced_product_choices(entries):
+    return (('', '-- Choisir un produit --'),) + tuple(
+        (str(entry.id), f"{entry.name} ({entry.price:.2f} DA / {entry.unit})")
+        for entry in entries if entry.product_type == 'finished'
+    )
+
+def _production_product_choices(entries):
+    return (('', '-- Choisir un produit --'),) + tuple(
+        (str(entry.id), f"{entry.name} (Unité: {entry.unit})")
+        for entry in entries if entry.product_type == 'finished'
+    )
+
+def sellable_product_choices(with_price=True):
+    """Choix des produits finis, partagés par tous les formulaires (catalogue en mémoire)."""
+    if with_price:
+        return ProductCatalogue.choices('orders.sellable_priced', _priced_product_choices)
+    return ProductCatalogue.choices('orders.sellable_unit', _production_product_choices)
+
 class OrderItemForm(FlaskForm):
     class Meta:
         csrf = False
@@ -109,13 +128,7 @@ class OrderForm(FlaskForm):
 
     def __init__(self, *args, **kwargs):
         super(OrderForm, self).__init__(*args, **kwargs)
-        products = get_sellable_products()
-        product_choices = [('', '-- Choisir un produit --')]
-        for product in products:
-            price = product.price or 0.0
-            label = f"{product.name} ({price:.2f} DA / {product.unit})"
-            product_choices.append((str(product.id), label))
-        
+        product_choices = sellable_product_choices()
         for item_form in self.items:
             item_form.product.choices = product_choices
 
@@ -194,13 +207,7 @@ class CustomerOrderForm(FlaskForm):
 
     def __init__(self, *args, **kwargs):
         super(CustomerOrderForm, self).__init__(*args, **kwargs)
-        products = get_sellable_products()
-        product_choices = [('', '-- Choisir un produit --')]
-        for product in products:
-            price = product.price or 0.0
-            label = f"{product.name} ({price:.2f} DA / {product.unit})"
-            product_choices.append((str(product.id), label))
-        
+        product_choices = sellable_product_choices()
         for item_form in self.items:
             item_form.product.choices = product_choices
 
@@ -252,12 +259,7 @@ class ProductionOrderForm(FlaskForm):
 
     def __init__(self, *args, **kwargs):
         super(ProductionOrderForm, self).__init__(*args, **kwargs)
-        products = get_sellable_products()
-        product_choices = [('', '-- Choisir un produit --')]
-        for product in products:
-            label = f"{product.name} (Unité: {product.unit})"
-            product_choices.append((str(product.id), label))
-        
+        product_choices = sellable_product_choices(with_price=False)
         for item_form in self.items:
             item_form.product.choices = product_choices
 
@@ -0,0 +1,219 @@
+"""
+Comptabilisation groupée de la production
+Module: app/orders/production.py
+Auteur: ERP Fée Maison
+
+Calcule le vecteur complet de consommation d'ingrédients pour une ou
+plusieurs commandes, puis le passe au journal de stock (StockLedger.post_batch :
+UPDATE en masse stock = stock - :delta et insertion groupée des StockMovement).
+Toute une fournée peut ainsi être finalisée dans une seule transaction.
+Les ingrédients consommés sortent de leurs lots premier-périmé-premier-sorti
+(LotTracker, appelé par le journal pour chaque sortie).
+"""
+
+from collections import defaultdict
+
+from sqlalchemy import bindparam, case, func, update
+
+from extensions import db
+from app.orders.availability import load_recipe_lines
+from app.products.catalogue import ProductCatalogue
+from app.recipes.costing import refresh_costs_for_products
+from app.stock.ledger import StockLedger
+from app.stock.models import StockMovementType
+from app.stock.stock_manager import StockLocationManager
+
+
+class ProductionPostingEngine:
+    """
+    Finalise la production d'une liste de commandes en une passe.
+    L'appelant reste responsable du commit / rollback de la session.
+    """
+
+    FINISHED_LOCATION = 'comptoir'
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+
+    def post_orders(self, order_ids, employee_ids=None):
+        """
+        Décrémente les ingrédients, incrémente les produits finis et passe les
+        commandes au statut suivant.
+
+        :param order_ids: Identifiants des commandes à finaliser.
+        :param employee_ids: Employés de production à assigner (optionnel).
+        :return: dict {'posted': [Order], 'skipped': [Order], 'movements': int}.
+        """
+        from models import Order, OrderItem, Product
+
+        orders = Order.query.filter(Order.id.in_(list(order_ids))).order_by(Order.id).all()
+        claimed = self._claim_orders([order.id for order in orders])
+        posted = [order for order in orders if order.id in claimed]
+        skipped = [order for order in orders if order.id not in claimed]
+        for order in skipped:
+            # Statut relu : une autre requête a pu finaliser la commande entre-temps
+            db.session.expire(order, ['status'])
+        if not posted:
+            return {'posted': [], 'skipped': skipped, 'movements': 0}
+
+        posted_ids = [order.id for order in posted]
+        items = db.session.query(OrderItem.order_id, OrderItem.product_id, OrderItem.quantity)\
+            .filter(OrderItem.order_id.in_(posted_ids)).all()
+        recipe_lines = load_recipe_lines({product_id for _, product_id, _ in items})
+
+        # Vecteurs de production et de consommation par commande
+        produced = defaultdict(float)   # (order_id, finished_id) -> quantité
+        consumed = defaultdict(float)   # (order_id, ingredient_id, labo_key) -> quantité
+        for order_id, product_id, quantity in items:
+            lines = recipe_lines.get(product_id)
+            if not lines:
+                continue
+            produced[(order_id, product_id)] += float(quantity)
+            for ingredient_id, labo_key, qty_per_unit in lines:
+                consumed[(order_id, ingredient_id, labo_key)] += qty_per_unit * float(quantity)
+
+        product_ids = {key[1] for key in produced} | {key[1] for key in consumed}
+        ledger = StockLedger(self.user_id)
+        snapshot = ledger.lock_balances(product_ids, Product.cost_price)
+
+        movements = self._apply(ledger, produced, consumed, recipe_lines, snapshot)
+
+        self._finalize_orders(posted, employee_ids or [])
+        return {'posted': posted, 'skipped': skipped, 'movements': movements}
+
+    # ------------------------------------------------------------------ #
+
+    @staticmethod
+    def _claim_orders(order_ids):
+        """
+        Passe au statut final, en une instruction, les commandes encore en
+        production : deux finalisations concurrentes (double clic, fournées
+        qui se recouvrent) ne comptabilisent pas deux fois la même commande.
+
+        :return: Identifiants des commandes réservées.
+        """
+        from models import Order
+
+        if not order_ids:
+            return set()
+        table = Order.__table__
+        final_status = case((table.c.order_type == 'counter_production_request', 'completed'),
+                            else_='ready_at_shop')
+        return set(db.session.execute(
+            update(table)
+            .where(table.c.id.in_(order_ids), table.c.status == 'in_production')
+            .values(status=final_status)
+            .returning(table.c.id)
+        ).scalars().all())
+
+    def _apply(self, ledger, produced, consumed, recipe_lines, snapshot):
+        """Construit les mouvements, les passe au journal puis met à jour les valeurs."""
+        def unit_cost(product_id):
+            row = snapshot.get(product_id)
+            return float(row.cost_price or 0) if row is not None else 0.0
+
+        entries = []
+        finished_values = defaultdict(float)
+        finished_quantities = defaultdict(float)
+
+        for (order_id, ingredient_id, labo_key), quantity in consumed.items():
+            cost = unit_cost(ingredient_id)
+            entries.append({
+                'product_id': ingredient_id,
+                'location': labo_key,
+                'quantity': -quantity,
+                'movement_type': StockMovementType.PRODUCTION,
+                'unit_cost': cost,
+                'order_id': order_id,
+                'reason': f"Production commande #{order_id} - Consommation"
+            })
+
+        for (order_id, finished_id), quantity in produced.items():
+            # La valeur du produit fini est celle des ingrédients consommés
+            value = sum(
+                qty_per_unit * quantity * unit_cost(ingredient_id)
+                for ingredient_id, _, qty_per_unit in recipe_lines.get(finished_id, ())
+            )
+            entries.append({
+                'product_id': finished_id,
+                'location': self.FINISHED_LOCATION,
+                'quantity': quantity,
+                'movement_type': StockMovementType.PRODUCTION,
+                'unit_cost': value / quantity if quantity else 0.0,
+                'order_id': order_id,
+                'reason': f"Production commande #{order_id} - Entrée comptoir"
+            })
+            finished_values[finished_id] += value
+            finished_quantities[finished_id] += quantity
+
+        movement_rows = ledger.post_batch(entries, balances=snapshot)
+
+        # Valeur sortie calculée sur la quantité réellement appliquée (plancher à zéro)
+        ingredient_values = defaultdict(float)
+        for row in movement_rows:
+            if row['quantity'] < 0:
+                ingredient_values[row['product_id']] -= row['quantity'] * row['unit_cost']
+        self._bulk_update_values(ingredient_values, finished_values, finished_quantities)
+
+        # Le PMP des produits finis a changé : recettes qui les utilisent
+        refresh_costs_for_products(finished_values)
+
+        ledger.expire_products(snapshot)
+        return len(movement_rows)
+
+    @staticmethod
+    def _bulk_update_values(ingredient_values, finished_values, finished_quantities):
+        """Met à jour total_stock_value et, pour les produits finis, le PMP."""
+        from models import Product
+
+        table = Product.__table__
+        tsv = func.coalesce(table.c.total_stock_value, 0)
+
+        if ingredient_values:
+            stmt = update(table)\
+                .where(table.c.id == bindparam('b_id'))\
+                .values(total_stock_value=tsv - bindparam('b_value'))
+            db.session.execute(stmt, [
+                {'b_id': product_id, 'b_value': value}
+                for product_id, value in ingredient_values.items()
+            ])
+
+        if finished_values:
+            # Les colonnes de stock ont déjà été mises à jour par StockLedger.post_batch
+            total_qty = sum(func.coalesce(table.c[col], 0) for col in StockLocationManager.LOCATION_COLUMNS.values())
+            new_value = tsv + bindparam('b_value')
+            stmt = update(table)\
+                .where(table.c.id == bindparam('b_id'))\
+                .values(total_stock_value=new_value,
+                        cost_price=case((total_qty > 0, new_value / total_qty), else_=table.c.cost_price))
+            db.session.execute(stmt, [
+                {'b_id': product_id, 'b_value': value}
+                for product_id, value in finished_values.items()
+                if finished_quantities[product_id] > 0
+            ])
+            # Le PMP fait partie du catalogue des formulaires
+            ProductCatalogue.mark_changed(db.session)
+
+    @staticmethod
+    def _finalize_orders(orders, employee_ids):
+        """
+        Reporte sur les objets de la session le statut final (déjà écrit par
+        _claim_orders) et assigne les employés.
+        """
+        from app.employees.models import Employee
+
+        employees = []
+        if employee_ids:
+            employees = Employee.query.filter(
+                Employee.id.in_([int(emp_id) for emp_id in employee_ids]),
+                Employee.is_active == True
+            ).all()
+
+        for order in orders:
+            if order.order_type == 'counter_production_request':
+                order.status = 'completed'
+            else:
+                order.status = 'ready_at_shop'
+            for employee in employees:
+                order.assign_producer(employee)
+
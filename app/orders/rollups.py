@@ -0,0 +1,294 @@
+"""
+Cumuls journaliers des ventes et de la production
+Module: app/orders/rollups.py
+Auteur: ERP Fée Maison
+
+Les transitions de statut des commandes écrivent dans le journal de stock :
+la livraison crée les mouvements VENTE, la réception / fin de production les
+mouvements PRODUCTION (dont la valeur est le coût des ingrédients consommés).
+SalesRollup lit ces mouvements pour tenir deux tables de cumul :
+daily_sales_stats (un jour = une ligne) et daily_product_stats (jour × produit,
+catégorie dénormalisée). Les tableaux de bord lisent O(jours) lignes au lieu
+de parcourir les commandes.
+
+Le rafraîchissement est incrémental : seuls les jours touchés par des
+mouvements postérieurs au dernier filigrane (plus le jour courant, pour les
+transactions validées en retard) sont recalculés, et chaque jour est
+recalculé entièrement, ce qui rend l'opération idempotente. Il est lancé par
+la commande `flask rollup-sales`, à planifier (cron) ; les tableaux de bord
+ne font que lire les cumuls.
+"""
+
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from sqlalchemy import func
+
+from extensions import db
+from app.stock.models import StockMovement, StockMovementType
+
+
+def _empty_stats():
+    return {
+        'quantity_sold': 0.0,
+        'revenue': Decimal('0'),
+        'quantity_produced': 0.0,
+        'ingredient_cost': 0.0,
+    }
+
+
+class SalesRollup:
+    """Maintenance et lecture des cumuls journaliers ventes / production."""
+
+    WATERMARK = 'daily_sales'
+    SOURCE_TYPES = (StockMovementType.VENTE, StockMovementType.PRODUCTION)
+
+    # ------------------------------------------------------------------ #
+    # Maintenance
+    # ------------------------------------------------------------------ #
+
+    @classmethod
+    def refresh(cls, today=None):
+        """
+        Recalcule les jours touchés depuis le dernier rafraîchissement.
+        L'appelant reste responsable du commit.
+
+        :return: Nombre de jours recalculés.
+        """
+        from models import RollupWatermark
+
+        today = today or datetime.utcnow().date()
+        watermark = db.session.query(RollupWatermark)\
+            .filter(RollupWatermark.name == cls.WATERMARK)\
+            .with_for_update().first()
+        if watermark is None:
+            watermark = RollupWatermark(name=cls.WATERMARK, last_movement_id=0)
+            db.session.add(watermark)
+
+        last_id = db.session.query(func.max(StockMovement.id)).scalar() or 0
+        first_touched = None
+        if last_id > watermark.last_movement_id:
+            first_touched = db.session.query(func.min(StockMovement.created_at)).filter(
+                StockMovement.id > watermark.last_movement_id,
+                StockMovement.id <= last_id,
+                StockMovement.movement_type.in_(cls.SOURCE_TYPES),
+                StockMovement.order_id.isnot(None)
+            ).scalar()
+
+        start = min(first_touched.date(), today) if first_touched else today
+        days = cls.rebuild(start, today)
+
+        watermark.last_movement_id = last_id
+        watermark.refreshed_at = datetime.utcnow()
+        return days
+
+    @classmethod
+    def rebuild(cls, start, end):
+        """
+        Recalcule entièrement les jours de start à end inclus depuis le journal.
+        L'appelant reste responsable du commit.
+
+        :return: Nombre de jours recalculés.
+        """
+        from models import DailySalesStats, DailyProductStats, OrderItem, Product
+
+        range_start = datetime.combine(start, time.min)
+        range_end = datetime.combine(end + timedelta(days=1), time.min)
+
+        product_stats = defaultdict(_empty_stats)   # (jour, product_id) -> cumuls
+        categories = {}
+        day_stats = defaultdict(_empty_stats)
+        day_orders = defaultdict(set)
+
+        # Ventes : une commande livrée = ses mouvements VENTE ; les quantités
+        # et montants viennent des lignes de commande (le mouvement peut avoir
+        # été plafonné à zéro si le comptoir était vide).
+        deliveries = db.session.query(
+            StockMovement.order_id.label('order_id'),
+            func.min(StockMovement.created_at).label('delivered_at')
+        ).filter(
+            StockMovement.movement_type == StockMovementType.VENTE,
+            StockMovement.order_id.isnot(None),
+            StockMovement.created_at >= range_start,
+            StockMovement.created_at < range_end
+        ).group_by(StockMovement.order_id).subquery()
+
+        sales = db.session.query(
+            deliveries.c.order_id,
+            deliveries.c.delivered_at,
+            OrderItem.product_id,
+            Product.category_id,
+            func.sum(OrderItem.quantity),
+            func.sum(OrderItem.quantity * OrderItem.unit_price)
+        ).join(OrderItem, OrderItem.order_id == deliveries.c.order_id)\
+         .join(Product, Product.id == OrderItem.product_id)\
+         .group_by(deliveries.c.order_id, deliveries.c.delivered_at,
+                   OrderItem.product_id, Product.category_id).all()
+
+        for order_id, delivered_at, product_id, category_id, quantity, amount in sales:
+            day = delivered_at.date()
+            quantity = float(quantity or 0)
+            amount = Decimal(amount or 0).quantize(Decimal('0.01'))
+            stats = product_stats[(day, product_id)]
+            stats['quantity_sold'] += quantity
+            stats['revenue'] += amount
+            categories[product_id] = category_id
+            day_stats[day]['quantity_sold'] += quantity
+            day_stats[day]['revenue'] += amount
+            day_orders[day].add(order_id)
+
+        # Production : entrées PRODUCTION des produits finis, valorisées au
+        # coût des ingrédients consommés
+        production = db.session.query(
+            StockMovement.created_at,
+            StockMovement.product_id,
+            Product.category_id,
+            StockMovement.quantity,
+            StockMovement.total_value
+        ).join(Product, Product.id == StockMovement.product_id).filter(
+            StockMovement.movement_type == StockMovementType.PRODUCTION,
+            StockMovement.order_id.isnot(None),
+            StockMovement.quantity > 0,
+            StockMovement.created_at >= range_start,
+            StockMovement.created_at < range_end
+        ).all()
+
+        for created_at, product_id, category_id, quantity, value in production:
+            day = created_at.date()
+            stats = product_stats[(day, product_id)]
+            stats['quantity_produced'] += float(quantity or 0)
+            stats['ingredient_cost'] += float(value or 0)
+            categories[product_id] = category_id
+            day_stats[day]['quantity_produced'] += float(quantity or 0)
+            day_stats[day]['ingredient_cost'] += float(value or 0)
+
+        # Remplacement des jours recalculés
+        for model in (DailyProductStats, DailySalesStats):
+            table = model.__table__
+            db.session.execute(table.delete().where(table.c.day >= start, table.c.day <= end))
+
+        now = datetime.utcnow()
+        if product_stats:
+            db.session.execute(DailyProductStats.__table__.insert(), [
+                dict(stats, day=day, product_id=product_id, category_id=categories.get(product_id))
+                for (day, product_id), stats in product_stats.items()
+            ])
+        if day_stats:
+            db.session.execute(DailySalesStats.__table__.insert(), [
+                dict(stats, day=day, orders_delivered=len(day_orders[day]), updated_at=now)
+                for day, stats in day_stats.items()
+            ])
+        return (end - start).days + 1
+
+    # ------------------------------------------------------------------ #
+    # Lecture
+    # ------------------------------------------------------------------ #
+
+    @staticmethod
+    def daily(start, end):
+        """
+        Cumuls jour par jour (jours sans activité inclus, à zéro).
+
+        :return: Liste de dicts triée par jour.
+        """
+        from models import DailySalesStats
+
+        rows = {
+            row.day: row for row in DailySalesStats.query.filter(
+                DailySalesStats.day >= start, DailySalesStats.day <= end
+            )
+        }
+        result = []
+        day = start
+        while day <= end:
+            row = rows.get(day)
+            result.append({
+                'day': day.isoformat(),
+                'orders_delivered': row.orders_delivered if row else 0,
+                'quantity_sold': float(row.quantity_sold) if row else 0.0,
+                'revenue': float(row.revenue) if row else 0.0,
+                'quantity_produced': float(row.quantity_produced) if row else 0.0,
+                'ingredient_cost': float(row.ingredient_cost) if row else 0.0,
+            })
+            day += timedelta(days=1)
+        return result
+
+    @staticmethod
+    def totals(start, end):
+        """Somme des cumuls journaliers sur la période."""
+        from models import DailySalesStats
+
+        row = db.session.query(
+            func.coalesce(func.sum(DailySalesStats.orders_delivered), 0),
+            func.coalesce(func.sum(DailySalesStats.quantity_sold), 0),
+            func.coalesce(func.sum(DailySalesStats.revenue), 0),
+            func.coalesce(func.sum(DailySalesStats.quantity_produced), 0),
+            func.coalesce(func.sum(DailySalesStats.ingredient_cost), 0)
+        ).filter(DailySalesStats.day >= start, DailySalesStats.day <= end).one()
+        return {
+            'orders_delivered': int(row[0]),
+            'quantity_sold': float(row[1]),
+            'revenue': float(row[2]),
+            'quantity_produced': float(row[3]),
+            'ingredient_cost': float(row[4]),
+        }
+
+    @staticmethod
+    def by_product(start, end, limit=None):
+        """Cumuls par produit sur la période, triés par CA décroissant."""
+        from models import DailyProductStats, Product
+
+        revenue = func.sum(DailyProductStats.revenue)
+        query = db.session.query(
+            DailyProductStats.product_id,
+            Product.name,
+            func.sum(DailyProductStats.quantity_sold),
+            revenue,
+            func.sum(DailyProductStats.quantity_produced),
+            func.sum(DailyProductStats.ingredient_cost)
+        ).join(Product, Product.id == DailyProductStats.product_id)\
+         .filter(DailyProductStats.day >= start, DailyProductStats.day <= end)\
+         .group_by(DailyProductStats.product_id, Product.name)\
+         .order_by(revenue.desc(), Product.name)
+        if limit:
+            query = query.limit(limit)
+        return [{
+            'product_id': product_id,
+            'product_name': name,
+            'quantity_sold': float(sold or 0),
+            'revenue': float(amount or 0),
+            'quantity_produced': float(produced or 0),
+            'ingredient_cost': float(cost or 0),
+        } for product_id, name, sold, amount, produced, cost in query.all()]
+
+    @staticmethod
+    def by_category(start, end):
+        """Cumuls par catégorie sur la période, triés par CA décroissant."""
+        from models import DailyProductStats, Category
+
+        revenue = func.sum(DailyProductStats.revenue)
+        rows = db.session.query(
+            DailyProductStats.category_id,
+            Category.name,
+            func.sum(DailyProductStats.quantity_sold),
+            revenue,
+            func.sum(DailyProductStats.quantity_produced),
+            func.sum(DailyProductStats.ingredient_cost)
+        ).outerjoin(Category, Category.id == DailyProductStats.category_id)\
+         .filter(DailyProductStats.day >= start, DailyProductStats.day <= end)\
+         .group_by(DailyProductStats.category_id, Category.name)\
+         .order_by(revenue.desc()).all()
+        return [{
+            'category_id': category_id,
+            'category_name': name or 'Sans catégorie',
+            'quantity_sold': float(sold or 0),
+            'revenue': float(amount or 0),
+            'quantity_produced': float(produced or 0),
+            'ingredient_cost': float(cost or 0),
+        } for category_id, name, sold, amount, produced, cost in rows]
+
+
+def parse_day(value, default):
+    """Lit une date AAAA-MM-JJ (paramètre d'URL) ; lève ValueError si invalide."""
+    return date.fromisoformat(value) if value else default
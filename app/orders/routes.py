@@ -3,6 +3,9 @@ from flask_login import login_required, current_user
 from extensions import db
 from models import Order, OrderItem, Product, Recipe, RecipeIngredient
 from .forms import OrderForm, OrderStatusForm, CustomerOrderForm, ProductionOrderForm
+from .availability import check_order_availability
+from .calendar import CalendarFeed, InvalidWindowError
+from app.products.search import ProductSearch
 from decorators import admin_required
 from decimal import Decimal
 from datetime import datetime, timezone
@@ -10,63 +13,18 @@ from datetime import datetime, timezone
 orders = Blueprint('orders', __name__)
 
 
-# ### DEBUT DU BLOC A AJOUTER ###
 def check_stock_availability(form_items):
     """
     Vérifie la disponibilité des ingrédients pour une liste d'articles de commande.
+    Les besoins sont agrégés par (ingrédient, labo) sur toute la commande.
     Retourne True si tout est disponible, False sinon, et flashe des messages d'erreur.
     """
-    print("\n--- DEBUT DE LA VERIFICATION DE STOCK ---")
-    is_sufficient = True
-    for item_data in form_items:
-        product_id = item_data.get('product')
-        quantity_ordered = float(item_data.get('quantity', 0))
-
-        if product_id and quantity_ordered > 0:
-            product_fini = Product.query.get(int(product_id))
-            print(f"\n[+] Vérification pour le produit fini : {product_fini.name} (Qté: {quantity_ordered})")
-
-            if product_fini and product_fini.recipe_definition:
-                recipe = product_fini.recipe_definition
-                labo_key = recipe.production_location
-                labo_name = "Labo A (Stock Magasin)" if labo_key == 'ingredients_magasin' else "Labo B (Stock Local)"
-                print(f"    -> Recette trouvée: '{recipe.name}'. Doit être produit dans: {labo_name} (colonne: {labo_key})")
-
-                for ingredient_in_recipe in recipe.ingredients.all():
-                    # --- DEBUT DE LA CORRECTION ---
-                    
-                    # 1. Calcul de la quantité d'ingrédient nécessaire pour UNE SEULE unité de produit fini
-                    # Ex: (4000g de semoule) / (12 galettes) = 333.33g de semoule par galette
-                    qty_per_unit = float(ingredient_in_recipe.quantity_needed) / float(recipe.yield_quantity)
-                    
-                    # 2. Calcul du besoin total pour la commande actuelle
-                    # Ex: (333.33g par galette) * (20 galettes commandées) = 6666.6g
-                    needed_qty = qty_per_unit * quantity_ordered
-                    
-                    # --- FIN DE LA CORRECTION ---
-
-                    ingredient_product = ingredient_in_recipe.product
-                    
-                    print(f"    - Ingrédient requis: {ingredient_product.name}")
-                    print(f"      - Quantité par unité de recette: {qty_per_unit:.3f}g") # Log mis à jour
-                    print(f"      - Quantité totale nécessaire pour la commande: {needed_qty:.3f}g") # Log mis à jour
-
-                    available_stock = ingredient_product.get_stock_by_location(labo_key)
-                    print(f"      - Stock disponible dans '{labo_key}': {available_stock or 0:.3f}g")
-                    
-                    if not available_stock or available_stock < needed_qty:
-                        is_sufficient = False
-                        print(f"      - !!! STOCK INSUFFISANT !!!")
-                        flash(f"Stock insuffisant pour '{ingredient_product.name}' dans {labo_name}. "
-                              f"Besoin: {needed_qty:.3f}g, Dispo: {available_stock or 0:.3f}g", 'danger')
-                    else:
-                        print(f"      - Stock OK.")
-            else:
-                print(f"    -> Pas de recette trouvée pour ce produit. Vérification ignorée.")
-    
-    print(f"\n--- FIN DE LA VERIFICATION. Résultat final : {is_sufficient} ---")
-    return is_sufficient
-# ### FIN DU BLOC A AJOUTER ###
+    shortages = check_order_availability(form_items)
+    for shortage in shortages:
+        labo_name = "Labo A (Stock Magasin)" if shortage['location'] == 'ingredients_magasin' else "Labo B (Stock Local)"
+        flash(f"Stock insuffisant pour '{shortage['product_name']}' dans {labo_name}. "
+              f"Besoin: {shortage['needed']:.3f}g, Dispo: {shortage['available']:.3f}g", 'danger')
+    return not shortages
 
 
 @orders.route('/customer/new', methods=['GET', 'POST'])
@@ -218,7 +176,10 @@ def list_production_orders():
 @admin_required
 def api_products():
     query = request.args.get('q', '')
-    products = Product.query.filter(Product.product_type == 'finished', Product.name.ilike(f'%{query}%')).order_by(Product.name).limit(20).all()
+    if query:
+        products = ProductSearch.search(query, product_types=('finished',), limit=20)
+    else:
+        products = Product.query.filter(Product.product_type == 'finished').order_by(Product.name).limit(20).all()
     results = []
     for product in products:
         price = float(product.price or 0.0)
@@ -309,9 +270,22 @@ def edit_order_status(order_id):
 @login_required
 @admin_required
 def orders_calendar():
-    orders = Order.query.filter(Order.due_date.isnot(None)).all()
-    events = []
-    for order in orders:
-        if order.should_appear_in_calendar():
-            events.append({'id': order.id, 'title': f"#{order.id} - {order.customer_name or 'Production'}", 'start': order.due_date.isoformat(), 'url': url_for('orders.view_order', order_id=order.id), 'backgroundColor': '#ffc107' if order.status == 'in_production' else '#6c757d'})
-    return render_template('orders/orders_calendar.html', events=events, title="Calendrier des Commandes")
\ No newline at end of file
+    # Les événements sont chargés par FullCalendar, fenêtre par fenêtre
+    return render_template('orders/orders_calendar.html',
+                           events_url=url_for('orders.orders_calendar_events'),
+                           title="Calendrier des Commandes")
+
+@orders.route('/calendar/events')
+@login_required
+@admin_required
+def orders_calendar_events():
+    """Événements de la fenêtre FullCalendar (?start=...&end=...), JSON avec ETag."""
+    try:
+        feed = CalendarFeed.from_args(request.args)
+    except InvalidWindowError as e:
+        return jsonify({'error': str(e)}), 400
+    payload, etag = feed.render()
+    response = current_app.response_class(payload, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
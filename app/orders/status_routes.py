@@ -9,6 +9,7 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
 from flask_login import login_required, current_user
 from models import Order, db
 from app.employees.models import Employee
+from app.orders.production import ProductionPostingEngine
 from decorators import admin_required
 
 status_bp = Blueprint('status', __name__)
@@ -22,9 +23,6 @@ def change_status_to_ready(order_id):
     Change le statut, décrémente la quantité ET la valeur des ingrédients, 
     et incrémente la quantité ET la valeur du stock du produit fini.
     """
-    
-    from models import Product, Recipe, RecipeIngredient
-
     order = Order.query.get_or_404(order_id)
     
     if not order.can_be_received_at_shop():
@@ -39,53 +37,21 @@ def change_status_to_ready(order_id):
                               new_status='ready_at_shop'))
     
     try:
-        # ### DEBUT DE LA LOGIQUE CORRIGÉE ###
-        
-        for order_item in order.items:
-            product_fini = order_item.product
-            
-            if product_fini and product_fini.recipe_definition:
-                recipe = product_fini.recipe_definition
-                labo_key = recipe.production_location
-                
-                for ingredient_in_recipe in recipe.ingredients.all():
-                    ingredient_product = ingredient_in_recipe.product
-                    
-                    qty_per_unit = float(ingredient_in_recipe.quantity_needed) / float(recipe.yield_quantity)
-                    quantity_to_decrement = qty_per_unit * float(order_item.quantity)
-                    
-                    # --- NOUVELLE LOGIQUE DE VALORISATION ---
-                    # 1. On récupère le PMP (cost_price) de l'ingrédient
-                    cost_per_base_unit = float(ingredient_product.cost_price or 0.0)
-                    
-                    # 2. On calcule la valeur du stock d'ingrédient qui a été consommé
-                    value_to_decrement = quantity_to_decrement * cost_per_base_unit
-                    
-                    # 3. On met à jour la quantité ET la valeur du stock de l'ingrédient
-                    ingredient_product.update_stock_by_location(labo_key, -quantity_to_decrement)
-                    ingredient_product.total_stock_value = float(ingredient_product.total_stock_value or 0.0) - value_to_decrement
-                    
-                    print(f"DECREMENT: {quantity_to_decrement:.2f}g de {ingredient_product.name} (Valeur: {value_to_decrement:.2f} DA)")
-        
-        # On appelle la méthode qui incrémente le stock ET la valeur du produit fini
-        order._increment_shop_stock_with_value()
+        # Consommation des ingrédients, entrée des produits finis et mouvements
+        # de stock sont comptabilisés en masse par le moteur de production.
+        result = ProductionPostingEngine(current_user.id).post_orders([order.id], employee_ids)
+        if not result['posted']:
+            # Finalisée entre-temps par une autre requête
+            db.session.rollback()
+            flash(f"La commande #{order.id} ne peut pas être finalisée. Statut actuel: {order.get_status_display()}", 'error')
+            return redirect(url_for('dashboard.shop_dashboard'))
+        db.session.commit()
 
-        # Décision sur le statut final
         if order.order_type == 'counter_production_request':
-            order.status = 'completed'
             final_message = f'Ordre de production #{order.id} terminé. Stocks mis à jour.'
         else:
-            order.status = 'ready_at_shop'
             final_message = f'Commande client #{order.id} prête pour le client. Stocks mis à jour.'
         
-        # Assignation des employés
-        for employee_id in employee_ids:
-            employee = Employee.query.get(employee_id)
-            if employee and employee.is_active:
-                order.assign_producer(employee)
-        
-        db.session.commit()
-        
         producers_names = ", ".join([emp.name for emp in order.produced_by])
         flash(f'{final_message} Produit par: {producers_names}', 'success')
             
@@ -97,6 +63,43 @@ def change_status_to_ready(order_id):
     return redirect(url_for('dashboard.shop_dashboard'))
 
 
+@status_bp.route('/change-status-to-ready/batch', methods=['POST'])
+@login_required
+@admin_required
+def change_status_to_ready_batch():
+    """
+    Finalise toute une fournée de commandes dans une seule transaction.
+    Attend 'order_ids[]' et 'employee_ids[]' dans le formulaire.
+    """
+    order_ids = [int(order_id) for order_id in request.form.getlist('order_ids[]') if order_id.isdigit()]
+    employee_ids = request.form.getlist('employee_ids[]')
+
+    if not order_ids:
+        flash("Aucune commande sélectionnée.", 'warning')
+        return redirect(url_for('dashboard.shop_dashboard'))
+
+    if not employee_ids:
+        flash("Veuillez sélectionner au moins un employé de production.", 'warning')
+        return redirect(url_for('dashboard.shop_dashboard'))
+
+    try:
+        result = ProductionPostingEngine(current_user.id).post_orders(order_ids, employee_ids)
+        db.session.commit()
+
+        if result['posted']:
+            posted_refs = ", ".join(f"#{order.id}" for order in result['posted'])
+            flash(f"{len(result['posted'])} commande(s) finalisée(s) : {posted_refs}. Stocks mis à jour.", 'success')
+        for order in result['skipped']:
+            flash(f"La commande #{order.id} ne peut pas être finalisée. Statut actuel: {order.get_status_display()}", 'warning')
+
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Erreur critique lors de la finalisation groupée {order_ids}: {str(e)}", exc_info=True)
+        flash(f"Erreur critique lors de la mise à jour des stocks : {str(e)}", 'error')
+
+    return redirect(url_for('dashboard.shop_dashboard'))
+
+
 # ... (Le reste de ton fichier status_routes.py reste identique)
 
 @status_bp.route('/<int:order_id>/change-status-to-delivered', methods=['POST'])
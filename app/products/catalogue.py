@@ -0,0 +1,193 @@
+"""
+Catalogue produits partagé par les formulaires
+Module: app/products/catalogue.py
+Auteur: ERP Fée Maison
+
+Les listes déroulantes de produits (commandes, recettes, stock) sont
+construites à partir d'un instantané unique du catalogue : un tuple
+d'entrées compactes chargé en une requête et partagé par tout le processus.
+Chaque liste de choix dérivée est calculée une fois par version de
+l'instantané ; un formulaire à 30 lignes d'ingrédients ne coûte donc plus
+30 requêtes, mais aucune quand le catalogue est chaud.
+
+La version est incrémentée au commit de toute écriture qui change le
+catalogue (produit créé / supprimé / renommé, prix, unité, type, recette).
+Ce commit est aussi publié sur le sujet « catalogue » du flux de
+changements : toutes les REVALIDATE_SECONDS au plus, l'instantané compare la
+dernière version du sujet à celle relevée avant son chargement, et se
+recharge si un autre processus a modifié le catalogue entre-temps. Le TTL
+reste un filet de sécurité.
+"""
+
+import threading
+import time
+from collections import namedtuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from extensions import db
+from app.orders.changefeed import ChangeFeed
+
+
+CatalogueEntry = namedtuple(
+    'CatalogueEntry', 'id name unit product_type price cost_price has_recipe'
+)
+
+# Colonnes de Product dont la modification change le catalogue
+CATALOGUE_COLUMNS = ('name', 'unit', 'product_type', 'price', 'cost_price')
+
+
+class CatalogueSnapshot:
+    """Instantané immuable du catalogue, avec mémo des listes de choix."""
+
+    def __init__(self, version, entries, feed_version=None):
+        self.version = version
+        self.entries = entries
+        # Version du sujet « catalogue » relevée avant le chargement
+        self.feed_version = feed_version
+        self.by_id = {entry.id: entry for entry in entries}
+        self._memo = {}
+        self._memo_lock = threading.Lock()
+
+    def memo(self, key, builder):
+        """Résultat de builder(entries), calculé une fois pour cette version."""
+        with self._memo_lock:
+            if key not in self._memo:
+                self._memo[key] = builder(self.entries)
+            return self._memo[key]
+
+
+class ProductCatalogue:
+    """Instantané versionné du catalogue produits, commun au processus."""
+
+    DEFAULT_TTL = 300  # secondes
+    REVALIDATE_SECONDS = 2
+    FEED_TOPIC = 'catalogue'
+
+    _lock = threading.Lock()
+    _snapshot = None
+    _loaded_at = 0.0
+    _checked_at = 0.0
+    _version = 0
+    _listeners_installed = False
+
+    @classmethod
+    def load(cls):
+        """Charge toutes les entrées du catalogue en une requête (triées par nom)."""
+        from models import Product, Recipe
+
+        has_recipe = db.session.query(Recipe.id).filter(Recipe.product_id == Product.id).exists()
+        rows = db.session.query(
+            Product.id,
+            Product.name,
+            Product.unit,
+            Product.product_type,
+            Product.price,
+            Product.cost_price,
+            has_recipe
+        ).order_by(Product.name, Product.id).all()
+        return tuple(
+            CatalogueEntry(
+                product_id, name, unit, product_type,
+                float(price or 0), float(cost_price or 0), bool(recipe)
+            )
+            for product_id, name, unit, product_type, price, cost_price, recipe in rows
+        )
+
+    @classmethod
+    def snapshot(cls, ttl=None):
+        """
+        Instantané courant, rechargé s'il a été invalidé, a expiré ou si le
+        catalogue a changé dans un autre processus.
+        """
+        ttl = cls.DEFAULT_TTL if ttl is None else ttl
+        now = time.monotonic()
+        with cls._lock:
+            snapshot = cls._snapshot
+            version = cls._version
+            fresh = snapshot is not None and snapshot.version == version and now - cls._loaded_at < ttl
+            if fresh and now - cls._checked_at < cls.REVALIDATE_SECONDS:
+                return snapshot
+
+        feed_version = ChangeFeed.latest_version(cls.FEED_TOPIC)
+        if fresh and snapshot.feed_version == feed_version:
+            with cls._lock:
+                cls._checked_at = now
+            return snapshot
+
+        snapshot = CatalogueSnapshot(version, cls.load(), feed_version)
+        with cls._lock:
+            # Une invalidation pendant le chargement l'emporte
+            if cls._version == version:
+                cls._snapshot = snapshot
+                cls._loaded_at = cls._checked_at = now
+        return snapshot
+
+    @classmethod
+    def choices(cls, key, builder):
+        """Liste de choix dérivée du catalogue, partagée tant que la version tient."""
+        return cls.snapshot().memo(key, builder)
+
+    @classmethod
+    def invalidate(cls):
+        with cls._lock:
+            cls._version += 1
+            cls._snapshot = None
+
+    # ------------------------------------------------------------------ #
+    # Invalidation
+    # ------------------------------------------------------------------ #
+
+    @classmethod
+    def mark_changed(cls, session):
+        """Signale une écriture hors ORM touchant le catalogue ; invalidé au commit."""
+        session.info['product_catalogue_changed'] = True
+        ChangeFeed.mark(session, cls.FEED_TOPIC)
+
+    @classmethod
+    def install_listeners(cls):
+        if cls._listeners_installed:
+            return
+        event.listen(Session, 'after_flush', cls._after_flush)
+        event.listen(Session, 'after_commit', cls._after_commit)
+        event.listen(Session, 'after_rollback', cls._after_rollback)
+        cls._listeners_installed = True
+
+    @classmethod
+    def _after_flush(cls, session, flush_context):
+        from models import Product, Recipe
+
+        for obj in (*session.new, *session.deleted):
+            if isinstance(obj, (Product, Recipe)):
+                cls.mark_changed(session)
+                return
+        for obj in session.dirty:
+            if isinstance(obj, Product):
+                columns = CATALOGUE_COLUMNS
+            elif isinstance(obj, Recipe):
+                columns = ('product_id',)
+            else:
+                continue
+            attrs = db.inspect(obj).attrs
+            if any(attrs[column].history.has_changes() for column in columns):
+                cls.mark_changed(session)
+                return
+
+    @classmethod
+    def _after_commit(cls, session):
+        if session.info.pop('product_catalogue_changed', False):
+            cls.invalidate()
+
+    @staticmethod
+    def _after_rollback(session):
+        session.info.pop('product_catalogue_changed', None)
+
+
+def coerce_product_id(value):
+    """Coerce des listes de produits : entier, ou None pour le choix vide."""
+    if value in (None, '', '__None'):
+        return None
+    if hasattr(value, 'id'):
+        return value.id
+    return int(value)
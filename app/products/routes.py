@@ -4,6 +4,7 @@ from extensions import db
 from models import Product, Category
 from .forms import ProductForm, CategoryForm # Import local depuis le même dossier
 from decorators import admin_required
+from app.recipes.costing import refresh_costs_for_products
 
 # Création du Blueprint 'products'
 products = Blueprint('products', __name__)
@@ -98,8 +99,11 @@ def edit_product(product_id):
     product = db.session.get(Product, product_id) or abort(404)
     form = ProductForm(obj=product)
     if form.validate_on_submit():
+        previous_cost_price = product.cost_price
         form.populate_obj(product)
         product.category = form.category.data
+        if product.cost_price != previous_cost_price:
+            refresh_costs_for_products([product.id])
         db.session.commit()
         flash(f'Le produit "{product.name}" a été mis à jour.', 'success')
         return redirect(url_for('products.list_products'))
@@ -0,0 +1,248 @@
+"""
+Recherche de produits pour l'auto-complétion
+Module: app/products/search.py
+Auteur: ERP Fée Maison
+
+Le nom des produits est dupliqué dans products.search_name sous forme
+normalisée (minuscules, sans accents : « Éclair » -> « eclair »), ce qui
+permet des recherches indexées quel que soit le moteur :
+
+- PostgreSQL : index GIN pg_trgm sur search_name (LIKE '%terme%' indexé,
+  classement secondaire par similarity()) ;
+- SQLite : table FTS5 products_fts (tokenizer trigram) synchronisée par
+  triggers ;
+- repli : LIKE sur search_name.
+
+Un terme de moins de trois caractères ne forme aucun trigramme : il est
+cherché en début de mot par égalité sur product_search_prefixes (débuts de
+mots d'un et deux caractères, maintenus avec search_name).
+
+Les identifiants des meilleurs résultats sont gardés dans un cache LRU
+en mémoire, vidé quand un produit est créé, supprimé ou renommé ; les
+colonnes affichées (prix, stock) sont relues par clé primaire. Pour les
+écritures des autres processus, le cache compare au plus toutes les
+REVALIDATE_SECONDS la version du sujet « catalogue » du flux de changements
+(voir app.products.catalogue) à celle qu'il a vue, et se vide si elle a
+avancé.
+"""
+
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from sqlalchemy import case, event, func, literal_column, text
+from sqlalchemy.orm import Session
+
+from extensions import db
+from app.orders.changefeed import ChangeFeed
+
+
+_NON_ALNUM = re.compile(r'[^0-9a-z]+')
+
+
+def fold_search_text(value):
+    """Normalise un texte pour la recherche : minuscules, sans accents ni ponctuation."""
+    if not value:
+        return ''
+    decomposed = unicodedata.normalize('NFKD', value.replace('œ', 'oe').replace('Œ', 'OE'))
+    stripped = ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return _NON_ALNUM.sub(' ', stripped.lower()).strip()
+
+
+def search_word_prefixes(folded, max_length=2):
+    """Débuts de mots distincts (jusqu'à `max_length` caractères) d'un nom normalisé."""
+    return sorted({word[:length] for word in folded.split()
+                   for length in range(1, min(len(word), max_length) + 1)})
+
+
+class ProductSearch:
+    """Recherche classée de produits, avec cache des meilleurs résultats."""
+
+    DEFAULT_LIMIT = 20
+    MIN_TRIGRAM_LENGTH = 3
+    CACHE_SIZE = 512
+    CACHE_TTL = 300  # secondes
+    REVALIDATE_SECONDS = 2
+    FEED_TOPIC = 'catalogue'
+
+    _lock = threading.Lock()
+    _cache = OrderedDict()
+    _generation = 0
+    _feed_version = None
+    _checked_at = 0.0
+    _backends = {}
+    _listeners_installed = False
+
+    # ------------------------------------------------------------------ #
+    # API
+    # ------------------------------------------------------------------ #
+
+    @classmethod
+    def search(cls, term, product_types=None, limit=None):
+        """
+        Produits dont le nom contient tous les mots de `term`, classés :
+        nom exact, puis préfixe, puis début de mot, puis sous-chaîne.
+
+        :param product_types: Restreint aux types donnés (optionnel).
+        :return: Liste de Product dans l'ordre du classement.
+        """
+        from models import Product
+
+        ids = cls.search_ids(term, product_types, limit)
+        if not ids:
+            return []
+        products = {p.id: p for p in Product.query.filter(Product.id.in_(ids))}
+        return [products[product_id] for product_id in ids if product_id in products]
+
+    @classmethod
+    def search_ids(cls, term, product_types=None, limit=None):
+        """Identifiants classés, servis depuis le cache quand c'est possible."""
+        folded = fold_search_text(term)
+        if not folded:
+            return []
+        limit = limit or cls.DEFAULT_LIMIT
+        key = (folded, tuple(sorted(product_types or ())), limit)
+
+        now = time.monotonic()
+        cls._revalidate(now)
+        with cls._lock:
+            generation = cls._generation
+            cached = cls._cache.get(key)
+            if cached is not None and now - cached[0] < cls.CACHE_TTL:
+                cls._cache.move_to_end(key)
+                return cached[1]
+
+        ids = cls._query_ids(folded, product_types, limit)
+        with cls._lock:
+            # Une invalidation pendant la requête l'emporte
+            if cls._generation == generation:
+                cls._cache[key] = (now, ids)
+                cls._cache.move_to_end(key)
+                while len(cls._cache) > cls.CACHE_SIZE:
+                    cls._cache.popitem(last=False)
+        return ids
+
+    @classmethod
+    def invalidate(cls):
+        with cls._lock:
+            cls._generation += 1
+            cls._cache.clear()
+
+    @classmethod
+    def _revalidate(cls, now):
+        """Vide le cache si le catalogue a changé dans un autre processus."""
+        with cls._lock:
+            if now - cls._checked_at < cls.REVALIDATE_SECONDS:
+                return
+        feed_version = ChangeFeed.latest_version(cls.FEED_TOPIC)
+        with cls._lock:
+            if feed_version != cls._feed_version:
+                cls._generation += 1
+                cls._cache.clear()
+                cls._feed_version = feed_version
+            cls._checked_at = now
+
+    # ------------------------------------------------------------------ #
+    # Requête
+    # ------------------------------------------------------------------ #
+
+    @classmethod
+    def backend(cls):
+        """Détecte (une fois par base) l'index de recherche disponible."""
+        url = str(db.engine.url)
+        if url not in cls._backends:
+            dialect = db.engine.dialect.name
+            backend = 'btree'
+            if dialect == 'postgresql':
+                if db.session.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).first():
+                    backend = 'trigram'
+            elif dialect == 'sqlite':
+                if db.session.execute(text(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products_fts'"
+                )).first():
+                    backend = 'fts5'
+            cls._backends[url] = backend
+        return cls._backends[url]
+
+    @classmethod
+    def _query_ids(cls, folded, product_types, limit):
+        from models import Product, ProductSearchPrefix
+
+        column = Product.search_name
+        words = folded.split()
+        backend = cls.backend()
+        query = db.session.query(Product.id)
+        if product_types:
+            query = query.filter(Product.product_type.in_(list(product_types)))
+
+        if all(len(word) < cls.MIN_TRIGRAM_LENGTH for word in words):
+            # Trop court pour les trigrammes : début de mot, par égalité sur
+            # l'index (prefix, product_id) (« ta » trouve « pate a tartiner »)
+            for word in words:
+                query = query.filter(Product.id.in_(
+                    db.select(ProductSearchPrefix.product_id).where(ProductSearchPrefix.prefix == word)
+                ))
+        elif backend == 'fts5':
+            phrases = ' '.join(f'"{word}"' for word in words if len(word) >= cls.MIN_TRIGRAM_LENGTH)
+            matches = db.select(literal_column('rowid'))\
+                .select_from(text('products_fts'))\
+                .where(text('products_fts MATCH :phrases').bindparams(phrases=phrases))
+            query = query.filter(Product.id.in_(matches))
+            for word in words:
+                if len(word) < cls.MIN_TRIGRAM_LENGTH:
+                    query = query.filter(column.like(f'%{word}%'))
+        else:
+            for word in words:
+                query = query.filter(column.like(f'%{word}%'))
+
+        rank = case(
+            (column == folded, 0),
+            (column.like(f'{folded}%'), 1),
+            (column.like(f'% {folded}%'), 2),
+            else_=3
+        )
+        ordering = [rank]
+        if backend == 'trigram':
+            ordering.append(func.similarity(column, folded).desc())
+        ordering += [func.length(column), Product.name]
+        return [row.id for row in query.order_by(*ordering).limit(limit)]
+
+    # ------------------------------------------------------------------ #
+    # Invalidation
+    # ------------------------------------------------------------------ #
+
+    @classmethod
+    def install_listeners(cls):
+        """Vide le cache au commit d'une création / suppression / modification de nom."""
+        if cls._listeners_installed:
+            return
+        event.listen(Session, 'after_flush', cls._after_flush)
+        event.listen(Session, 'after_commit', cls._after_commit)
+        event.listen(Session, 'after_rollback', cls._after_rollback)
+        cls._listeners_installed = True
+
+    @staticmethod
+    def _after_flush(session, flush_context):
+        from models import Product
+
+        for obj in (*session.new, *session.deleted):
+            if isinstance(obj, Product):
+                session.info['product_search_changed'] = True
+                return
+        for obj in session.dirty:
+            if isinstance(obj, Product) and session.is_modified(obj, include_collections=False):
+                state = db.inspect(obj)
+                if state.attrs.name.history.has_changes() or state.attrs.product_type.history.has_changes():
+                    session.info['product_search_changed'] = True
+                    return
+
+    @classmethod
+    def _after_commit(cls, session):
+        if session.info.pop('product_search_changed', False):
+            cls.invalidate()
+
+    @staticmethod
+    def _after_rollback(session):
+        session.info.pop('product_search_changed', None)
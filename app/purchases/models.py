@@ -7,6 +7,8 @@ Auteur: ERP Fée Maison
 """
 
 from extensions import db
+from sqlalchemy import and_
+from sqlalchemy.ext.hybrid import hybrid_method
 from datetime import datetime, date
 from enum import Enum
 import uuid
@@ -22,6 +24,9 @@ class PurchaseStatus(Enum):
     INVOICED = 'invoiced'                    # Facturé
     CANCELLED = 'cancelled'                  # Annulé
 
+# Statuts pour lesquels plus aucune livraison n'est attendue
+CLOSED_PURCHASE_STATUSES = (PurchaseStatus.RECEIVED, PurchaseStatus.INVOICED, PurchaseStatus.CANCELLED)
+
 class PurchaseUrgency(Enum):
     """Niveaux d'urgence pour les achats"""
     LOW = 'low'                 # Faible
@@ -56,7 +61,7 @@ class Purchase(db.Model):
     # Dates importantes
     requested_date = db.Column(db.DateTime, nullable=False)
     approved_date = db.Column(db.DateTime)
-    expected_delivery_date = db.Column(db.DateTime)
+    expected_delivery_date = db.Column(db.DateTime, index=True)
     received_date = db.Column(db.DateTime)
     
     # ✅ NOUVEAUX CHAMPS : Gestion paiement simplifiée
@@ -116,12 +121,22 @@ class Purchase(db.Model):
         """Vérifie si le bon d'achat peut être commandé"""
         return self.status == PurchaseStatus.APPROVED
     
-    def is_overdue(self):
+    @hybrid_method
+    def is_overdue(self, now=None):
         """Vérifie si le bon d'achat est en retard"""
         if not self.expected_delivery_date:
             return False
-        return (self.expected_delivery_date < datetime.utcnow() and 
-                self.status not in [PurchaseStatus.RECEIVED, PurchaseStatus.INVOICED, PurchaseStatus.CANCELLED])
+        return (self.expected_delivery_date < (now or datetime.utcnow()) and
+                self.status not in CLOSED_PURCHASE_STATUSES)
+
+    @is_overdue.expression
+    def is_overdue(cls, now=None):
+        """Même règle en SQL (index sur expected_delivery_date)"""
+        return and_(
+            cls.expected_delivery_date.isnot(None),
+            cls.expected_delivery_date < (now or datetime.utcnow()),
+            cls.status.notin_(CLOSED_PURCHASE_STATUSES)
+        )
     
     # ✅ NOUVELLES PROPRIÉTÉS : Gestion affichage paiement
     @property
@@ -188,6 +203,10 @@ class PurchaseItem(db.Model):
     # Informations de réception
     quantity_received = db.Column(db.Numeric(10, 3), default=0.0)
     
+    # Lot fournisseur (traçabilité et péremption, voir StockLot)
+    lot_number = db.Column(db.String(50))
+    expiry_date = db.Column(db.Date)
+    
     # Localisation et description
     stock_location = db.Column(db.String(50), nullable=False, default='ingredients_magasin')
     description_override = db.Column(db.String(255))
@@ -287,5 +306,7 @@ class PurchaseItem(db.Model):
             'original_unit_id': self.original_unit_id,
             'original_unit_price': float(self.original_unit_price) if self.original_unit_price else None,
             'stock_location': self.stock_location,
+            'lot_number': self.lot_number,
+            'expiry_date': self.expiry_date.isoformat() if self.expiry_date else None,
             'description_override': self.description_override,
         }
\ No newline at end of file
@@ -0,0 +1,177 @@
+"""
+Calcul des besoins matières et suggestions d'achat
+Module: app/purchases/mrp.py
+Auteur: ERP Fée Maison
+
+Les commandes en attente et en production n'ont pas encore consommé leurs
+ingrédients (la consommation est comptabilisée à la fin de production).
+RequirementsPlanner en déduit les besoins bruts :
+
+1. demande : une requête groupée donne la quantité à produire par produit ;
+2. nomenclature : chaque produit est développé une fois (app.recipes.bom) en
+   un vecteur creux {(ingrédient, labo): quantité par unité} ;
+3. besoins bruts = demande × nomenclature, accumulés par (ingrédient, labo).
+
+Les besoins nets retranchent le stock du labo et les achats en cours non
+encore reçus ; la quantité suggérée ramène le stock projeté au seuil du labo
+(seuil saisi ou point de commande calculé par app.stock.forecast, le plus
+grand des deux). Le coût est de quelques requêtes plus une par niveau de sous-recette,
+quel que soit le nombre de commandes.
+"""
+
+from collections import defaultdict
+
+from sqlalchemy import func
+
+from extensions import db
+from app.recipes.bom import BillOfMaterials
+from app.stock.forecast import ConsumptionForecast
+from app.stock.stock_manager import StockLocationManager
+from .models import Purchase, PurchaseItem, PurchaseStatus
+
+# Commandes dont les ingrédients restent à consommer
+DEMAND_STATUSES = ('pending', 'in_production')
+
+# Achats engagés dont la marchandise n'est pas (entièrement) arrivée
+OPEN_PURCHASE_STATUSES = (
+    PurchaseStatus.APPROVED,
+    PurchaseStatus.ORDERED,
+    PurchaseStatus.PARTIALLY_RECEIVED,
+)
+
+
+class RequirementsPlanner:
+    """Besoins nets en ingrédients par labo, à partir des commandes ouvertes."""
+
+    def __init__(self, until=None, locations=None):
+        """
+        :param until: Ne retient que les commandes dues avant cette date (optionnel).
+        :param locations: Labos à planifier (défaut : tous les labos de production).
+        """
+        self.until = until
+        self.locations = tuple(locations or (key for key, _ in StockLocationManager.get_production_choices()))
+
+    # ------------------------------------------------------------------ #
+    # Entrées
+    # ------------------------------------------------------------------ #
+
+    def demand(self):
+        """:return: dict {product_id: quantité à produire} des commandes ouvertes."""
+        from models import Order, OrderItem
+
+        query = db.session.query(OrderItem.product_id, func.sum(OrderItem.quantity))\
+            .join(Order, Order.id == OrderItem.order_id)\
+            .filter(Order.status.in_(DEMAND_STATUSES))
+        if self.until is not None:
+            query = query.filter(Order.due_date < self.until)
+        return {
+            product_id: float(quantity)
+            for product_id, quantity in query.group_by(OrderItem.product_id).all()
+            if quantity
+        }
+
+    def gross_requirements(self, demand=None, bom=None):
+        """
+        Besoins bruts : chaque produit est développé une seule fois, puis
+        multiplié par sa quantité demandée.
+
+        :return: dict {(ingredient_id, labo_key): quantité}.
+        :raises BomError: si une recette se contient elle-même ou mélange des unités incompatibles.
+        """
+        demand = self.demand() if demand is None else demand
+        if not demand:
+            return {}
+        if bom is None:
+            bom = BillOfMaterials.load(product_ids=demand)
+        else:
+            bom.ensure_loaded(product_ids=demand)
+
+        requirements = defaultdict(float)
+        for product_id, quantity in demand.items():
+            for key, (qty_per_unit, _) in bom.explode_product(product_id).items():
+                if key[1] in self.locations:
+                    requirements[key] += float(qty_per_unit) * quantity
+        return dict(requirements)
+
+    @staticmethod
+    def on_order():
+        """:return: dict {(product_id, stock_location): quantité restant à recevoir}."""
+        remaining = PurchaseItem.quantity_ordered - func.coalesce(PurchaseItem.quantity_received, 0)
+        rows = db.session.query(
+            PurchaseItem.product_id,
+            PurchaseItem.stock_location,
+            func.sum(remaining)
+        ).join(Purchase, Purchase.id == PurchaseItem.purchase_id)\
+         .filter(Purchase.status.in_(OPEN_PURCHASE_STATUSES),
+                 PurchaseItem.quantity_ordered > func.coalesce(PurchaseItem.quantity_received, 0))\
+         .group_by(PurchaseItem.product_id, PurchaseItem.stock_location).all()
+        return {(product_id, location): float(quantity or 0) for product_id, location, quantity in rows}
+
+    @staticmethod
+    def open_purchase_count():
+        """Nombre de bons d'achat engagés et pas encore entièrement reçus."""
+        return Purchase.query.filter(Purchase.status.in_(OPEN_PURCHASE_STATUSES)).count()
+
+    # ------------------------------------------------------------------ #
+    # Besoins nets
+    # ------------------------------------------------------------------ #
+
+    def plan(self, include_zero=False):
+        """
+        Besoins nets par (ingrédient, labo), pour les ingrédients demandés par
+        les commandes ouvertes et ceux déjà sous leur seuil minimal.
+
+        :param include_zero: Conserve les lignes sans achat suggéré.
+        :return: Liste de dicts triée par labo puis nom d'ingrédient.
+        """
+        from models import Product
+
+        gross = self.gross_requirements()
+        incoming = self.on_order()
+        reorder_points = {
+            location: ConsumptionForecast.reorder_points(location) for location in self.locations
+        }
+
+        columns = {
+            location: (StockLocationManager.get_stock_column(location), f'seuil_min_{location}')
+            for location in self.locations
+        }
+        attrs = []
+        for stock_column, threshold_column in columns.values():
+            attrs += [getattr(Product, stock_column), getattr(Product, threshold_column)]
+
+        needed_ids = {ingredient_id for ingredient_id, _ in gross}
+        query = db.session.query(Product.id, Product.name, Product.unit, *attrs)
+        if needed_ids:
+            query = query.filter(db.or_(Product.product_type == 'ingredient', Product.id.in_(needed_ids)))
+        else:
+            query = query.filter(Product.product_type == 'ingredient')
+
+        lines = []
+        for row in query.all():
+            for location, (stock_column, threshold_column) in columns.items():
+                requirement = gross.get((row.id, location), 0.0)
+                stock = float(getattr(row, stock_column) or 0)
+                threshold = max(float(getattr(row, threshold_column) or 0),
+                                reorder_points[location].get(row.id, 0.0))
+                on_order = incoming.get((row.id, location), 0.0)
+                if not requirement and stock > threshold:
+                    continue
+                net = requirement - stock - on_order
+                suggested = max(net + threshold, 0.0)
+                if not suggested and not include_zero:
+                    continue
+                lines.append({
+                    'product_id': row.id,
+                    'product_name': row.name,
+                    'unit': row.unit or 'unités',
+                    'location': location,
+                    'gross_requirement': round(requirement, 3),
+                    'stock': stock,
+                    'on_order': on_order,
+                    'threshold': threshold,
+                    'net_requirement': round(max(net, 0.0), 3),
+                    'suggested_quantity': round(suggested, 3),
+                })
+        lines.sort(key=lambda line: (line['location'], line['product_name'].lower()))
+        return lines
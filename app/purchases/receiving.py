@@ -0,0 +1,318 @@
+"""
+Réception groupée des bons d'achat
+Module: app/purchases/receiving.py
+Auteur: ERP Fée Maison
+
+Une facture fournisseur de plusieurs centaines de lignes est comptabilisée
+en un nombre fixe d'instructions :
+
+1. les produits et unités référencés sont chargés en deux requêtes IN ;
+2. toutes les lignes sont converties en unité de base en une passe ;
+3. le journal de stock reçoit les mouvements ENTREE en lot
+   (StockLedger.post_batch : un UPDATE des stocks, un INSERT multi-lignes) ;
+4. total_stock_value et le PMP (cost_price) des ingrédients sont mis à jour
+   par un seul UPDATE paramétré, et une couche de coût FIFO est ouverte par
+   ligne (CostLayerEngine, via le journal) ;
+5. les lignes du bon d'achat sont insérées en une instruction ;
+6. un lot (numéro, date de péremption) est créé par ligne reçue (LotTracker).
+
+La même mécanique sert à reverser un bon reçu (annulation, modification).
+"""
+
+from collections import defaultdict, namedtuple
+from datetime import datetime
+
+from sqlalchemy import bindparam, case, func, insert, update
+
+from extensions import db
+from app.products.catalogue import ProductCatalogue
+from app.recipes.costing import refresh_costs_for_products
+from app.stock.ledger import StockLedger
+from app.stock.lots import LotTracker
+from app.stock.models import StockMovementType
+from app.stock.stock_manager import StockLocationManager
+from .models import PurchaseItem
+
+# Ligne convertie en unité de base, prête à être comptabilisée
+ReceiptLine = namedtuple('ReceiptLine', [
+    'product_id', 'product_type', 'quantity', 'unit_price',
+    'original_quantity', 'original_unit_id', 'original_unit_price',
+    'stock_location', 'description', 'lot_number', 'expiry_date'
+], defaults=(None, None))
+
+# Types de produits dont la réception met à jour le stock
+STOCKED_PRODUCT_TYPES = ('ingredient', 'consommable')
+
+
+def form_lines(form):
+    """
+    Lignes brutes d'un formulaire de bon d'achat (champs items[][...]).
+
+    :return: Liste de dicts {'product_id', 'quantity', 'unit_price', 'unit_id', 'stock_location',
+             'lot_number', 'expiry_date'}.
+    """
+    product_ids = form.getlist('items[][product_id]')
+    quantities = form.getlist('items[][quantity_ordered]')
+    prices = form.getlist('items[][unit_price]')
+    unit_ids = form.getlist('items[][unit]')
+    locations = form.getlist('items[][stock_location]')
+    lot_numbers = form.getlist('items[][lot_number]')
+    expiry_dates = form.getlist('items[][expiry_date]')
+
+    def at(values, index):
+        return values[index] if index < len(values) else None
+
+    return [{
+        'product_id': product_ids[i],
+        'quantity': at(quantities, i),
+        'unit_price': at(prices, i),
+        'unit_id': at(unit_ids, i),
+        'stock_location': at(locations, i),
+        'lot_number': at(lot_numbers, i),
+        'expiry_date': at(expiry_dates, i),
+    } for i in range(len(product_ids))]
+
+
+def parse_expiry_date(value):
+    """Date de péremption d'un champ de formulaire (AAAA-MM-JJ ou JJ/MM/AAAA), sinon None."""
+    value = (value or '').strip()
+    for fmt in ('%Y-%m-%d', '%d/%m/%Y'):
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+class PurchaseReceivingEngine:
+    """
+    Conversion et comptabilisation groupées des lignes d'achat.
+    L'appelant reste responsable du commit / rollback de la session.
+    """
+
+    DEFAULT_LOCATION = 'ingredients_magasin'
+    CONSUMABLES_LOCATION = 'consommables'
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+
+    # ------------------------------------------------------------------ #
+    # Conversion
+    # ------------------------------------------------------------------ #
+
+    def prepare(self, raw_lines):
+        """
+        Valide et convertit les lignes en unité de base.
+        Les lignes illisibles, à quantité ou prix nul, de produit ou d'unité
+        inconnus sont ignorées.
+
+        :param raw_lines: Résultat de form_lines (ou dicts équivalents).
+        :return: Liste de ReceiptLine.
+        """
+        from models import Product, Unit
+
+        parsed = []
+        for raw in raw_lines:
+            try:
+                product_id = int(raw['product_id'])
+                quantity = float(raw.get('quantity') or 0)
+                price = float(raw.get('unit_price') or 0)
+                unit_id = int(raw['unit_id']) if raw.get('unit_id') else None
+            except (ValueError, TypeError):
+                continue
+            if quantity > 0 and price > 0:
+                lot = ((raw.get('lot_number') or '').strip()[:50] or None, parse_expiry_date(raw.get('expiry_date')))
+                parsed.append((product_id, quantity, price, unit_id, raw.get('stock_location'), lot))
+        if not parsed:
+            return []
+
+        product_types = dict(db.session.query(Product.id, Product.product_type)
+                             .filter(Product.id.in_({line[0] for line in parsed})).all())
+        unit_ids = {line[3] for line in parsed if line[3]}
+        units = {}
+        if unit_ids:
+            units = {row.id: row for row in db.session.query(Unit.id, Unit.name, Unit.conversion_factor)
+                     .filter(Unit.id.in_(unit_ids))}
+
+        lines = []
+        for product_id, quantity, price, unit_id, location, (lot_number, expiry_date) in parsed:
+            product_type = product_types.get(product_id)
+            if product_type is None:
+                continue
+            factor, description = 1.0, None
+            if unit_id:
+                unit = units.get(unit_id)
+                if unit is None or not unit.conversion_factor or unit.conversion_factor <= 0:
+                    continue
+                factor = float(unit.conversion_factor)
+                description = f"{quantity:g} × {unit.name}"
+
+            if product_type == 'consommable':
+                location = self.CONSUMABLES_LOCATION
+            elif not location or not StockLocationManager.get_stock_column(location):
+                location = self.DEFAULT_LOCATION
+
+            lines.append(ReceiptLine(
+                product_id=product_id,
+                product_type=product_type,
+                quantity=quantity * factor,
+                unit_price=price / factor,
+                original_quantity=quantity if unit_id else None,
+                original_unit_id=unit_id,
+                original_unit_price=price if unit_id else None,
+                stock_location=location,
+                description=description,
+                lot_number=lot_number,
+                expiry_date=expiry_date
+            ))
+        return lines
+
+    # ------------------------------------------------------------------ #
+    # Comptabilisation
+    # ------------------------------------------------------------------ #
+
+    @staticmethod
+    def add_items(purchase, lines):
+        """
+        Insère les lignes du bon d'achat en une instruction et met à jour ses totaux.
+
+        :return: Identifiants des lignes insérées, dans l'ordre de `lines`.
+        """
+        if not lines:
+            return []
+        item_ids = db.session.execute(insert(PurchaseItem).returning(PurchaseItem.id, sort_by_parameter_order=True), [{
+            'purchase_id': purchase.id,
+            'product_id': line.product_id,
+            'quantity_ordered': line.quantity,
+            'unit_price': line.unit_price,
+            'original_quantity': line.original_quantity,
+            'original_unit_id': line.original_unit_id,
+            'original_unit_price': line.original_unit_price,
+            'stock_location': line.stock_location,
+            'description_override': line.description,
+            'lot_number': line.lot_number,
+            'expiry_date': line.expiry_date,
+        } for line in lines]).scalars().all()
+
+        subtotal = sum(line.quantity * line.unit_price for line in lines)
+        purchase.subtotal_amount = subtotal
+        purchase.total_amount = subtotal + float(purchase.tax_amount or 0) + float(purchase.shipping_cost or 0)
+        db.session.expire(purchase, ['items'])
+        return item_ids
+
+    def receive(self, purchase, lines, item_ids=None, movement_type=StockMovementType.ENTREE, reason=None):
+        """
+        Entre en stock les lignes d'ingrédients et de consommables, met à
+        jour la valeur de stock et le PMP des ingrédients et crée un lot par ligne.
+
+        :param item_ids: Résultat de add_items (rattache chaque lot à sa ligne d'achat).
+        :return: Nombre de mouvements écrits.
+        """
+        reason = reason or f"Achat {purchase.reference}"
+        movements = self._post(lines, 1, movement_type, reason, allow_negative=False, purchase_id=purchase.id)
+
+        item_ids = item_ids or [None] * len(lines)
+        LotTracker.receive([{
+            'product_id': line.product_id,
+            'location': line.stock_location,
+            'quantity': line.quantity,
+            'unit_cost': line.unit_price,
+            'lot_number': line.lot_number,
+            'expiry_date': line.expiry_date,
+            'purchase_id': purchase.id,
+            'purchase_item_id': item_id
+        } for line, item_id in zip(lines, item_ids)
+          if line.product_type in STOCKED_PRODUCT_TYPES and line.quantity])
+        return movements
+
+    def reverse(self, purchase, movement_type=StockMovementType.AJUSTEMENT_NEGATIF, reason=None):
+        """
+        Retire du stock les lignes actuelles d'un bon reçu (annulation ou
+        modification) ; le stock peut devenir négatif. Les lots du bon encore
+        ouverts sont soldés, sans toucher aux lots des autres achats.
+
+        :return: Nombre de mouvements écrits.
+        """
+        from models import Product
+
+        rows = db.session.query(
+            PurchaseItem.product_id,
+            Product.product_type,
+            PurchaseItem.quantity_ordered,
+            PurchaseItem.unit_price,
+            PurchaseItem.stock_location
+        ).join(Product, Product.id == PurchaseItem.product_id)\
+         .filter(PurchaseItem.purchase_id == purchase.id).all()
+        lines = [
+            ReceiptLine(product_id, product_type, float(quantity or 0), float(unit_price or 0),
+                        None, None, None, location, None)
+            for product_id, product_type, quantity, unit_price, location in rows
+            if location and StockLocationManager.get_stock_column(location)
+        ]
+        reason = reason or f"Annulation achat {purchase.reference}"
+        movements = self._post(lines, -1, movement_type, reason, allow_negative=True, purchase_id=purchase.id)
+        LotTracker.reverse_purchase(purchase.id)
+        return movements
+
+    def _post(self, lines, sign, movement_type, reason, allow_negative, purchase_id=None):
+        stocked = [line for line in lines if line.product_type in STOCKED_PRODUCT_TYPES and line.quantity]
+        if not stocked:
+            return 0
+
+        ledger = StockLedger(self.user_id)
+        product_ids = {line.product_id for line in stocked}
+        balances = ledger.lock_balances(product_ids)
+
+        entries = []
+        value_deltas = defaultdict(float)
+        last_prices = {}
+        for line in stocked:
+            entries.append({
+                'product_id': line.product_id,
+                'location': line.stock_location,
+                'quantity': sign * line.quantity,
+                'movement_type': movement_type,
+                'unit_cost': line.unit_price,
+                'reason': reason,
+                # Les lots d'un bon reversé sont soldés par reverse()
+                'track_lots': sign > 0,
+                # Couches de coût FIFO rattachées au bon
+                'purchase_id': purchase_id,
+            })
+            # Seuls les ingrédients sont valorisés au PMP
+            if line.product_type == 'ingredient':
+                value_deltas[line.product_id] += sign * line.quantity * line.unit_price
+                last_prices[line.product_id] = line.unit_price
+
+        movement_rows = ledger.post_batch(entries, balances=balances, allow_negative=allow_negative)
+        self._bulk_update_values(value_deltas, last_prices)
+        if value_deltas:
+            refresh_costs_for_products(value_deltas)
+            ProductCatalogue.mark_changed(db.session)
+
+        ledger.expire_products(product_ids)
+        return len(movement_rows)
+
+    @staticmethod
+    def _bulk_update_values(value_deltas, last_prices):
+        """
+        total_stock_value += delta et PMP = valeur / stock total, en un UPDATE.
+        Sans stock restant, le PMP prend le dernier prix d'achat de la ligne.
+        """
+        from models import Product
+
+        if not value_deltas:
+            return
+        table = Product.__table__
+        tsv = func.coalesce(table.c.total_stock_value, 0)
+        new_value = tsv + bindparam('b_value')
+        # Les colonnes de stock ont déjà été mises à jour par post_batch
+        total_qty = sum(func.coalesce(table.c[col], 0) for col in StockLocationManager.LOCATION_COLUMNS.values())
+        stmt = update(table)\
+            .where(table.c.id == bindparam('b_id'))\
+            .values(total_stock_value=new_value,
+                    cost_price=case((total_qty > 0, new_value / total_qty), else_=bindparam('b_price')))
+        db.session.execute(stmt, [
+            {'b_id': product_id, 'b_value': value, 'b_price': last_prices[product_id]}
+            for product_id, value in value_deltas.items()
+        ])
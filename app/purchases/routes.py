@@ -15,6 +15,13 @@ from .models import Purchase, PurchaseItem, PurchaseStatus, PurchaseUrgency
 from .forms import (PurchaseForm, MarkAsPaidForm, PurchaseApprovalForm, PurchaseReceiptForm,
 PurchaseSearchForm, QuickPurchaseForm, PurchaseReceiptItemForm)
 from decorators import admin_required
+from app.stock.models import StockMovementType
+from app.products.search import ProductSearch
+from app.recipes.bom import BomError
+from app.stock.stock_manager import StockLocationManager
+from .mrp import RequirementsPlanner
+from .stats import PurchaseStatsService
+from .receiving import PurchaseReceivingEngine, form_lines
 from sqlalchemy import and_, or_, desc, func
 from datetime import datetime, timedelta
 import json
@@ -78,16 +85,8 @@ def list_purchases():
         page=page, per_page=per_page, error_out=False
     )
 
-    # ✅ NOUVEAU : Statistiques avec paiements
-    stats = {
-        'total_purchases': Purchase.query.count(),
-        'pending_approval': Purchase.query.filter(
-            Purchase.status.in_([PurchaseStatus.DRAFT, PurchaseStatus.REQUESTED])
-        ).count(),
-        'unpaid_purchases': Purchase.query.filter(Purchase.is_paid == False).count(),
-        'paid_purchases': Purchase.query.filter(Purchase.is_paid == True).count(),
-        'overdue': len([p for p in Purchase.query.all() if p.is_overdue()])
-    }
+    # Statistiques (une seule requête agrégée)
+    stats = PurchaseStatsService.summary()
 
     # Variables pour le template
     suppliers_list = db.session.query(Purchase.supplier_name).distinct().all()
@@ -103,7 +102,7 @@ def list_purchases():
         pending_purchases=stats['pending_approval'],
         unpaid_purchases=stats['unpaid_purchases'], # ✅ NOUVEAU
         paid_purchases=stats['paid_purchases'], # ✅ NOUVEAU
-        total_amount_month=0,
+        total_amount_month=stats['total_amount_month'],
         suppliers_count=len(suppliers_list),
         suppliers_list=suppliers_list,
         pagination=purchases,
@@ -149,82 +148,16 @@ def new_purchase():
         db.session.add(purchase)
         db.session.flush()
 
-        items_added = 0
-        product_ids = request.form.getlist('items[][product_id]')
-        quantities = request.form.getlist('items[][quantity_ordered]')
-        prices = request.form.getlist('items[][unit_price]')
-        unit_ids = request.form.getlist('items[][unit]')
-        stock_locations = request.form.getlist('items[][stock_location]')
-        
-        for i in range(len(product_ids)):
-            try:
-                product_id = int(product_ids[i])
-                product = Product.query.get(product_id)
-                quantity = float(quantities[i])
-                price_per_unit_achat = float(prices[i])
-                unit_id = int(unit_ids[i])
-                
-                if not (product and quantity > 0 and price_per_unit_achat >= 0 and unit_id):
-                    continue
-                
-                unit_object = Unit.query.get(unit_id)
-                if not unit_object:
-                    continue
-
-                quantity_in_base_unit = unit_object.to_base_unit(quantity)
-                
-                # ### DEBUT DE LA CORRECTION POUR CONSOMMABLES ###
-                
-                # Si c'est un consommable, on le met dans le bon stock et on ne calcule pas le PMP.
-                if product.product_type == 'consommable':
-                    stock_location = 'consommables'
-                    product.update_stock_by_location(stock_location, quantity_in_base_unit)
-                    print(f"CONSOMMABLE: Ajout de {quantity_in_base_unit} de {product.name} au stock consommables.")
-                
-                # Si c'est un ingrédient, on fait le calcul PMP.
-                elif product.product_type == 'ingredient':
-                    stock_location = stock_locations[i]
-                    price_per_base_unit = price_per_unit_achat / float(unit_object.conversion_factor) if unit_object.conversion_factor > 0 else 0
-                    purchase_value = quantity_in_base_unit * price_per_base_unit
-
-                    product.total_stock_value = float(product.total_stock_value or 0.0) + purchase_value
-                    product.update_stock_by_location(stock_location, quantity_in_base_unit)
-                    
-                    new_total_stock_qty = product.total_stock_all_locations
-                    if new_total_stock_qty > 0:
-                        product.cost_price = product.total_stock_value / new_total_stock_qty
-                    else:
-                        product.cost_price = price_per_base_unit
-                    
-                    print(f"INGREDIENT: {product.name} - Nouveau PMP: {product.cost_price}")
-
-                # ### FIN DE LA CORRECTION ###
-
-                # On crée l'item d'achat dans tous les cas pour l'historique
-                purchase_item = PurchaseItem(
-                    purchase_id=purchase.id,
-                    product_id=product.id,
-                    quantity_ordered=quantity_in_base_unit,
-                    unit_price=price_per_unit_achat / float(unit_object.conversion_factor) if unit_object.conversion_factor > 0 else 0,
-                    original_quantity=quantity,
-                    original_unit_id=unit_id,
-                    original_unit_price=price_per_unit_achat,
-                    stock_location=stock_location
-                )
-                db.session.add(purchase_item)
-                items_added += 1
-
-            except (ValueError, IndexError, TypeError) as e:
-                current_app.logger.error(f"Erreur traitement item PMP: {e}", exc_info=True)
-                continue
-
-        # ... (le reste de la fonction reste identique)
-        if items_added == 0:
+        # Conversion et comptabilisation groupées de toutes les lignes
+        engine = PurchaseReceivingEngine(current_user.id)
+        lines = engine.prepare(form_lines(request.form))
+        if not lines:
             db.session.rollback()
             flash('Aucun article valide. Le bon d\'achat a été annulé.', 'danger')
             return redirect(url_for('purchases.new_purchase'))
 
-        purchase.calculate_totals()
+        item_ids = engine.add_items(purchase, lines)
+        engine.receive(purchase, lines, item_ids)
         db.session.commit()
         
         flash(f'Bon d\'achat {purchase.reference} créé. Le stock et le coût moyen pondéré ont été mis à jour.', 'success')
@@ -298,32 +231,9 @@ def cancel_purchase(id):
         return redirect(url_for('purchases.view_purchase', id=id))
 
     if purchase.status == PurchaseStatus.RECEIVED:
-        stock_reversions = []
-        for item in purchase.items:
-            if item.product:
-                if item.stock_location == 'ingredients_magasin':
-                    item.product.stock_ingredients_magasin -= float(item.quantity_ordered)
-                    stock_location_display = "Stock Magasin"
-                elif item.stock_location == 'ingredients_local':
-                    item.product.stock_ingredients_local -= float(item.quantity_ordered)
-                    stock_location_display = "Stock Local"
-                elif item.stock_location == 'comptoir':
-                    item.product.stock_comptoir -= float(item.quantity_ordered)
-                    stock_location_display = "Stock Comptoir"
-                elif item.stock_location == 'consommables':
-                    item.product.stock_consommables -= float(item.quantity_ordered)
-                    stock_location_display = "Stock Consommables"
-                
-                if item.original_quantity and item.original_unit:
-                    display_quantity = f"{item.original_quantity} × {item.original_unit.name}"
-                else:
-                    display_quantity = f"{item.quantity_ordered}"
-                stock_reversions.append(f"{item.product.name}: -{display_quantity} du {stock_location_display}")
-
-        if stock_reversions:
-            flash(f'Stocks reversés automatiquement :', 'warning')
-            for reversion in stock_reversions:
-                flash(f'📦 {reversion}', 'info')
+        reversed_count = PurchaseReceivingEngine(current_user.id).reverse(purchase)
+        if reversed_count:
+            flash(f'Stocks reversés automatiquement : {reversed_count} ligne(s).', 'warning')
 
     purchase.status = PurchaseStatus.CANCELLED
     db.session.commit()
@@ -354,16 +264,6 @@ def edit_purchase(id):
         purchase.requested_date = form.requested_date.data
         # ### FIN DE LA CORRECTION ###
 
-        old_stock_updates = []
-        if purchase.status == PurchaseStatus.RECEIVED:
-            for item in purchase.items:
-                if item.product:
-                    old_stock_updates.append({
-                        'product': item.product,
-                        'location': item.stock_location,
-                        'quantity': float(item.quantity_ordered)
-                    })
-        
         purchase.supplier_name = form.supplier_name.data
         purchase.supplier_contact = form.supplier_contact.data
         purchase.supplier_phone = form.supplier_phone.data
@@ -378,74 +278,9 @@ def edit_purchase(id):
         purchase.internal_notes = form.internal_notes.data
         purchase.terms_conditions = form.terms_conditions.data
 
-        for old_update in old_stock_updates:
-            product = old_update['product']
-            location = old_update['location']
-            quantity = old_update['quantity']
-            if location == 'ingredients_magasin':
-                product.stock_ingredients_magasin -= quantity
-            elif location == 'ingredients_local':
-                product.stock_ingredients_local -= quantity
-            elif location == 'comptoir':
-                product.stock_comptoir -= quantity
-            elif location == 'consommables':
-                product.stock_consommables -= quantity
-
-        PurchaseItem.query.filter_by(purchase_id=purchase.id).delete()
-
-        items_added = 0
-        product_ids = request.form.getlist('items[][product_id]')
-        quantities = request.form.getlist('items[][quantity_ordered]')
-        prices = request.form.getlist('items[][unit_price]')
-        units = request.form.getlist('items[][unit]')
-        stock_locations = request.form.getlist('items[][stock_location]') 
-
-        for i in range(len(product_ids)):
-            try:
-                product_id = int(product_ids[i]) if product_ids[i] else None
-                quantity = float(quantities[i]) if quantities[i] else 0
-                price = float(prices[i]) if prices[i] else 0
-                unit_id = int(units[i]) if units[i] else None
-                stock_location = stock_locations[i] if i < len(stock_locations) else 'ingredients_magasin' 
-
-                if product_id and quantity > 0 and price > 0:
-                    final_quantity = quantity
-                    final_unit_price = price
-                    original_quantity = None
-                    original_unit_id = None
-                    original_unit_price = None
-                    description_with_unit = f"{quantity} unités"
-                    if unit_id:
-                        try:
-                            unit = Unit.query.get(unit_id)
-                            if unit and unit.conversion_factor > 0:
-                                final_quantity = unit.to_base_unit(quantity)
-                                final_unit_price = price / float(unit.conversion_factor)
-                                original_quantity = quantity
-                                original_unit_id = unit.id
-                                original_unit_price = price
-                                description_with_unit = f"{quantity} × {unit.name}"
-                        except (ValueError, TypeError):
-                            pass
-                    
-                    purchase_item = PurchaseItem(
-                        purchase_id=purchase.id,
-                        product_id=product_id,
-                        quantity_ordered=final_quantity,
-                        unit_price=final_unit_price,
-                        original_quantity=original_quantity,
-                        original_unit_id=original_unit_id,
-                        original_unit_price=original_unit_price,
-                        stock_location=stock_location,
-                        description_override=description_with_unit
-                    )
-                    db.session.add(purchase_item)
-                    items_added += 1
-            except (ValueError, IndexError, TypeError) as e:
-                print(f"Erreur traitement item {i}: {e}")
-                continue
-
-        if items_added == 0:
+        engine = PurchaseReceivingEngine(current_user.id)
+        lines = engine.prepare(form_lines(request.form))
+        if not lines:
             flash('Aucun article valide n\'a été ajouté au bon d\'achat.', 'danger')
             available_products = Product.query.filter(
                 Product.product_type.in_(['ingredient', 'consommable'])
@@ -454,20 +289,19 @@ def edit_purchase(id):
             return render_template('purchases/edit_purchase.html', form=form, purchase=purchase,
                                 title='Modifier Bon d\'Achat', available_products=available_products,
                                 available_units=available_units)
-        
-        if purchase.status == PurchaseStatus.RECEIVED:
-            for item in purchase.items:
-                if item.product:
-                    if item.stock_location == 'ingredients_magasin':
-                        item.product.stock_ingredients_magasin += float(item.quantity_ordered)
-                    elif item.stock_location == 'ingredients_local':
-                        item.product.stock_ingredients_local += float(item.quantity_ordered)
-                    elif item.stock_location == 'comptoir':
-                        item.product.stock_comptoir += float(item.quantity_ordered)
-                    elif item.stock_location == 'consommables':
-                        item.product.stock_consommables += float(item.quantity_ordered)
-
-        purchase.calculate_totals()
+
+        # Bon déjà reçu : les anciennes lignes sortent du stock, les nouvelles y entrent
+        received = purchase.status == PurchaseStatus.RECEIVED
+        if received:
+            engine.reverse(purchase, reason=f"Modification achat {purchase.reference} - annulation des lignes")
+
+        PurchaseItem.query.filter_by(purchase_id=purchase.id).delete()
+        item_ids = engine.add_items(purchase, lines)
+
+        if received:
+            engine.receive(purchase, lines, item_ids, movement_type=StockMovementType.AJUSTEMENT_POSITIF,
+                           reason=f"Modification achat {purchase.reference} - nouvelles lignes")
+
         db.session.commit()
         flash(f'Bon d\'achat {purchase.reference} modifié avec succès.', 'success')
         return redirect(url_for('purchases.view_purchase', id=purchase.id))
@@ -497,12 +331,7 @@ def api_products_search():
     if len(search_term) < 2:
         return jsonify([])
     
-    products = Product.query.filter(
-        and_(
-            Product.name.ilike(f'%{search_term}%'),
-            Product.product_type.in_(['ingredient', 'consommable'])
-        )
-    ).limit(20).all()
+    products = ProductSearch.search(search_term, product_types=('ingredient', 'consommable'), limit=20)
 
     results = []
     for product in products:
@@ -526,6 +355,28 @@ def api_pending_count():
     ).count()
     return jsonify({'count': count})
 
+@purchases.route('/api/suggestions')
+@login_required
+@admin_required
+def api_purchase_suggestions():
+    """API des besoins nets en ingrédients (commandes ouvertes - stock - achats en cours)"""
+    location = request.args.get('location')
+    if location and location not in dict(StockLocationManager.get_production_choices()):
+        return jsonify({'error': f"Labo inconnu : {location}"}), 400
+    until = None
+    if request.args.get('days'):
+        try:
+            until = datetime.utcnow() + timedelta(days=int(request.args['days']))
+        except ValueError:
+            return jsonify({'error': "Paramètre days invalide"}), 400
+
+    planner = RequirementsPlanner(until=until, locations=(location,) if location else None)
+    try:
+        lines = planner.plan(include_zero=request.args.get('all') == '1')
+    except BomError as e:
+        return jsonify({'error': str(e)}), 409
+    return jsonify({'suggestions': lines, 'open_purchases': planner.open_purchase_count()})
+
 @purchases.route('/api/products/<int:product_id>/units')
 @login_required
 def api_product_units(product_id):
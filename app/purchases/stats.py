@@ -0,0 +1,61 @@
+"""
+Statistiques de la liste des achats
+Module: app/purchases/stats.py
+Auteur: ERP Fée Maison
+
+Tous les compteurs de l'en-tête de la liste (total, en attente
+d'approbation, payés / non payés, en retard, montant du mois) sont calculés
+en une seule requête SUM(CASE ...) sur la table des achats. Le compteur de
+retard réutilise l'expression SQL de Purchase.is_overdue dans ce même
+parcours.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import case, func
+
+from extensions import db
+from .models import Purchase, PurchaseStatus
+
+# Bons d'achat en attente d'approbation
+PENDING_APPROVAL_STATUSES = (PurchaseStatus.DRAFT, PurchaseStatus.REQUESTED)
+
+
+class PurchaseStatsService:
+    """Compteurs de la liste des achats en une requête."""
+
+    @staticmethod
+    def _count_if(condition):
+        return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+    @classmethod
+    def summary(cls, now=None):
+        """
+        :param now: Instant de référence (retard, mois courant).
+        :return: dict total_purchases, pending_approval, unpaid_purchases,
+                 paid_purchases, overdue, total_amount_month.
+        """
+        now = now or datetime.utcnow()
+        month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+        row = db.session.query(
+            func.count(Purchase.id).label('total_purchases'),
+            cls._count_if(Purchase.status.in_(PENDING_APPROVAL_STATUSES)).label('pending_approval'),
+            cls._count_if(Purchase.is_paid == False).label('unpaid_purchases'),
+            cls._count_if(Purchase.is_paid == True).label('paid_purchases'),
+            cls._count_if(Purchase.is_overdue(now)).label('overdue'),
+            func.coalesce(func.sum(case(
+                (db.and_(Purchase.requested_date >= month_start,
+                         Purchase.status != PurchaseStatus.CANCELLED), Purchase.total_amount),
+                else_=0
+            )), 0).label('total_amount_month')
+        ).one()
+
+        return {
+            'total_purchases': int(row.total_purchases or 0),
+            'pending_approval': int(row.pending_approval or 0),
+            'unpaid_purchases': int(row.unpaid_purchases or 0),
+            'paid_purchases': int(row.paid_purchases or 0),
+            'overdue': int(row.overdue or 0),
+            'total_amount_month': float(row.total_amount_month or 0),
+        }
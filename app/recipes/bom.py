@@ -0,0 +1,226 @@
+"""
+Explosion multi-niveaux des nomenclatures (recettes imbriquées)
+Module: app/recipes/bom.py
+Auteur: ERP Fée Maison
+
+Une ligne de recette peut pointer vers un produit qui possède lui-même une
+recette (ex: crème pâtissière utilisée dans les éclairs). BillOfMaterials
+charge la structure d'adjacence niveau par niveau (une requête par niveau de
+profondeur), puis développe chaque recette jusqu'aux ingrédients bruts avec
+mémoïsation et détection de cycles. La vérification de stock, le calcul des
+coûts et la comptabilisation de la production partagent ce chemin.
+"""
+
+from collections import defaultdict
+from decimal import Decimal
+
+from extensions import db
+
+
+class BomError(ValueError):
+    """Nomenclature inexploitable (cycle, unité incompatible)."""
+
+
+class BomCycleError(BomError):
+    """Une recette se contient elle-même, directement ou via une sous-recette."""
+
+    def __init__(self, recipe_names):
+        self.recipe_names = recipe_names
+        super().__init__("Cycle détecté dans les recettes : " + " → ".join(recipe_names))
+
+
+class BomUnitError(BomError):
+    """L'unité d'une ligne ne se convertit pas dans l'unité de rendement de la sous-recette."""
+
+    def __init__(self, recipe_name, sub_recipe_name, line_unit, yield_unit):
+        self.recipe_name = recipe_name
+        self.sub_recipe_name = sub_recipe_name
+        super().__init__(
+            f"Recette '{recipe_name}' : l'unité « {line_unit} » ne se convertit pas dans l'unité "
+            f"de rendement « {yield_unit} » de la sous-recette '{sub_recipe_name}'."
+        )
+
+
+# Libellés équivalents d'une unité de comptage (unité produit « pièce », rendement « pièces »)
+COUNT_UNIT_ALIASES = {'PIÈCES': 'PIÈCE', 'U': 'PIÈCE', 'UNITÉ': 'PIÈCE', 'UNITÉS': 'PIÈCE'}
+
+
+def _normalize_unit(unit):
+    unit = (unit or '').strip().upper()
+    return COUNT_UNIT_ALIASES.get(unit, unit)
+
+
+def yield_unit_factor(line_unit, yield_unit):
+    """
+    Facteur convertissant une quantité exprimée dans l'unité de la ligne en
+    unités de rendement de la sous-recette (None si aucune conversion connue).
+    """
+    from models import RECIPE_UNIT_COST_FACTORS
+
+    line_unit = _normalize_unit(line_unit)
+    yield_unit = _normalize_unit(yield_unit)
+    if line_unit == yield_unit:
+        return Decimal('1')
+    # (KG, G) -> 0.001 : 1 g de la ligne vaut 0,001 kg de rendement
+    return RECIPE_UNIT_COST_FACTORS.get((yield_unit, line_unit))
+
+
+class BillOfMaterials:
+    """
+    Graphe des recettes chargé à la demande.
+
+    Les vecteurs retournés associent (ingredient_id, labo_key) à un couple
+    (quantité, quantité_coût) : la quantité est exprimée dans l'unité de la
+    recette (celle utilisée pour le stock), la quantité_coût est déjà
+    convertie dans l'unité du cost_price de l'ingrédient.
+    """
+
+    def __init__(self):
+        self.recipes = {}             # recipe_id -> {'name', 'product_id', 'labo', 'yield', 'yield_unit', 'lines'}
+        self.recipe_by_product = {}   # product_id -> recipe_id
+        self._examined_products = set()
+        self._batch_vectors = {}      # recipe_id -> vecteur pour une fournée complète
+
+    # ------------------------------------------------------------------ #
+    # Chargement
+    # ------------------------------------------------------------------ #
+
+    @classmethod
+    def load(cls, product_ids=(), recipe_ids=()):
+        """Construit le graphe nécessaire pour les produits / recettes donnés."""
+        bom = cls()
+        bom.ensure_loaded(product_ids=product_ids, recipe_ids=recipe_ids)
+        return bom
+
+    def ensure_loaded(self, product_ids=(), recipe_ids=()):
+        """Charge les recettes manquantes, puis leurs sous-recettes niveau par niveau."""
+        product_ids = {pid for pid in product_ids if pid} - self._examined_products
+        recipe_ids = {rid for rid in recipe_ids if rid} - set(self.recipes)
+
+        while product_ids or recipe_ids:
+            components = self._load_level(product_ids, recipe_ids)
+            self._examined_products |= product_ids
+            product_ids = components - self._examined_products
+            recipe_ids = set()
+
+    def _load_level(self, product_ids, recipe_ids):
+        from models import Recipe, RecipeIngredient, Product
+        from sqlalchemy import or_
+
+        conditions = []
+        if product_ids:
+            conditions.append(Recipe.product_id.in_(product_ids))
+        if recipe_ids:
+            conditions.append(Recipe.id.in_(recipe_ids))
+
+        rows = db.session.query(
+            Recipe.id,
+            Recipe.name,
+            Recipe.product_id,
+            Recipe.production_location,
+            Recipe.yield_quantity,
+            Recipe.yield_unit,
+            RecipeIngredient.product_id,
+            RecipeIngredient.quantity_needed,
+            RecipeIngredient.unit,
+            Product.unit
+        ).outerjoin(RecipeIngredient, RecipeIngredient.recipe_id == Recipe.id)\
+         .outerjoin(Product, Product.id == RecipeIngredient.product_id)\
+         .filter(or_(*conditions)).all()
+
+        components = set()
+        for (recipe_id, name, product_id, labo_key, yield_quantity, yield_unit,
+             component_id, quantity_needed, recipe_unit, component_unit) in rows:
+            node = self.recipes.get(recipe_id)
+            if node is None:
+                node = self.recipes[recipe_id] = {
+                    'name': name,
+                    'product_id': product_id,
+                    'labo': labo_key,
+                    'yield': Decimal(yield_quantity or 0),
+                    'yield_unit': yield_unit,
+                    'lines': []
+                }
+                if product_id:
+                    self.recipe_by_product[product_id] = recipe_id
+                    self._examined_products.add(product_id)
+            if component_id is not None:
+                node['lines'].append((component_id, Decimal(quantity_needed), recipe_unit, component_unit))
+                components.add(component_id)
+        return components
+
+    # ------------------------------------------------------------------ #
+    # Explosion
+    # ------------------------------------------------------------------ #
+
+    def has_recipe(self, product_id):
+        return product_id in self.recipe_by_product
+
+    def explode_recipe(self, recipe_id, _path=()):
+        """
+        Vecteur des ingrédients bruts pour une fournée complète de la recette.
+
+        :raises BomCycleError: si la recette dépend d'elle-même.
+        :raises BomUnitError: si l'unité d'une ligne ne se convertit pas dans
+                              l'unité de rendement de sa sous-recette.
+        """
+        from models import RECIPE_UNIT_COST_FACTORS
+
+        if recipe_id in self._batch_vectors:
+            return self._batch_vectors[recipe_id]
+        if recipe_id in _path:
+            cycle = list(_path[_path.index(recipe_id):]) + [recipe_id]
+            raise BomCycleError([self.recipes[rid]['name'] for rid in cycle])
+
+        node = self.recipes[recipe_id]
+        path = _path + (recipe_id,)
+        vector = defaultdict(lambda: [Decimal('0'), Decimal('0')])
+
+        for component_id, quantity, recipe_unit, component_unit in node['lines']:
+            sub_recipe_id = self.recipe_by_product.get(component_id)
+            if sub_recipe_id is not None:
+                sub_node = self.recipes[sub_recipe_id]
+                if not sub_node['yield']:
+                    continue
+                sub_vector = self.explode_recipe(sub_recipe_id, path)
+                factor = yield_unit_factor(recipe_unit, sub_node['yield_unit'])
+                if factor is None:
+                    raise BomUnitError(node['name'], sub_node['name'], recipe_unit, sub_node['yield_unit'])
+                scale = quantity * factor / sub_node['yield']
+                for key, (sub_qty, sub_cost_qty) in sub_vector.items():
+                    vector[key][0] += sub_qty * scale
+                    vector[key][1] += sub_cost_qty * scale
+            else:
+                factor = RECIPE_UNIT_COST_FACTORS.get(((component_unit or '').upper(), (recipe_unit or '').upper()), Decimal('1'))
+                key = (component_id, node['labo'])
+                vector[key][0] += quantity
+                vector[key][1] += quantity * factor
+
+        result = {key: (qty, cost_qty) for key, (qty, cost_qty) in vector.items()}
+        self._batch_vectors[recipe_id] = result
+        return result
+
+    def explode_product(self, product_id):
+        """Vecteur des ingrédients bruts pour UNE unité du produit fini (vide si pas de recette)."""
+        recipe_id = self.recipe_by_product.get(product_id)
+        if recipe_id is None:
+            return {}
+        yield_quantity = self.recipes[recipe_id]['yield']
+        if not yield_quantity:
+            return {}
+        return {
+            key: (qty / yield_quantity, cost_qty / yield_quantity)
+            for key, (qty, cost_qty) in self.explode_recipe(recipe_id).items()
+        }
+
+    def check_cycles(self, recipe_id):
+        """Lève BomCycleError (ou BomUnitError) si la recette (déjà chargée) est inexploitable."""
+        self._batch_vectors.pop(recipe_id, None)
+        self.explode_recipe(recipe_id)
+
+
+def products_with_recipe_ids():
+    """Identifiants des produits possédant une recette (utilisables comme sous-recette)."""
+    from models import Recipe
+    return {product_id for (product_id,) in db.session.query(Recipe.product_id)
+            .filter(Recipe.product_id.isnot(None)).all()}
@@ -0,0 +1,135 @@
+"""
+Coûts de revient matérialisés des recettes
+Module: app/recipes/costing.py
+Auteur: ERP Fée Maison
+
+Recipe.stored_total_cost et Recipe.stored_cost_per_unit sont recalculés
+uniquement pour les recettes touchées quand le PMP (cost_price) d'un
+ingrédient change. L'index inverse produit -> recettes est la table
+recipe_ingredients elle-même (index sur product_id), remonté niveau par
+niveau pour atteindre les recettes qui utilisent une sous-recette.
+"""
+
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy import bindparam, update
+from sqlalchemy.orm.util import identity_key
+
+from extensions import db
+from app.recipes.bom import BillOfMaterials
+
+
+def recipes_using_products(product_ids):
+    """
+    Index inverse : recettes qui utilisent au moins un des produits donnés,
+    directement ou via une sous-recette (crème pâtissière -> éclair).
+
+    :param product_ids: Identifiants de produits (ingrédients).
+    :return: set d'identifiants de recettes.
+    """
+    from models import Recipe, RecipeIngredient
+
+    pending = {pid for pid in product_ids if pid}
+    seen_products = set(pending)
+    recipe_ids = set()
+    while pending:
+        rows = db.session.query(Recipe.id, Recipe.product_id)\
+            .join(RecipeIngredient, RecipeIngredient.recipe_id == Recipe.id)\
+            .filter(RecipeIngredient.product_id.in_(pending))\
+            .distinct().all()
+        recipe_ids.update(recipe_id for recipe_id, _ in rows)
+        pending = {product_id for _, product_id in rows if product_id} - seen_products
+        seen_products |= pending
+    return recipe_ids
+
+
+def compute_recipe_costs(recipe_ids, bom=None):
+    """
+    Calcule le coût total et le coût unitaire de plusieurs recettes, sous-recettes
+    développées jusqu'aux ingrédients bruts.
+
+    :param recipe_ids: Identifiants des recettes.
+    :param bom: BillOfMaterials déjà chargé, si disponible.
+    :return: dict {recipe_id: (total_cost, cost_per_unit)} en Decimal.
+    :raises BomError: si une recette se contient elle-même ou mélange des unités incompatibles.
+    """
+    from models import Product
+
+    recipe_ids = list(set(recipe_ids))
+    if not recipe_ids:
+        return {}
+    if bom is None:
+        bom = BillOfMaterials.load(recipe_ids=recipe_ids)
+    else:
+        bom.ensure_loaded(recipe_ids=recipe_ids)
+
+    vectors = {recipe_id: bom.explode_recipe(recipe_id) for recipe_id in recipe_ids if recipe_id in bom.recipes}
+    ingredient_ids = {ingredient_id for vector in vectors.values() for ingredient_id, _ in vector}
+    prices = {}
+    if ingredient_ids:
+        prices = dict(db.session.query(Product.id, Product.cost_price)
+                      .filter(Product.id.in_(ingredient_ids)).all())
+
+    costs = {}
+    for recipe_id, vector in vectors.items():
+        total = Decimal('0.0')
+        for (ingredient_id, _), (_, cost_quantity) in vector.items():
+            cost_price = prices.get(ingredient_id)
+            if cost_price:
+                total += cost_quantity * Decimal(cost_price)
+        yield_quantity = bom.recipes[recipe_id]['yield']
+        per_unit = total / yield_quantity if yield_quantity > 0 else Decimal('0.0')
+        costs[recipe_id] = (total, per_unit)
+    return costs
+
+
+def recompute_recipe_costs(recipe_ids):
+    """
+    Recalcule et enregistre les coûts matérialisés des recettes données.
+    L'appelant reste responsable du commit.
+
+    :return: Nombre de recettes mises à jour.
+    """
+    from models import Recipe
+
+    costs = compute_recipe_costs(recipe_ids)
+    if not costs:
+        return 0
+
+    table = Recipe.__table__
+    now = datetime.utcnow()
+    stmt = update(table)\
+        .where(table.c.id == bindparam('b_id'))\
+        .values(stored_total_cost=bindparam('b_total'),
+                stored_cost_per_unit=bindparam('b_per_unit'),
+                cost_updated_at=bindparam('b_now'))
+    db.session.execute(stmt, [
+        {'b_id': recipe_id, 'b_total': total, 'b_per_unit': per_unit, 'b_now': now}
+        for recipe_id, (total, per_unit) in costs.items()
+    ])
+
+    # Les recettes déjà chargées dans la session doivent relire leurs coûts
+    for recipe_id in costs:
+        obj = db.session.identity_map.get(identity_key(Recipe, recipe_id))
+        if obj is not None:
+            db.session.expire(obj, ['stored_total_cost', 'stored_cost_per_unit', 'cost_updated_at'])
+    return len(costs)
+
+
+def refresh_costs_for_products(product_ids):
+    """
+    Point d'entrée après une mise à jour de PMP : recalcule seulement les
+    recettes qui utilisent les produits modifiés.
+
+    :return: Nombre de recettes mises à jour.
+    """
+    return recompute_recipe_costs(recipes_using_products(product_ids))
+
+
+def recompute_all_recipe_costs():
+    """Recalcule toutes les recettes (initialisation du cache)."""
+    from models import Recipe
+
+    recipe_ids = [recipe_id for (recipe_id,) in db.session.query(Recipe.id).all()]
+    return recompute_recipe_costs(recipe_ids)
@@ -12,20 +12,29 @@ from wtforms import (
 )
 from wtforms.validators import DataRequired, Length, Optional, NumberRange
 from wtforms.widgets import HiddenInput
-from models import Product, Recipe
-from sqlalchemy import or_
 
 # ### DEBUT DE LA CORRECTION ###
 # On importe notre nouveau manager pour l'utiliser dans le formulaire
 from app.stock.stock_manager import StockLocationManager
 # ### FIN DE LA CORRECTION ###
+from app.products.catalogue import ProductCatalogue
 
 
-def ingredient_product_query_factory():
-    """
-    Retourne une requête pour obtenir tous les produits de type 'ingrédient'.
-    """
-    return Product.query.filter_by(product_type='ingredient').order_by(Product.name)
+def _is_recipe_component(entry):
+    return entry.product_type == 'ingredient' or entry.has_recipe
+
+def recipe_component_entries():
+    """Entrées du catalogue utilisables comme ingrédient (ingrédients et sous-recettes)."""
+    return ProductCatalogue.choices(
+        'recipes.components',
+        lambda entries: tuple(entry for entry in entries if _is_recipe_component(entry))
+    )
+
+def _ingredient_choices(entries):
+    return ((0, '-- Choisir un ingrédient --'),) + tuple(
+        (entry.id, f"{entry.name} ({entry.unit})")
+        for entry in entries if _is_recipe_component(entry)
+    )
 
 class IngredientForm(Form):
     """
@@ -39,8 +48,8 @@ class IngredientForm(Form):
 
     def __init__(self, *args, **kwargs):
         super(IngredientForm, self).__init__(*args, **kwargs)
-        self.product.choices = [(p.id, f"{p.name} ({p.unit})") for p in ingredient_product_query_factory().all()]
-        self.product.choices.insert(0, (0, '-- Choisir un ingrédient --'))
+        # Liste partagée par toutes les lignes (catalogue en mémoire, aucune requête)
+        self.product.choices = ProductCatalogue.choices('recipes.ingredient_choices', _ingredient_choices)
 
 class RecipeForm(FlaskForm):
     """
@@ -78,15 +87,16 @@ class RecipeForm(FlaskForm):
     submit = SubmitField('Enregistrer la Recette')
 
     def __init__(self, *args, **kwargs):
+        current_product_id = kwargs.pop('current_product_id', None)
         super(RecipeForm, self).__init__(*args, **kwargs)
         
         recipe_obj = kwargs.get('obj')
-        query = Product.query.filter_by(product_type='finished')
-        
-        if recipe_obj and recipe_obj.product_id:
-            query = query.filter(or_(Product.recipe_definition == None, Product.id == recipe_obj.product_id))
-        else:
-            query = query.filter(Product.recipe_definition == None)
+        if recipe_obj is not None and current_product_id is None:
+            current_product_id = recipe_obj.product_id
         
-        self.finished_product.choices = [(p.id, p.name) for p in query.order_by(Product.name).all()]
-        self.finished_product.choices.insert(0, (0, '-- Aucun --'))
\ No newline at end of file
+        # Produits finis sans recette (plus celui de la recette éditée)
+        self.finished_product.choices = [(0, '-- Aucun --')] + [
+            (entry.id, entry.name)
+            for entry in ProductCatalogue.snapshot().entries
+            if entry.product_type == 'finished' and (not entry.has_recipe or entry.id == current_product_id)
+        ]
\ No newline at end of file
@@ -4,7 +4,9 @@ from flask_wtf import FlaskForm
 from wtforms import SubmitField
 from extensions import db
 # from models import Recipe, Product, RecipeIngredient # <-- LIGNE SUPPRIMÉE
-from .forms import RecipeForm, ingredient_product_query_factory
+from .forms import RecipeForm, recipe_component_entries
+from .bom import BomError
+from .costing import recompute_recipe_costs, recipes_using_products
 from decorators import admin_required
 import json
 
@@ -61,15 +63,14 @@ def new_recipe():
 
     form = RecipeForm()
     
-    all_ingredients = ingredient_product_query_factory().all()
     ingredients_json = [
         {
-            'id': p.id, 
-            'name': p.name, 
-            'unit': p.unit, 
-            'cost_price': float(p.cost_price) if p.cost_price is not None else 0.0
+            'id': entry.id, 
+            'name': entry.name, 
+            'unit': entry.unit, 
+            'cost_price': entry.cost_price
         } 
-        for p in all_ingredients
+        for entry in recipe_component_entries()
     ]
 
     if form.validate_on_submit():
@@ -98,9 +99,13 @@ def new_recipe():
                     )
                     db.session.add(ingredient)
 
+            recompute_recipe_costs([recipe.id])
             db.session.commit()
             flash(f"Recette '{recipe.name}' créée avec succès.", 'success')
             return redirect(url_for('recipes.view_recipe', recipe_id=recipe.id))
+        except BomError as e:
+            db.session.rollback()
+            flash(str(e), 'danger')
         except Exception as e:
             db.session.rollback()
             current_app.logger.error(f"Erreur lors de la création de la recette: {e}", exc_info=True)
@@ -121,17 +126,33 @@ def edit_recipe(recipe_id):
     # ### FIN DE LA CORRECTION ###
 
     recipe = db.session.get(Recipe, recipe_id) or abort(404)
-    form = RecipeForm(obj=recipe)
+    # Lignes lues en une requête (obj=recipe chargerait chaque Product via recipe.ingredients)
+    ingredient_rows = [
+        {'id': row.id, 'product': row.product_id, 'quantity_needed': row.quantity_needed,
+         'unit': row.unit, 'notes': row.notes}
+        for row in db.session.query(
+            RecipeIngredient.id, RecipeIngredient.product_id, RecipeIngredient.quantity_needed,
+            RecipeIngredient.unit, RecipeIngredient.notes
+        ).filter(RecipeIngredient.recipe_id == recipe.id).order_by(RecipeIngredient.id)
+    ]
+    form = RecipeForm(data={
+        'name': recipe.name,
+        'description': recipe.description,
+        'production_location': recipe.production_location,
+        'yield_quantity': recipe.yield_quantity,
+        'yield_unit': recipe.yield_unit,
+        'finished_product': recipe.product_id,
+        'ingredients': ingredient_rows
+    }, current_product_id=recipe.product_id)
     
-    all_ingredients = ingredient_product_query_factory().all()
     ingredients_json = [
         {
-            'id': p.id, 
-            'name': p.name, 
-            'unit': p.unit, 
-            'cost_price': float(p.cost_price) if p.cost_price is not None else 0.0
+            'id': entry.id, 
+            'name': entry.name, 
+            'unit': entry.unit, 
+            'cost_price': entry.cost_price
         } 
-        for p in all_ingredients
+        for entry in recipe_component_entries()
     ]
 
     if form.validate_on_submit():
@@ -158,9 +179,14 @@ def edit_recipe(recipe_id):
                     )
                     db.session.add(ingredient)
 
+            # Les recettes qui utilisent celle-ci comme sous-recette changent aussi de coût
+            recompute_recipe_costs({recipe.id} | recipes_using_products([recipe.product_id]))
             db.session.commit()
             flash(f"Recette '{recipe.name}' mise à jour avec succès.", 'success')
             return redirect(url_for('recipes.view_recipe', recipe_id=recipe.id))
+        except BomError as e:
+            db.session.rollback()
+            flash(str(e), 'danger')
         except Exception as e:
             db.session.rollback()
             current_app.logger.error(f"Erreur lors de la mise à jour de la recette {recipe_id}: {e}", exc_info=True)
@@ -176,15 +202,7 @@ def edit_recipe(recipe_id):
         # Ce champ sera ajouté au formulaire à la Tâche 3
         form.production_location.data = recipe.production_location
         
-        while len(form.ingredients.entries) > 0:
-            form.ingredients.pop_entry()
-        for item in recipe.ingredients:
-            form.ingredients.append_entry({
-                'product': item.product_id,
-                'quantity_needed': item.quantity_needed,
-                'unit': item.unit,
-                'notes': item.notes
-            })
+        # Les lignes d'ingrédients ont été chargées à la construction du formulaire
 
     return render_template('recipes/recipe_form.html', 
                          form=form, 
@@ -0,0 +1,169 @@
+/**
+ * Mises à jour incrémentales des écrans (production, magasin, stocks)
+ * Fichier: app/static/js/dashboards/changefeed.js
+ * Auteur: ERP Fée Maison
+ *
+ * L'écran connaît la version du flux de changements avec laquelle il a été
+ * rendu. Le flux SSE /dashboard/api/changes/stream signale chaque nouvelle
+ * version ; l'écran demande alors /dashboard/api/changes?since=<version> et
+ * ne remplace que les cartes de commande modifiées. Sans EventSource (ou en
+ * cas d'erreurs répétées), une interrogation périodique prend le relais.
+ */
+(function(window, document) {
+    'use strict';
+
+    const CHANGES_URL = '/dashboard/api/changes';
+    const STREAM_URL = '/dashboard/api/changes/stream';
+    const POLL_INTERVAL = 15000;
+    const MAX_STREAM_ERRORS = 5;
+
+    function sectionContainer(section) {
+        return document.querySelector(`[data-section="${section}"]`);
+    }
+
+    function dueTime(element) {
+        return element.dataset.dueTime ? new Date(element.dataset.dueTime).getTime() : Infinity;
+    }
+
+    function removeCard(orderId) {
+        document.querySelectorAll(`[data-section] > [data-order-id="${orderId}"]`)
+            .forEach(card => card.remove());
+    }
+
+    // Insère la carte à sa place (tri par échéance, comme le rendu serveur)
+    function insertCard(container, html) {
+        const template = document.createElement('template');
+        template.innerHTML = html.trim();
+        const card = template.content.firstElementChild;
+        if (!card) {
+            return null;
+        }
+        const due = dueTime(card);
+        const next = Array.from(container.children).find(other => dueTime(other) > due);
+        container.insertBefore(card, next || null);
+        return card;
+    }
+
+    // Compteurs et états vides recalculés à partir des cartes affichées
+    function refreshCounts() {
+        let total = 0;
+        document.querySelectorAll('[data-section]').forEach(container => {
+            const section = container.dataset.section;
+            const count = container.children.length;
+            total += count;
+            document.querySelectorAll(`[data-count-for="${section}"]`)
+                .forEach(el => { el.textContent = count; });
+            document.querySelectorAll(`[data-empty-for="${section}"]`)
+                .forEach(el => el.classList.toggle('d-none', count > 0));
+        });
+        document.querySelectorAll('[data-count-for="total"]')
+            .forEach(el => { el.textContent = total; });
+    }
+
+    function applyCards(data) {
+        const added = [];
+        (data.removed || []).forEach(removeCard);
+        (data.cards || []).forEach(item => {
+            const isNew = !document.querySelector(`[data-section] > [data-order-id="${item.id}"]`);
+            removeCard(item.id);
+            const container = sectionContainer(item.section);
+            if (container) {
+                const card = insertCard(container, item.html);
+                if (card && isNew) {
+                    added.push(card);
+                }
+            }
+        });
+        refreshCounts();
+        return added;
+    }
+
+    /**
+     * Abonne l'écran au flux de changements.
+     *
+     * options.version   Version avec laquelle la page a été rendue
+     * options.view      'production' | 'shop' pour recevoir les cartes
+     * options.onChange  function(data, addedCards) appelée après chaque changement
+     */
+    function subscribe(options) {
+        let version = Number(options.version) || 0;
+        let fetching = false;
+        let pending = false;
+        let pollTimer = null;
+        let streamErrors = 0;
+
+        function fetchChanges() {
+            if (fetching) {
+                pending = true;
+                return;
+            }
+            fetching = true;
+            const params = new URLSearchParams({since: version});
+            if (options.view) {
+                params.set('view', options.view);
+            }
+            fetch(`${CHANGES_URL}?${params}`, {credentials: 'same-origin', headers: {'Accept': 'application/json'}})
+                .then(response => {
+                    if (!response.ok) {
+                        throw new Error(`HTTP ${response.status}`);
+                    }
+                    return response.json();
+                })
+                .then(data => {
+                    if (data.reset) {
+                        window.location.reload();
+                        return;
+                    }
+                    if (data.version === version) {
+                        return;
+                    }
+                    version = data.version;
+                    const added = options.view ? applyCards(data) : [];
+                    if (options.onChange) {
+                        options.onChange(data, added);
+                    }
+                })
+                .catch(error => console.warn('Flux de changements indisponible:', error))
+                .finally(() => {
+                    fetching = false;
+                    if (pending) {
+                        pending = false;
+                        fetchChanges();
+                    }
+                });
+        }
+
+        function startPolling() {
+            if (!pollTimer) {
+                pollTimer = setInterval(fetchChanges, POLL_INTERVAL);
+            }
+        }
+
+        if (!window.EventSource) {
+            startPolling();
+            return;
+        }
+
+        const source = new EventSource(`${STREAM_URL}?since=${version}`);
+        source.addEventListener('change', event => {
+            streamErrors = 0;
+            if (Number(event.data) !== version) {
+                fetchChanges();
+            }
+        });
+        source.addEventListener('open', () => {
+            streamErrors = 0;
+            // Reconnexion : rattraper ce qui a pu être manqué
+            fetchChanges();
+        });
+        source.addEventListener('error', () => {
+            streamErrors += 1;
+            if (streamErrors >= MAX_STREAM_ERRORS) {
+                source.close();
+                startPolling();
+            }
+        });
+    }
+
+    window.DashboardChangeFeed = {subscribe: subscribe, refreshCounts: refreshCounts};
+})(window, document);
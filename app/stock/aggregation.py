@@ -0,0 +1,114 @@
+"""
+Agrégations SQL pour les tableaux de bord de stock
+Module: app/stock/aggregation.py
+Auteur: ERP Fée Maison
+
+Les totaux par localisation, les compteurs de stock bas et de rupture sont
+calculés en une seule requête SUM(CASE ...) côté base de données, au lieu de
+charger tous les produits et de boucler en Python.
+"""
+
+from sqlalchemy import func, case, or_
+from extensions import db
+
+
+class StockAggregationService:
+    """
+    Calcule les statistiques des 4 stocks directement en SQL.
+    Le coût d'une vue ne dépend plus de la taille du catalogue.
+    """
+
+    # Clé de localisation -> (colonne stock, colonne seuil)
+    LOCATION_COLUMNS = {
+        'comptoir': ('stock_comptoir', 'seuil_min_comptoir'),
+        'ingredients_local': ('stock_ingredients_local', 'seuil_min_ingredients_local'),
+        'ingredients_magasin': ('stock_ingredients_magasin', 'seuil_min_ingredients_magasin'),
+        'consommables': ('stock_consommables', 'seuil_min_consommables'),
+    }
+
+    @classmethod
+    def _stock_expr(cls, location_key):
+        from models import Product
+        stock_col, _ = cls.LOCATION_COLUMNS[location_key]
+        return func.coalesce(getattr(Product, stock_col), 0)
+
+    @classmethod
+    def _low_stock_condition(cls, location_key, default_threshold):
+        """Stock <= seuil ; un seuil nul ou absent prend la valeur par défaut."""
+        from models import Product
+        _, seuil_col = cls.LOCATION_COLUMNS[location_key]
+        threshold = func.coalesce(func.nullif(getattr(Product, seuil_col), 0), default_threshold)
+        return cls._stock_expr(location_key) <= threshold
+
+    @classmethod
+    def _total_stock_expr(cls):
+        return sum(cls._stock_expr(key) for key in cls.LOCATION_COLUMNS)
+
+    @classmethod
+    def _any_low_condition(cls, default_threshold):
+        return or_(*[cls._low_stock_condition(key, default_threshold) for key in cls.LOCATION_COLUMNS])
+
+    @classmethod
+    def get_location_summary(cls, default_threshold=5):
+        """
+        Retourne en une seule requête les agrégats de tous les stocks.
+
+        :param default_threshold: Seuil utilisé quand seuil_min_* est vide ou nul.
+        :return: dict avec 'locations' (valeur et nombre de stocks bas par
+                 localisation), 'total_value', 'low_stock_count' (produits bas
+                 dans au moins une localisation) et 'out_of_stock_count'.
+        """
+        from models import Product
+
+        cost = func.coalesce(Product.cost_price, 0)
+        columns = []
+        for key in cls.LOCATION_COLUMNS:
+            columns.append(func.coalesce(func.sum(cls._stock_expr(key) * cost), 0).label(f'value_{key}'))
+            columns.append(func.coalesce(func.sum(case(
+                (cls._low_stock_condition(key, default_threshold), 1), else_=0
+            )), 0).label(f'low_{key}'))
+        columns.append(func.coalesce(func.sum(case(
+            (cls._any_low_condition(default_threshold), 1), else_=0
+        )), 0).label('low_any'))
+        columns.append(func.coalesce(func.sum(case(
+            (cls._total_stock_expr() <= 0, 1), else_=0
+        )), 0).label('out_of_stock'))
+
+        row = db.session.query(*columns).select_from(Product).one()
+
+        locations = {
+            key: {
+                'value': float(getattr(row, f'value_{key}') or 0),
+                'low_count': int(getattr(row, f'low_{key}') or 0),
+            }
+            for key in cls.LOCATION_COLUMNS
+        }
+        return {
+            'locations': locations,
+            'total_value': sum(loc['value'] for loc in locations.values()),
+            'low_stock_count': int(row.low_any or 0),
+            'out_of_stock_count': int(row.out_of_stock or 0),
+        }
+
+    @classmethod
+    def _display_columns(cls):
+        from models import Product
+        return (Product.id, Product.name, Product.sku, Product.quantity_in_stock)
+
+    @classmethod
+    def get_low_stock_rows(cls, limit, default_threshold=5):
+        """Produits bas dans au moins une localisation (colonnes d'affichage uniquement)."""
+        from models import Product
+        return db.session.query(*cls._display_columns())\
+            .filter(cls._any_low_condition(default_threshold))\
+            .order_by(Product.name)\
+            .limit(limit).all()
+
+    @classmethod
+    def get_out_of_stock_rows(cls, limit):
+        """Produits en rupture totale (toutes localisations confondues)."""
+        from models import Product
+        return db.session.query(*cls._display_columns())\
+            .filter(cls._total_stock_expr() <= 0)\
+            .order_by(Product.name)\
+            .limit(limit).all()
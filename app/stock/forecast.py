@@ -0,0 +1,257 @@
+"""
+Prévision de consommation et points de commande dynamiques
+Module: app/stock/forecast.py
+Auteur: ERP Fée Maison
+
+Les sorties de stock du journal (ventes comptoir, consommation des recettes
+à la production, sorties et transferts sortants) donnent, par produit et
+localisation, une consommation journalière sur une fenêtre glissante. On en
+déduit :
+
+- le débit moyen et son écart-type journalier ;
+- le point de commande : débit × délai de réapprovisionnement + stock de
+  sécurité (facteur de service × écart-type × √délai) ;
+- les jours de couverture du stock actuel.
+
+Les résultats sont stockés dans stock_forecasts. Le rafraîchissement est
+incrémental (filigrane sur l'identifiant des mouvements) : seuls les produits
+touchés depuis le dernier passage sont recalculés, avec un recalcul complet
+une fois par jour puisque la fenêtre glisse. Il est lancé par la commande
+`flask refresh-stock-forecast`, à planifier (cron) ; les tableaux de bord
+lisent la table sans rien recalculer.
+"""
+
+import math
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from sqlalchemy import and_, case, func
+
+from extensions import db
+from .models import StockForecast, StockLocationType, StockMovement, StockMovementType
+from .stock_manager import StockLocationManager
+
+
+class ConsumptionForecast:
+    """Maintenance et lecture des prévisions de consommation (stock_forecasts)."""
+
+    WATERMARK = 'stock_forecast'
+    WINDOW_DAYS = 28
+    MIN_WINDOW_DAYS = 7        # Produit récent : fenêtre raccourcie, mais pas en dessous
+    SERVICE_FACTOR = 1.65      # ~95 % de cycles sans rupture
+    REVIEW_DAYS = 14           # Couverture visée par une suggestion de réapprovisionnement
+
+    # Délai de réapprovisionnement par localisation, en jours
+    LEAD_TIME_DAYS = {
+        'ingredients_magasin': 3,   # Fournisseurs
+        'ingredients_local': 1,     # Transfert depuis le magasin
+        'comptoir': 1,              # Production du labo
+        'consommables': 7,          # Fournisseurs d'emballages
+    }
+
+    CONSUMPTION_TYPES = (
+        StockMovementType.SORTIE,
+        StockMovementType.VENTE,
+        StockMovementType.PRODUCTION,
+        StockMovementType.TRANSFERT_SORTIE,
+    )
+
+    # ------------------------------------------------------------------ #
+    # Maintenance
+    # ------------------------------------------------------------------ #
+
+    @classmethod
+    def refresh(cls, now=None):
+        """
+        Recalcule les produits touchés depuis le dernier rafraîchissement
+        (tout le catalogue au premier passage de la journée).
+        L'appelant reste responsable du commit.
+
+        :return: Nombre de prévisions écrites.
+        """
+        from models import RollupWatermark
+
+        now = now or datetime.utcnow()
+        watermark = db.session.query(RollupWatermark)\
+            .filter(RollupWatermark.name == cls.WATERMARK)\
+            .with_for_update().first()
+        if watermark is None:
+            watermark = RollupWatermark(name=cls.WATERMARK, last_movement_id=0)
+            db.session.add(watermark)
+
+        last_id = db.session.query(func.max(StockMovement.id)).scalar() or 0
+        full = not watermark.last_movement_id or watermark.refreshed_at is None \
+            or watermark.refreshed_at.date() < now.date()
+
+        if full:
+            written = cls.rebuild(now=now)
+        elif last_id > watermark.last_movement_id:
+            product_ids = [product_id for (product_id,) in db.session.query(StockMovement.product_id).filter(
+                StockMovement.id > watermark.last_movement_id,
+                StockMovement.id <= last_id
+            ).distinct()]
+            written = cls.rebuild(product_ids, now=now)
+        else:
+            written = 0
+
+        watermark.last_movement_id = last_id
+        watermark.refreshed_at = now
+        return written
+
+    @classmethod
+    def rebuild(cls, product_ids=None, now=None):
+        """
+        Recalcule entièrement les prévisions des produits donnés (tous si None).
+        L'appelant reste responsable du commit.
+
+        :return: Nombre de prévisions écrites.
+        """
+        from models import Product
+
+        now = now or datetime.utcnow()
+        today = now.date()
+        window_start = datetime.combine(today - timedelta(days=cls.WINDOW_DAYS - 1), time.min)
+
+        day = func.date(StockMovement.created_at)
+        query = db.session.query(
+            StockMovement.product_id,
+            StockMovement.stock_location,
+            day,
+            func.sum(-StockMovement.quantity),
+            func.max(StockMovement.created_at)
+        ).filter(
+            StockMovement.movement_type.in_(cls.CONSUMPTION_TYPES),
+            StockMovement.quantity < 0,
+            StockMovement.created_at >= window_start
+        )
+        if product_ids is not None:
+            product_ids = list(product_ids)
+            if not product_ids:
+                return 0
+            query = query.filter(StockMovement.product_id.in_(product_ids))
+
+        series = defaultdict(dict)   # (product_id, location) -> {jour: quantité}
+        last_consumed = {}
+        for product_id, location, movement_day, quantity, last_at in \
+                query.group_by(StockMovement.product_id, StockMovement.stock_location, day).all():
+            key = (product_id, location)
+            series[key][str(movement_day)] = float(quantity or 0)
+            last_consumed[key] = max(last_consumed.get(key, last_at), last_at)
+
+        stock_columns = {
+            location: getattr(Product, StockLocationManager.get_stock_column(location.value))
+            for location in StockLocationType
+        }
+        stock_rows = {}
+        consumed_ids = {product_id for product_id, _ in series}
+        if consumed_ids:
+            stock_rows = {
+                row.id: row for row in db.session.query(Product.id, *stock_columns.values())
+                .filter(Product.id.in_(consumed_ids))
+            }
+
+        rows = []
+        for (product_id, location), per_day in series.items():
+            stock_row = stock_rows.get(product_id)
+            if stock_row is None:
+                continue
+            first_day = datetime.strptime(min(per_day), '%Y-%m-%d').date()
+            window = min(cls.WINDOW_DAYS, max(cls.MIN_WINDOW_DAYS, (today - first_day).days + 1))
+            total = sum(per_day.values())
+            mean = total / window
+            variance = max(sum(q * q for q in per_day.values()) / window - mean * mean, 0.0)
+            stddev = math.sqrt(variance)
+
+            lead_time = cls.LEAD_TIME_DAYS.get(location.value, 1)
+            reorder_point = mean * lead_time + cls.SERVICE_FACTOR * stddev * math.sqrt(lead_time)
+            stock = float(getattr(stock_row, stock_columns[location].key) or 0)
+            rows.append({
+                'product_id': product_id,
+                'stock_location': location,
+                'avg_daily_consumption': round(mean, 4),
+                'stddev_daily_consumption': round(stddev, 4),
+                'window_days': window,
+                'reorder_point': round(reorder_point, 3),
+                'stock_level': stock,
+                'days_of_cover': round(max(stock, 0.0) / mean, 1) if mean > 0 else None,
+                'last_consumed_at': last_consumed[(product_id, location)],
+                'computed_at': now,
+            })
+
+        table = StockForecast.__table__
+        delete = table.delete()
+        if product_ids is not None:
+            delete = delete.where(table.c.product_id.in_(product_ids))
+        db.session.execute(delete)
+        if rows:
+            db.session.execute(table.insert(), rows)
+        return len(rows)
+
+    # ------------------------------------------------------------------ #
+    # Lecture
+    # ------------------------------------------------------------------ #
+
+    @staticmethod
+    def reorder_points(location_key, product_ids=None):
+        """:return: dict {product_id: point de commande} pour une localisation."""
+        query = db.session.query(StockForecast.product_id, StockForecast.reorder_point)\
+            .filter(StockForecast.stock_location == StockLocationType(location_key))
+        if product_ids is not None:
+            query = query.filter(StockForecast.product_id.in_(list(product_ids)))
+        return {product_id: float(point or 0) for product_id, point in query.all()}
+
+    @classmethod
+    def alerts(cls, location_key, product_type=None, default_threshold=0):
+        """
+        Produits d'une localisation dont le stock est au plus au seuil effectif :
+        le plus grand du seuil saisi (ou default_threshold) et du point de
+        commande calculé. La quantité suggérée couvre REVIEW_DAYS de consommation
+        au-delà du seuil (au moins le seuil lui-même si rien n'est consommé).
+
+        :return: Liste de dicts triée par jours de couverture puis nom.
+        """
+        from models import Product
+
+        stock_col = getattr(Product, StockLocationManager.get_stock_column(location_key))
+        seuil_col = getattr(Product, f'seuil_min_{location_key}')
+        stock = func.coalesce(stock_col, 0)
+        seuil = func.coalesce(func.nullif(seuil_col, 0), default_threshold)
+        reorder_point = func.coalesce(StockForecast.reorder_point, 0)
+        threshold = case((reorder_point > seuil, reorder_point), else_=seuil)
+
+        query = db.session.query(
+            Product.id,
+            Product.name,
+            Product.unit,
+            stock.label('stock'),
+            threshold.label('threshold'),
+            StockForecast.avg_daily_consumption,
+            StockForecast.days_of_cover
+        ).outerjoin(StockForecast, and_(
+            StockForecast.product_id == Product.id,
+            StockForecast.stock_location == StockLocationType(location_key)
+        )).filter(threshold > 0, stock <= threshold)
+        if product_type:
+            query = query.filter(Product.product_type == product_type)
+
+        alerts = []
+        for row in query.all():
+            current = float(row.stock or 0)
+            limit = float(row.threshold or 0)
+            daily = float(row.avg_daily_consumption or 0)
+            order_up_to = limit + max(daily * cls.REVIEW_DAYS, limit)
+            alerts.append({
+                'product_id': row.id,
+                'product_name': row.name,
+                'unit': row.unit or 'unités',
+                'stock': current,
+                'threshold': round(limit, 3),
+                'avg_daily_consumption': daily,
+                'days_of_cover': row.days_of_cover,
+                'suggested_quantity': round(max(order_up_to - current, 0.0), 3),
+            })
+        alerts.sort(key=lambda alert: (
+            alert['days_of_cover'] if alert['days_of_cover'] is not None else float('inf'),
+            alert['product_name'].lower()
+        ))
+        return alerts
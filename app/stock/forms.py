@@ -5,15 +5,25 @@ Auteur: ERP Fée Maison
 """
 
 from flask_wtf import FlaskForm
-from wtforms import StringField, FloatField, SubmitField, SelectField, TextAreaField, FieldList, FormField, HiddenField, IntegerField
+from flask_wtf.file import FileField, FileRequired, FileAllowed
+from wtforms import StringField, FloatField, SubmitField, SelectField, TextAreaField, FieldList, FormField, HiddenField, IntegerField, BooleanField
 from wtforms.validators import DataRequired, Optional, Length, NumberRange, ValidationError
-from wtforms_sqlalchemy.fields import QuerySelectField
 from models import Product, User
+from app.products.catalogue import ProductCatalogue, coerce_product_id
 from .models import StockLocationType
 
-# Factory pour lister tous les produits
-def all_product_query_factory():
-    return Product.query.order_by(Product.name)
+# Choix de tous les produits, servis par le catalogue en mémoire (partagés entre formulaires)
+def all_product_choices():
+    return ProductCatalogue.choices(
+        'stock.all_products',
+        lambda entries: tuple((entry.id, entry.name) for entry in entries)
+    )
+
+def all_product_choices_with_blank():
+    return ProductCatalogue.choices(
+        'stock.all_products_blank',
+        lambda entries: (('', ''),) + tuple((entry.id, entry.name) for entry in entries)
+    )
 
 # Factory pour lister les produits actifs avec stock
 def active_products_with_stock():
@@ -27,14 +37,14 @@ def all_users_query_factory():
 
 class StockAdjustmentForm(FlaskForm):
     """Formulaire d'ajustement de stock (ancien - conservé pour compatibilité)"""
-    product = QuerySelectField('Produit', query_factory=all_product_query_factory, get_label='name', allow_blank=False)
+    product = SelectField('Produit', coerce=coerce_product_id, choices=all_product_choices, validators=[DataRequired()])
     quantity = FloatField('Changement de quantité (+/-)', validators=[DataRequired()])
     reason = StringField('Raison', validators=[Optional(), Length(max=255)])
     submit = SubmitField('Ajuster le stock')
 
 class QuickStockEntryForm(FlaskForm):
     """Formulaire de réception rapide (étendu avec localisation)"""
-    product = QuerySelectField('Produit', query_factory=all_product_query_factory, get_label='name', allow_blank=False)
+    product = SelectField('Produit', coerce=coerce_product_id, choices=all_product_choices, validators=[DataRequired()])
     quantity_received = FloatField('Quantité reçue', validators=[DataRequired(), NumberRange(min=0.01)])
     location_type = SelectField('Localisation', choices=[
         ('ingredients_magasin', 'Stock Magasin (Réserve)'),
@@ -50,7 +60,7 @@ class QuickStockEntryForm(FlaskForm):
 
 class MultiLocationAdjustmentForm(FlaskForm):
     """Formulaire d'ajustement avec sélection de localisation"""
-    product = QuerySelectField('Produit', query_factory=all_product_query_factory, get_label='name', allow_blank=False)
+    product = SelectField('Produit', coerce=coerce_product_id, choices=all_product_choices, validators=[DataRequired()])
     location_type = SelectField('Localisation', choices=[
         ('comptoir', 'Stock Comptoir'),
         ('ingredients_local', 'Stock Local Production'),
@@ -71,7 +81,7 @@ class MultiLocationAdjustmentForm(FlaskForm):
 class StockTransferLineForm(FlaskForm):
     """Formulaire pour une ligne de transfert"""
     product_id = IntegerField('Produit ID', validators=[Optional()])
-    product = QuerySelectField('Produit', query_factory=all_product_query_factory, get_label='name', allow_blank=True)
+    product = SelectField('Produit', coerce=coerce_product_id, choices=all_product_choices_with_blank, validators=[Optional()])
     quantity_requested = FloatField('Quantité', validators=[Optional(), NumberRange(min=0.01)])
     notes = StringField('Notes', validators=[Optional(), Length(max=255)])
 
@@ -161,6 +171,33 @@ class BulkStockUpdateForm(FlaskForm):
         if self.operation_type.data in ['multiply', 'add', 'subtract'] and not field.data:
             raise ValidationError('Une valeur est requise pour cette opération.')
 
+# ==================== INVENTAIRES ====================
+
+class StockCountForm(FlaskForm):
+    """Ouverture d'une session d'inventaire"""
+    location_type = SelectField('Localisation inventoriée', choices=[
+        ('comptoir', 'Stock Comptoir'),
+        ('ingredients_local', 'Stock Local Production'),
+        ('ingredients_magasin', 'Stock Magasin'),
+        ('consommables', 'Stock Consommables')
+    ], validators=[DataRequired()])
+    full_count = BooleanField('Inventaire complet (produits non comptés remis à zéro)')
+    notes = TextAreaField('Notes', validators=[Optional(), Length(max=500)],
+                         render_kw={"rows": 2, "placeholder": "Ex: Inventaire mensuel, zone réserve..."})
+    submit = SubmitField('Ouvrir l\'inventaire')
+
+class StockCountImportForm(FlaskForm):
+    """Import d'un fichier de comptage (CSV ou douchette)"""
+    count_file = FileField('Fichier de comptage', validators=[
+        FileRequired(),
+        FileAllowed(['csv', 'txt', 'tsv'], 'Fichier CSV ou texte uniquement.')
+    ])
+    mode = SelectField('Produits déjà comptés', choices=[
+        ('replace', 'Remplacer la quantité'),
+        ('add', 'Ajouter à la quantité (plusieurs zones)')
+    ], default='replace', validators=[DataRequired()])
+    submit = SubmitField('Importer')
+
 class StockSearchForm(FlaskForm):
     """Formulaire de recherche dans les stocks"""
     search_term = StringField('Rechercher un produit', validators=[Optional(), Length(max=100)],
@@ -186,7 +223,7 @@ class StockSearchForm(FlaskForm):
 
 class StockAlertForm(FlaskForm):
     """Formulaire de configuration des alertes de stock"""
-    product = QuerySelectField('Produit', query_factory=all_product_query_factory, get_label='name', allow_blank=False)
+    product = SelectField('Produit', coerce=coerce_product_id, choices=all_product_choices, validators=[DataRequired()])
     
     seuil_comptoir = FloatField('Seuil alerte Comptoir', validators=[Optional(), NumberRange(min=0)],
                                render_kw={"placeholder": "Quantité minimale"})
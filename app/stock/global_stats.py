@@ -0,0 +1,113 @@
+"""
+Statistiques globales de stock injectées dans les templates
+Module: app/stock/global_stats.py
+Auteur: ERP Fée Maison
+
+Les trois compteurs (produits, stock bas, ruptures) sont calculés en une
+seule requête, mis en cache quelques secondes et invalidés dès qu'un commit
+modifie un produit. Le calcul n'a lieu que si un template lit réellement
+l'une des variables.
+"""
+
+import threading
+import time
+
+from sqlalchemy import event, func, case
+from sqlalchemy.orm import Session
+from extensions import db
+
+
+class GlobalStockStats:
+    """
+    Cache process-wide des compteurs affichés par le context processor.
+    """
+
+    DEFAULT_TTL = 30  # secondes
+    EMPTY_STATS = {
+        'total_products_count': 0,
+        'low_stock_products': 0,
+        'out_of_stock_products': 0,
+    }
+
+    _lock = threading.Lock()
+    _cached = None
+    _cached_at = 0.0
+    _version = 0
+    _listeners_installed = False
+
+    @classmethod
+    def compute(cls, low_stock_threshold=5):
+        """Calcule les trois compteurs en une seule requête SQL."""
+        from models import Product
+
+        qty = Product.quantity_in_stock
+        row = db.session.query(
+            func.count(Product.id).label('total'),
+            func.coalesce(func.sum(case((qty <= low_stock_threshold, 1), else_=0)), 0).label('low'),
+            func.coalesce(func.sum(case((qty <= 0, 1), else_=0)), 0).label('out'),
+        ).one()
+        return {
+            'total_products_count': int(row.total or 0),
+            'low_stock_products': int(row.low or 0),
+            'out_of_stock_products': int(row.out or 0),
+        }
+
+    @classmethod
+    def get(cls, ttl=None, low_stock_threshold=5):
+        """Retourne les compteurs depuis le cache, en les recalculant si expirés."""
+        ttl = cls.DEFAULT_TTL if ttl is None else ttl
+        now = time.monotonic()
+        with cls._lock:
+            if cls._cached is not None and now - cls._cached_at < ttl:
+                return cls._cached
+            version = cls._version
+        stats = cls.compute(low_stock_threshold)
+        with cls._lock:
+            # Une invalidation pendant le calcul l'emporte
+            if cls._version == version:
+                cls._cached = stats
+                cls._cached_at = now
+        return stats
+
+    @classmethod
+    def invalidate(cls):
+        """Vide le cache ; le prochain accès relancera la requête."""
+        with cls._lock:
+            cls._version += 1
+            cls._cached = None
+            cls._cached_at = 0.0
+
+    @staticmethod
+    def mark_stock_changed(session):
+        """
+        Signale qu'une écriture de stock hors ORM (UPDATE en masse) a eu lieu
+        dans cette session ; le cache sera invalidé au commit.
+        """
+        session.info['stock_changed'] = True
+
+    @classmethod
+    def install_listeners(cls):
+        """Branche l'invalidation automatique sur les commits de la session."""
+        if cls._listeners_installed:
+            return
+        event.listen(Session, 'after_flush', cls._after_flush)
+        event.listen(Session, 'after_commit', cls._after_commit)
+        event.listen(Session, 'after_rollback', cls._after_rollback)
+        cls._listeners_installed = True
+
+    @staticmethod
+    def _after_flush(session, flush_context):
+        from models import Product
+        for obj in (*session.new, *session.dirty, *session.deleted):
+            if isinstance(obj, Product):
+                session.info['stock_changed'] = True
+                return
+
+    @classmethod
+    def _after_commit(cls, session):
+        if session.info.pop('stock_changed', False):
+            cls.invalidate()
+
+    @staticmethod
+    def _after_rollback(session):
+        session.info.pop('stock_changed', None)
@@ -0,0 +1,197 @@
+"""
+Historique des mouvements de stock : filtres et pagination par curseur
+Module: app/stock/history.py
+Auteur: ERP Fée Maison
+
+Pagination « keyset » sur (created_at, id) décroissants : chaque page
+reprend après la dernière ligne lue au lieu d'un OFFSET, si bien que la
+page 1000 coûte autant que la page 1. Les index composites
+stock_movements(product_id, created_at) et (stock_location, created_at)
+servent les filtres usuels. L'utilisateur est joint dans la même requête.
+"""
+
+import base64
+import json
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, or_
+
+from extensions import db
+from app.stock.models import StockMovement, StockMovementType, StockLocationType
+
+
+class InvalidCursorError(ValueError):
+    """Curseur de pagination illisible."""
+
+
+class MovementHistoryQuery:
+    """
+    Requête filtrée sur le journal des mouvements.
+
+    Filtres : product_id, location, movement_type, order_id, date_from (inclus),
+    date_to (exclu : la période est [date_from, date_to[).
+    """
+
+    DEFAULT_LIMIT = 50
+    MAX_LIMIT = 500
+    EXPORT_BATCH_SIZE = 1000
+
+    def __init__(self, product_id=None, location=None, movement_type=None,
+                 order_id=None, date_from=None, date_to=None):
+        self.product_id = product_id
+        self.location = StockLocationType(location) if location else None
+        self.movement_type = StockMovementType(movement_type) if movement_type else None
+        self.order_id = order_id
+        self.date_from = date_from
+        self.date_to = date_to
+
+    @classmethod
+    def from_args(cls, args, **overrides):
+        """
+        Construit la requête depuis des paramètres d'URL (request.args).
+
+        :raises ValueError: si un filtre est invalide.
+        """
+        def parse_date(value):
+            return datetime.fromisoformat(value) if value else None
+
+        def parse_end(value):
+            # Une date seule (« to=2026-10-18 ») inclut toute la journée
+            end = parse_date(value)
+            if end is not None and len(value.strip()) <= 10:
+                end += timedelta(days=1)
+            return end
+
+        params = {
+            'product_id': args.get('product_id', type=int),
+            'location': args.get('location') or None,
+            'movement_type': args.get('type') or None,
+            'order_id': args.get('order_id', type=int),
+            'date_from': parse_date(args.get('from')),
+            'date_to': parse_end(args.get('to')),
+        }
+        params.update(overrides)
+        return cls(**params)
+
+    # ------------------------------------------------------------------ #
+    # Curseurs
+    # ------------------------------------------------------------------ #
+
+    @staticmethod
+    def encode_cursor(created_at, movement_id):
+        raw = json.dumps([created_at.isoformat(), movement_id]).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            created_at, movement_id = json.loads(base64.urlsafe_b64decode(padded))
+            return datetime.fromisoformat(created_at), int(movement_id)
+        except (ValueError, TypeError) as e:
+            raise InvalidCursorError("Curseur de pagination invalide.") from e
+
+    # ------------------------------------------------------------------ #
+    # Lecture
+    # ------------------------------------------------------------------ #
+
+    def _base_query(self):
+        from models import User, Product
+
+        query = db.session.query(
+            StockMovement.id,
+            StockMovement.reference,
+            StockMovement.created_at,
+            StockMovement.product_id,
+            Product.name.label('product_name'),
+            StockMovement.stock_location,
+            StockMovement.movement_type,
+            StockMovement.quantity,
+            StockMovement.unit_cost,
+            StockMovement.total_value,
+            StockMovement.stock_before,
+            StockMovement.stock_after,
+            StockMovement.order_id,
+            StockMovement.transfer_id,
+            StockMovement.reason,
+            User.username
+        ).outerjoin(User, User.id == StockMovement.user_id)\
+         .outerjoin(Product, Product.id == StockMovement.product_id)
+
+        if self.product_id is not None:
+            query = query.filter(StockMovement.product_id == self.product_id)
+        if self.location is not None:
+            query = query.filter(StockMovement.stock_location == self.location)
+        if self.movement_type is not None:
+            query = query.filter(StockMovement.movement_type == self.movement_type)
+        if self.order_id is not None:
+            query = query.filter(StockMovement.order_id == self.order_id)
+        if self.date_from is not None:
+            query = query.filter(StockMovement.created_at >= self.date_from)
+        if self.date_to is not None:
+            query = query.filter(StockMovement.created_at < self.date_to)
+        return query
+
+    def _after(self, query, created_at, movement_id):
+        """Lignes strictement après (created_at, id) dans l'ordre décroissant."""
+        return query.filter(or_(
+            StockMovement.created_at < created_at,
+            and_(StockMovement.created_at == created_at, StockMovement.id < movement_id)
+        ))
+
+    def page(self, cursor=None, limit=None):
+        """
+        Une page de mouvements.
+
+        :return: (liste de dicts, curseur suivant ou None).
+        """
+        limit = max(1, min(int(limit or self.DEFAULT_LIMIT), self.MAX_LIMIT))
+        query = self._base_query()
+        if cursor:
+            query = self._after(query, *self.decode_cursor(cursor))
+        rows = query.order_by(StockMovement.created_at.desc(), StockMovement.id.desc())\
+            .limit(limit + 1).all()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = self.encode_cursor(rows[-1].created_at, rows[-1].id)
+        return [self.serialize(row) for row in rows], next_cursor
+
+    def iter_all(self, batch_size=None):
+        """Parcourt tous les mouvements filtrés, page par page (export)."""
+        batch_size = batch_size or self.EXPORT_BATCH_SIZE
+        cursor = None
+        while True:
+            query = self._base_query()
+            if cursor:
+                query = self._after(query, *cursor)
+            rows = query.order_by(StockMovement.created_at.desc(), StockMovement.id.desc())\
+                .limit(batch_size).all()
+            for row in rows:
+                yield self.serialize(row)
+            if len(rows) < batch_size:
+                return
+            cursor = (rows[-1].created_at, rows[-1].id)
+
+    @staticmethod
+    def serialize(row):
+        return {
+            'id': row.id,
+            'reference': row.reference,
+            'created_at': row.created_at.isoformat(),
+            'date': row.created_at.strftime('%d/%m/%Y %H:%M'),
+            'product_id': row.product_id,
+            'product_name': row.product_name,
+            'location': row.stock_location.value,
+            'type': row.movement_type.value,
+            'quantity': row.quantity,
+            'unit_cost': row.unit_cost,
+            'total_value': row.total_value,
+            'stock_before': row.stock_before,
+            'stock_after': row.stock_after,
+            'order_id': row.order_id,
+            'transfer_id': row.transfer_id,
+            'reason': row.reason,
+            'user': row.username or 'N/A'
+        }
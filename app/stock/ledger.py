@@ -0,0 +1,415 @@
+"""
+Journal de stock en ajout seul
+Module: app/stock/ledger.py
+Auteur: ERP Fée Maison
+
+Toute modification de stock passe par StockLedger : la colonne de stock du
+produit (projection courante) et le StockMovement correspondant sont écrits
+ensemble. Le journal n'est jamais modifié après coup ; une correction est un
+nouveau mouvement. La quantité enregistrée est le delta réellement appliqué
+(après plancher à 0), si bien que la somme des mouvements reconstitue le stock.
+Les deltas sont appliqués côté SQL (apply_deltas : UPDATE ... GREATEST(col + :d, 0)
+RETURNING), jamais par lecture-modification-écriture en Python.
+
+Les sorties consomment aussi les lots du produit dans la localisation,
+premier-périmé-premier-sorti (LotTracker.consume), et les mouvements valorisés
+ouvrent ou épuisent les couches de coût FIFO (CostLayerEngine.post).
+
+Des instantanés périodiques (StockSnapshot, commande `flask snapshot-stock`)
+bornent le rejeu : le stock à une date X vaut l'instantané le plus proche
+avant X plus la somme des mouvements postérieurs.
+"""
+
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import case, func, insert, select, update
+from sqlalchemy.orm.util import identity_key
+from sqlalchemy.orm.attributes import set_committed_value
+
+from extensions import db
+from app.orders.changefeed import ChangeFeed
+from app.stock.global_stats import GlobalStockStats
+from app.stock.levels import StockLevelStore
+from app.stock.lots import LotTracker
+from app.stock.models import StockMovement, StockMovementType, StockLocationType, StockSnapshot
+from app.stock.stock_manager import StockLocationManager
+from app.stock.valuation import CostLayerEngine
+
+
+def current_user_id():
+    """Utilisateur connecté, s'il y en a un (contexte de requête)."""
+    try:
+        from flask_login import current_user
+        if current_user and current_user.is_authenticated:
+            return current_user.id
+    except Exception:
+        pass
+    return None
+
+
+class StockLedger:
+    """
+    Point d'entrée unique des mouvements de stock.
+    L'appelant reste responsable du commit / rollback de la session.
+    """
+
+    LOCATION_BY_COLUMN = {column: location for location, column in StockLocationManager.LOCATION_COLUMNS.items()}
+
+    def __init__(self, user_id=None):
+        self.user_id = user_id if user_id is not None else current_user_id()
+
+    @classmethod
+    def resolve_location(cls, location):
+        """
+        Normalise une localisation (StockLocationType, valeur 'comptoir',
+        clé métier 'labo_a' ou nom de colonne).
+
+        :return: (StockLocationType, nom de colonne)
+        :raises ValueError: si la localisation est inconnue.
+        """
+        if isinstance(location, StockLocationType):
+            location = location.value
+        column = StockLocationManager.get_stock_column(location) if location else None
+        if not column:
+            raise ValueError(f"Localisation de stock inconnue : {location!r}")
+        return StockLocationType(cls.LOCATION_BY_COLUMN[column]), column
+
+    # ------------------------------------------------------------------ #
+    # Écriture unitaire
+    # ------------------------------------------------------------------ #
+
+    def record(self, product, location, quantity, movement_type=None, unit_cost=None,
+               reason=None, order_id=None, transfer_id=None, notes=None, allow_negative=False,
+               track_lots=True):
+        """
+        Applique un mouvement à un produit chargé et l'ajoute au journal.
+
+        :param product: Instance Product.
+        :param location: Localisation (voir resolve_location).
+        :param quantity: Quantité signée (positive = entrée).
+        :param allow_negative: Autorise un stock négatif (annulations d'achats).
+        :param track_lots: Une sortie consomme les lots FEFO (False si l'appelant
+                           gère lui-même les lots).
+        :return: Le StockMovement ajouté à la session (None si delta nul).
+        """
+        location_type, column = self.resolve_location(location)
+        quantity = float(quantity or 0)
+        if quantity == 0:
+            return None
+
+        # Une sortie peut être bornée à 0 : verrou pour connaître le stock avant exact
+        lock = quantity < 0 and not allow_negative
+        before, after = self.apply_deltas({(product.id, column): quantity},
+                                          lock=lock, allow_negative=allow_negative)[(product.id, column)]
+        applied = after - before
+        now = datetime.utcnow()
+        if applied < 0 and track_lots:
+            LotTracker.consume({(product.id, location_type): -applied})
+
+        if movement_type is None:
+            movement_type = StockMovementType.ENTREE if quantity > 0 else StockMovementType.SORTIE
+        if unit_cost is None:
+            unit_cost = float(product.cost_price or 0)
+        if applied > 0 and CostLayerEngine.is_valued(movement_type):
+            CostLayerEngine.post(inflows=[{'product_id': product.id, 'quantity': applied, 'unit_cost': unit_cost,
+                                           'movement_type': movement_type, 'order_id': order_id}])
+        elif applied < 0 and CostLayerEngine.is_valued(movement_type):
+            CostLayerEngine.post(outflows={(product.id, None): -applied})
+
+        movement = StockMovement(
+            product_id=product.id,
+            stock_location=location_type,
+            movement_type=movement_type,
+            quantity=applied,
+            unit_cost=unit_cost,
+            total_value=abs(applied) * unit_cost,
+            stock_before=before,
+            stock_after=after,
+            order_id=order_id,
+            transfer_id=transfer_id,
+            user_id=self.user_id,
+            reason=reason,
+            notes=notes,
+            created_at=now
+        )
+        db.session.add(movement)
+        return movement
+
+    # ------------------------------------------------------------------ #
+    # Écriture groupée (UPDATE / INSERT en masse)
+    # ------------------------------------------------------------------ #
+
+    @staticmethod
+    def lock_balances(product_ids, *extra_columns):
+        """
+        Charge (et verrouille si possible) les colonnes de stock des produits.
+
+        :param extra_columns: Attributs Product supplémentaires (ex: Product.cost_price).
+        :return: dict {product_id: Row}.
+        """
+        from models import Product
+
+        if not product_ids:
+            return {}
+        stock_attrs = [getattr(Product, col) for col in StockLocationManager.LOCATION_COLUMNS.values()]
+        rows = db.session.query(Product.id, *extra_columns, *stock_attrs)\
+            .filter(Product.id.in_(list(product_ids)))\
+            .with_for_update().all()
+        return {row.id: row for row in rows}
+
+    def post_batch(self, entries, balances=None, allow_negative=False):
+        """
+        Applique une liste de mouvements en quelques instructions groupées.
+
+        :param entries: dicts {'product_id', 'location', 'quantity', 'movement_type',
+                        'unit_cost', 'reason', 'order_id', 'transfer_id' (optionnel),
+                        'track_lots' (optionnel, False si l'appelant gère les lots),
+                        'purchase_id' (optionnel, couches de coût de l'achat)}.
+        :param balances: Résultat de lock_balances, si déjà chargé.
+        :param allow_negative: Autorise un stock négatif (annulations d'achats).
+        :return: Liste des lignes de mouvement insérées (dicts).
+        """
+        if not entries:
+            return []
+        if balances is None:
+            balances = self.lock_balances({entry['product_id'] for entry in entries})
+
+        # Stock courant suivi en mémoire pour renseigner stock_before / stock_after
+        running = {}
+        for product_id, row in balances.items():
+            for column in StockLocationManager.LOCATION_COLUMNS.values():
+                running[(product_id, column)] = float(getattr(row, column) or 0)
+
+        qty_deltas = defaultdict(float)
+        lot_outflows = defaultdict(float)
+        layer_inflows, layer_outflows = [], defaultdict(float)
+        movement_rows = []
+        now = datetime.utcnow()
+        for entry in entries:
+            location_type, column = self.resolve_location(entry['location'])
+            key = (entry['product_id'], column)
+            before = running.get(key, 0.0)
+            after = before + float(entry['quantity'])
+            if not allow_negative:
+                after = max(0.0, after)
+            applied = after - before
+            running[key] = after
+            qty_deltas[key] += applied
+            if applied < 0 and entry.get('track_lots', True):
+                lot_outflows[(entry['product_id'], location_type)] -= applied
+            unit_cost = float(entry.get('unit_cost') or 0)
+            if applied and CostLayerEngine.is_valued(entry['movement_type']):
+                if applied > 0:
+                    layer_inflows.append({
+                        'product_id': entry['product_id'],
+                        'quantity': applied,
+                        'unit_cost': unit_cost,
+                        'movement_type': entry['movement_type'],
+                        'purchase_id': entry.get('purchase_id'),
+                        'order_id': entry.get('order_id')
+                    })
+                else:
+                    layer_outflows[(entry['product_id'], entry.get('purchase_id'))] -= applied
+            movement_rows.append({
+                'product_id': entry['product_id'],
+                'stock_location': location_type,
+                'movement_type': entry['movement_type'],
+                'quantity': applied,
+                'unit_cost': unit_cost,
+                'total_value': abs(applied) * unit_cost,
+                'stock_before': before,
+                'stock_after': after,
+                'order_id': entry.get('order_id'),
+                'transfer_id': entry.get('transfer_id'),
+                'user_id': self.user_id,
+                'reason': entry.get('reason'),
+                'created_at': now
+            })
+
+        # Les deltas sont déjà bornés sur le stock verrouillé : une instruction pour tout le lot
+        self.apply_deltas(qty_deltas, allow_negative=allow_negative)
+        LotTracker.consume(lot_outflows)
+        CostLayerEngine.post(layer_inflows, layer_outflows)
+        self._bulk_insert_movements(movement_rows)
+        return movement_rows
+
+    @staticmethod
+    def _floor_zero(expression):
+        """GREATEST(x, 0) selon le dialecte (MAX scalaire sous SQLite)."""
+        dialect = db.engine.dialect.name
+        if dialect == 'postgresql':
+            return func.greatest(expression, 0)
+        if dialect == 'sqlite':
+            return func.max(expression, 0)
+        return case((expression < 0, 0), else_=expression)
+
+    @classmethod
+    def apply_deltas(cls, deltas, lock=False, allow_negative=False):
+        """
+        Applique des deltas de stock côté SQL, en une seule instruction :
+        UPDATE products SET col = CASE id WHEN :id THEN GREATEST(col + :d, 0) ... END
+        RETURNING id, col. Aucune lecture-modification-écriture en Python, donc
+        pas de mise à jour perdue entre deux requêtes concurrentes.
+
+        :param deltas: dict {(product_id, nom de colonne): delta}.
+        :param lock: Verrouille d'abord les lignes (SELECT ... FOR UPDATE) pour
+                     connaître le stock avant exact. Sans verrou, le stock avant
+                     est déduit (après - delta), exact sauf si le plancher à 0 a joué.
+        :param allow_negative: Désactive le plancher à 0.
+        :return: dict {(product_id, colonne): (avant, après)}.
+        """
+        from models import Product
+
+        deltas = {key: float(delta) for key, delta in deltas.items() if delta}
+        if not deltas:
+            return {}
+
+        table = Product.__table__
+        product_ids = sorted({product_id for product_id, _ in deltas})
+        columns = sorted({column for _, column in deltas})
+
+        locked = cls.lock_balances(product_ids) if lock else {}
+
+        now = datetime.utcnow()
+        values = {'last_stock_update': now}
+        for column in columns:
+            col = table.c[column]
+            whens = {}
+            for product_id in product_ids:
+                if (product_id, column) in deltas:
+                    new_value = func.coalesce(col, 0) + deltas[(product_id, column)]
+                    whens[product_id] = new_value if allow_negative else cls._floor_zero(new_value)
+            values[column] = case(whens, value=table.c.id, else_=col)
+
+        stmt = update(table).where(table.c.id.in_(product_ids)).values(values)
+        if db.engine.dialect.update_returning:
+            rows = db.session.execute(stmt.returning(table.c.id, *[table.c[c] for c in columns])).all()
+        else:
+            db.session.execute(stmt)
+            rows = db.session.execute(
+                select(table.c.id, *[table.c[c] for c in columns]).where(table.c.id.in_(product_ids))
+            ).all()
+
+        results = {}
+        current = {row.id: row for row in rows}
+        for (product_id, column), delta in deltas.items():
+            row = current.get(product_id)
+            if row is None:
+                continue
+            after = float(getattr(row, column) or 0)
+            if product_id in locked:
+                before = float(getattr(locked[product_id], column) or 0)
+            else:
+                before = after - delta
+            results[(product_id, column)] = (before, after)
+
+        # Même transaction : stock_levels reçoit les quantités retournées
+        StockLevelStore.sync_columns({key: after for key, (_, after) in results.items()})
+
+        # Les objets Product déjà en session reçoivent les valeurs retournées
+        for product_id in current:
+            obj = db.session.identity_map.get(identity_key(Product, product_id))
+            if obj is not None:
+                for column in columns:
+                    value = getattr(current[product_id], column)
+                    set_committed_value(obj, column, float(value) if value is not None else None)
+                set_committed_value(obj, 'last_stock_update', now)
+
+        GlobalStockStats.mark_stock_changed(db.session)
+        ChangeFeed.mark(db.session, 'stock', current)
+        return results
+
+    @staticmethod
+    def _bulk_insert_movements(movement_rows):
+        """Insère tous les mouvements en une seule instruction multi-lignes."""
+        if not movement_rows:
+            return
+        references = StockMovement.reserve_references(len(movement_rows))
+        for row, reference in zip(movement_rows, references):
+            row['reference'] = reference
+        db.session.execute(insert(StockMovement), movement_rows)
+
+    @staticmethod
+    def expire_products(product_ids):
+        """Les objets Product déjà chargés dans la session sont désormais périmés."""
+        from models import Product
+
+        for product_id in product_ids:
+            obj = db.session.identity_map.get(identity_key(Product, product_id))
+            if obj is not None:
+                db.session.expire(obj)
+
+    # ------------------------------------------------------------------ #
+    # Instantanés et reconstitution
+    # ------------------------------------------------------------------ #
+
+    @staticmethod
+    def take_snapshot(at=None):
+        """
+        Enregistre le stock courant de chaque produit et localisation.
+        L'appelant reste responsable du commit.
+
+        :return: Nombre de lignes d'instantané écrites.
+        """
+        from models import Product
+
+        at = at or datetime.utcnow()
+        watermark = db.session.query(func.max(StockMovement.id)).scalar() or 0
+        columns = StockLocationManager.LOCATION_COLUMNS
+        stock_attrs = [getattr(Product, col) for col in columns.values()]
+
+        rows = []
+        for product in db.session.query(Product.id, *stock_attrs).all():
+            for location, column in columns.items():
+                rows.append({
+                    'product_id': product.id,
+                    'stock_location': StockLocationType(location),
+                    'quantity': float(getattr(product, column) or 0),
+                    'snapshot_at': at,
+                    'last_movement_id': watermark
+                })
+        if rows:
+            db.session.execute(insert(StockSnapshot), rows)
+        return len(rows)
+
+    @staticmethod
+    def balances_as_of(at, product_ids=None):
+        """
+        Stock par produit et localisation à une date donnée :
+        instantané le plus récent avant `at` + mouvements postérieurs.
+
+        :return: dict {(product_id, location_value): quantité}.
+        """
+        snapshot_at = db.session.query(func.max(StockSnapshot.snapshot_at))\
+            .filter(StockSnapshot.snapshot_at <= at).scalar()
+
+        balances = defaultdict(float)
+        watermark = 0
+        if snapshot_at is not None:
+            # Un instantané est pris pour tous les produits à la fois : filigrane unique
+            watermark = db.session.query(func.max(StockSnapshot.last_movement_id))\
+                .filter(StockSnapshot.snapshot_at == snapshot_at).scalar() or 0
+            query = db.session.query(StockSnapshot.product_id, StockSnapshot.stock_location, StockSnapshot.quantity)\
+                .filter(StockSnapshot.snapshot_at == snapshot_at)
+            if product_ids is not None:
+                query = query.filter(StockSnapshot.product_id.in_(list(product_ids)))
+            for product_id, location, quantity in query.all():
+                balances[(product_id, location.value)] = float(quantity or 0)
+
+        # Rejeu borné : seuls les mouvements postérieurs au filigrane sont sommés.
+        # Un produit créé après l'instantané n'a aucun mouvement sous le filigrane.
+        query = db.session.query(
+            StockMovement.product_id, StockMovement.stock_location, func.sum(StockMovement.quantity)
+        ).filter(StockMovement.id > watermark, StockMovement.created_at <= at)
+        if product_ids is not None:
+            query = query.filter(StockMovement.product_id.in_(list(product_ids)))
+        for product_id, location, quantity in query.group_by(StockMovement.product_id, StockMovement.stock_location).all():
+            balances[(product_id, location.value)] += float(quantity or 0)
+        return dict(balances)
+
+    @classmethod
+    def balance_as_of(cls, product_id, location, at):
+        """Stock d'un produit dans une localisation à une date donnée."""
+        location_type, _ = cls.resolve_location(location)
+        return cls.balances_as_of(at, product_ids=[product_id]).get((product_id, location_type.value), 0.0)
@@ -0,0 +1,389 @@
+"""
+Niveaux de stock normalisés (stock_levels)
+Module: app/stock/levels.py
+Auteur: ERP Fée Maison
+
+Les localisations sont des lignes de stock_locations et les quantités /
+seuils des lignes stock_levels(product_id, location_id, qty, min_qty) :
+ajouter un cinquième emplacement ne demande aucune modification de schéma.
+
+Les quatre emplacements historiques gardent leur colonne sur Product
+(stock_comptoir, seuil_min_comptoir...) comme projection de compatibilité.
+Les deux sont écrits dans la même transaction :
+
+- StockLedger.apply_deltas recopie les quantités retournées par son UPDATE
+  (un seul INSERT ... ON CONFLICT pour tout le lot) ;
+- un écouteur after_flush recopie les colonnes modifiées par l'ORM
+  (création / édition de produit, seuils).
+
+Les recherches de stock bas lisent stock_levels : l'index partiel
+ix_stock_levels_low (min_qty > 0 AND qty <= min_qty) ne contient que les
+lignes sous leur seuil.
+"""
+
+import threading
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+
+from extensions import db
+from app.orders.changefeed import ChangeFeed
+from .models import StockLevel, StockLocation, StockLocationType
+from .stock_manager import StockLocationManager
+
+# Localisation déclarée ; stock_column / threshold_column valent None hors emplacements historiques
+LocationInfo = namedtuple('LocationInfo', ['id', 'key', 'name', 'stock_column', 'threshold_column'])
+
+# Emplacements historiques : clé -> libellé
+LEGACY_LOCATION_NAMES = {
+    'comptoir': 'Stock Vente',
+    'ingredients_local': 'Labo B',
+    'ingredients_magasin': 'Labo A (Réserve)',
+    'consommables': 'Stock Consommables',
+}
+
+
+class StockLevelStore:
+    """Lecture et écriture des niveaux de stock par localisation."""
+
+    _registry = None
+    _registry_lock = threading.Lock()
+    _listeners_installed = False
+
+    # ------------------------------------------------------------------ #
+    # Localisations
+    # ------------------------------------------------------------------ #
+
+    @classmethod
+    def registry(cls, connection=None, refresh=False):
+        """
+        Localisations actives, mises en cache par processus.
+        Les emplacements historiques absents de la table y sont ajoutés.
+
+        :return: dict {clé: LocationInfo}.
+        """
+        registry = cls._registry
+        if registry is not None and not refresh:
+            return registry
+        with cls._registry_lock:
+            connection = connection if connection is not None else db.session.connection()
+            table = StockLocation.__table__
+            rows = connection.execute(select(table).order_by(table.c.display_order, table.c.id)).all()
+            known = {row.key for row in rows}
+            missing = [key for key in StockLocationManager.LOCATION_COLUMNS if key not in known]
+            if missing:
+                connection.execute(table.insert(), [{
+                    'key': key,
+                    'name': LEGACY_LOCATION_NAMES[key],
+                    'stock_column': StockLocationManager.LOCATION_COLUMNS[key],
+                    'threshold_column': f'seuil_min_{key}',
+                    'is_active': True,
+                    'display_order': index,
+                } for index, key in enumerate(missing)])
+                rows = connection.execute(select(table).order_by(table.c.display_order, table.c.id)).all()
+            registry = {
+                row.key: LocationInfo(row.id, row.key, row.name, row.stock_column, row.threshold_column)
+                for row in rows if row.is_active
+            }
+            # Des lignes tout juste insérées peuvent encore être annulées : pas de cache
+            cls._registry = None if missing else registry
+            return registry
+
+    @classmethod
+    def location(cls, location_key, connection=None):
+        """
+        Localisation déclarée pour une clé de localisation, une clé métier
+        ('labo_a'), un nom de colonne ou un StockLocationType.
+
+        :raises ValueError: si la localisation est inconnue.
+        """
+        if isinstance(location_key, StockLocationType):
+            location_key = location_key.value
+        key = (location_key or '').lower()
+        column = StockLocationManager.get_stock_column(key) if key else None
+        if column:
+            key = next(k for k, c in StockLocationManager.LOCATION_COLUMNS.items() if c == column)
+
+        info = cls.registry(connection).get(key)
+        if info is None:
+            # Localisation ajoutée depuis le chargement du cache
+            info = cls.registry(connection, refresh=True).get(key)
+        if info is None:
+            raise ValueError(f"Localisation de stock inconnue : {location_key!r}")
+        return info
+
+    @classmethod
+    def extra_locations(cls):
+        """Localisations sans colonne sur Product (ajoutées après les quatre historiques)."""
+        return [info for info in cls.registry().values() if not info.stock_column]
+
+    # ------------------------------------------------------------------ #
+    # Lecture
+    # ------------------------------------------------------------------ #
+
+    @classmethod
+    def get(cls, product_id, location_key):
+        """Quantité en stock (0 sans ligne)."""
+        info = cls.location(location_key)
+        qty = db.session.query(StockLevel.qty)\
+            .filter(StockLevel.product_id == product_id, StockLevel.location_id == info.id).scalar()
+        return float(qty or 0)
+
+    @classmethod
+    def get_min_qty(cls, product_id, location_key):
+        """Seuil d'alerte (0 sans ligne)."""
+        info = cls.location(location_key)
+        min_qty = db.session.query(StockLevel.min_qty)\
+            .filter(StockLevel.product_id == product_id, StockLevel.location_id == info.id).scalar()
+        return float(min_qty or 0)
+
+    @classmethod
+    def levels(cls, product_id):
+        """
+        Niveaux d'un produit dans toutes les localisations actives.
+
+        :return: dict {clé: {'qty', 'min_qty', 'is_low'}}.
+        """
+        registry = cls.registry()
+        rows = {
+            location_id: (float(qty or 0), float(min_qty or 0))
+            for location_id, qty, min_qty in db.session.query(
+                StockLevel.location_id, StockLevel.qty, StockLevel.min_qty
+            ).filter(StockLevel.product_id == product_id)
+        }
+        levels = {}
+        for key, info in registry.items():
+            qty, min_qty = rows.get(info.id, (0.0, 0.0))
+            levels[key] = {'qty': qty, 'min_qty': min_qty, 'is_low': min_qty > 0 and qty <= min_qty}
+        return levels
+
+    @classmethod
+    def low_stock_query(cls, location_key):
+        """
+        Lignes sous leur seuil dans une localisation. Le filtre reprend le
+        prédicat de ix_stock_levels_low : parcours de l'index partiel.
+        """
+        info = cls.location(location_key)
+        return db.session.query(StockLevel).filter(
+            StockLevel.location_id == info.id,
+            StockLevel.min_qty > 0,
+            StockLevel.qty <= StockLevel.min_qty
+        )
+
+    @classmethod
+    def low_stock(cls, location_key, product_type=None, limit=None):
+        """
+        Produits sous leur seuil dans une localisation.
+
+        :return: Liste de dicts triée par nom.
+        """
+        from models import Product
+
+        query = cls.low_stock_query(location_key)\
+            .join(Product, Product.id == StockLevel.product_id)\
+            .with_entities(Product.id, Product.name, Product.unit, Product.product_type,
+                           StockLevel.qty, StockLevel.min_qty)
+        if product_type:
+            query = query.filter(Product.product_type == product_type)
+        query = query.order_by(Product.name)
+        if limit:
+            query = query.limit(limit)
+        return [{
+            'product_id': row.id,
+            'product_name': row.name,
+            'unit': row.unit,
+            'product_type': row.product_type,
+            'qty': float(row.qty or 0),
+            'min_qty': float(row.min_qty or 0),
+        } for row in query.all()]
+
+    # ------------------------------------------------------------------ #
+    # Écriture
+    # ------------------------------------------------------------------ #
+
+    @staticmethod
+    def _upsert(connection, rows, update_columns):
+        """INSERT ... ON CONFLICT (product_id, location_id) DO UPDATE en une instruction."""
+        if not rows:
+            return
+        table = StockLevel.__table__
+        dialect = connection.dialect.name
+        if dialect in ('postgresql', 'sqlite'):
+            if dialect == 'postgresql':
+                from sqlalchemy.dialects.postgresql import insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert
+            stmt = insert(table)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[table.c.product_id, table.c.location_id],
+                set_={column: stmt.excluded[column] for column in (*update_columns, 'updated_at')}
+            )
+            connection.execute(stmt, rows)
+            return
+        # Repli générique : mise à jour puis insertion des lignes absentes
+        for row in rows:
+            result = connection.execute(
+                table.update()
+                .where(table.c.product_id == row['product_id'], table.c.location_id == row['location_id'])
+                .values({column: row[column] for column in (*update_columns, 'updated_at')})
+            )
+            if not result.rowcount:
+                connection.execute(table.insert().values(row))
+
+    @classmethod
+    def sync_columns(cls, values, connection=None):
+        """
+        Recopie des quantités de colonnes historiques (après UPDATE des produits).
+
+        :param values: dict {(product_id, nom de colonne): quantité}.
+        """
+        if not values:
+            return
+        connection = connection if connection is not None else db.session.connection()
+        by_column = {info.stock_column: info for info in cls.registry(connection).values() if info.stock_column}
+        now = datetime.utcnow()
+        rows = [{
+            'product_id': product_id,
+            'location_id': by_column[column].id,
+            'qty': float(qty or 0),
+            'min_qty': 0.0,
+            'updated_at': now,
+        } for (product_id, column), qty in values.items() if column in by_column]
+        cls._upsert(connection, rows, ('qty',))
+
+    @classmethod
+    def apply_deltas(cls, deltas, allow_negative=False):
+        """
+        Applique des deltas dans des localisations sans colonne historique
+        (aucun mouvement n'est journalisé, comme Product.update_stock_by_location).
+
+        :param deltas: dict {(product_id, clé de localisation): delta}.
+        :return: dict {(product_id, clé): quantité après}.
+        """
+        table = StockLevel.__table__
+        now = datetime.utcnow()
+        results = {}
+        for (product_id, location_key), delta in deltas.items():
+            info = cls.location(location_key)
+            if info.stock_column:
+                raise ValueError(f"La localisation {info.key!r} passe par StockLedger")
+            current = db.session.execute(
+                select(table.c.qty)
+                .where(table.c.product_id == product_id, table.c.location_id == info.id)
+                .with_for_update()
+            ).scalar()
+            after = float(current or 0) + float(delta)
+            if not allow_negative:
+                after = max(0.0, after)
+            if current is None:
+                db.session.execute(table.insert().values(
+                    product_id=product_id, location_id=info.id, qty=after, min_qty=0.0, updated_at=now))
+            else:
+                db.session.execute(
+                    table.update()
+                    .where(table.c.product_id == product_id, table.c.location_id == info.id)
+                    .values(qty=after, updated_at=now)
+                )
+            results[(product_id, info.key)] = after
+        ChangeFeed.mark(db.session, 'stock', {product_id for product_id, _ in deltas})
+        return results
+
+    @classmethod
+    def set_min_qty(cls, product_id, location_key, min_qty):
+        """
+        Fixe le seuil d'alerte d'un produit dans une localisation (la colonne
+        seuil_min_* est mise à jour pour les emplacements historiques).
+        """
+        from models import Product
+
+        info = cls.location(location_key)
+        min_qty = float(min_qty or 0)
+        if info.threshold_column:
+            db.session.query(Product).filter(Product.id == product_id)\
+                .update({info.threshold_column: min_qty}, synchronize_session='fetch')
+        table = StockLevel.__table__
+        row = db.session.execute(
+            select(table.c.qty).where(table.c.product_id == product_id, table.c.location_id == info.id)
+        ).first()
+        if row is None:
+            qty = 0.0
+            if info.stock_column:
+                qty = float(db.session.query(getattr(Product, info.stock_column))
+                            .filter(Product.id == product_id).scalar() or 0)
+            db.session.execute(table.insert().values(
+                product_id=product_id, location_id=info.id, qty=qty, min_qty=min_qty,
+                updated_at=datetime.utcnow()))
+        else:
+            db.session.execute(
+                table.update()
+                .where(table.c.product_id == product_id, table.c.location_id == info.id)
+                .values(min_qty=min_qty, updated_at=datetime.utcnow())
+            )
+
+    @classmethod
+    def rebuild(cls):
+        """
+        Reconstruit les lignes des emplacements historiques depuis les colonnes
+        de Product (commande `flask rebuild-stock-levels`).
+        L'appelant reste responsable du commit.
+
+        :return: Nombre de lignes écrites.
+        """
+        from models import Product
+
+        connection = db.session.connection()
+        legacy = [info for info in cls.registry(connection).values() if info.stock_column]
+        columns = [getattr(Product, name) for info in legacy for name in (info.stock_column, info.threshold_column)]
+        now = datetime.utcnow()
+        rows = []
+        for product in db.session.query(Product.id, *columns).all():
+            for info in legacy:
+                qty = float(getattr(product, info.stock_column) or 0)
+                min_qty = float(getattr(product, info.threshold_column) or 0)
+                if qty or min_qty:
+                    rows.append({'product_id': product.id, 'location_id': info.id,
+                                 'qty': qty, 'min_qty': min_qty, 'updated_at': now})
+        cls._upsert(connection, rows, ('qty', 'min_qty'))
+        return len(rows)
+
+    # ------------------------------------------------------------------ #
+    # Recopie des modifications ORM
+    # ------------------------------------------------------------------ #
+
+    @classmethod
+    def install_listeners(cls):
+        """Recopie dans stock_levels les colonnes de stock / seuil modifiées par l'ORM."""
+        if cls._listeners_installed:
+            return
+        event.listen(Session, 'after_flush', cls._after_flush)
+        cls._listeners_installed = True
+
+    @classmethod
+    def _after_flush(cls, session, flush_context):
+        from models import Product
+
+        products = [obj for obj in (*session.new, *session.dirty)
+                    if isinstance(obj, Product) and obj.id is not None]
+        if not products:
+            return
+
+        connection = session.connection()
+        legacy = [info for info in cls.registry(connection).values() if info.stock_column]
+        now = datetime.utcnow()
+        rows = []
+        for product in products:
+            attrs = inspect(product).attrs
+            is_new = product in session.new
+            for info in legacy:
+                if not is_new and not (attrs[info.stock_column].history.has_changes()
+                                       or attrs[info.threshold_column].history.has_changes()):
+                    continue
+                qty = float(getattr(product, info.stock_column) or 0)
+                min_qty = float(getattr(product, info.threshold_column) or 0)
+                if is_new and not (qty or min_qty):
+                    continue
+                rows.append({'product_id': product.id, 'location_id': info.id,
+                             'qty': qty, 'min_qty': min_qty, 'updated_at': now})
+        cls._upsert(connection, rows, ('qty', 'min_qty'))
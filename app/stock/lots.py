@@ -0,0 +1,235 @@
+"""
+Suivi des lots et des dates de péremption
+Module: app/stock/lots.py
+Auteur: ERP Fée Maison
+
+Chaque réception d'achat crée un lot (numéro fournisseur, date de péremption,
+quantité reçue) dans la localisation de destination. Toute sortie passée au
+journal de stock consomme les lots du produit premier-périmé-premier-sorti :
+une requête sur l'index partiel (product_id, stock_location, expiry_date) des
+lots non épuisés, une répartition en mémoire et un UPDATE exécuté en lot.
+
+Les colonnes de stock de Product restent la référence : le stock reçu avant
+le suivi des lots (ou entré sans lot) est simplement « hors lot » et n'est
+consommé qu'une fois les lots épuisés.
+"""
+
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import bindparam, insert, update
+
+from extensions import db
+from app.stock.models import StockLocationType, StockLot
+
+
+class LotTracker:
+    """
+    Réception, consommation FEFO et transfert des lots.
+    L'appelant reste responsable du commit / rollback de la session.
+    """
+
+    DEFAULT_EXPIRING_DAYS = 7
+    EPSILON = 1e-9
+
+    @staticmethod
+    def _location_type(location):
+        if isinstance(location, StockLocationType):
+            return location
+        from app.stock.ledger import StockLedger
+        return StockLedger.resolve_location(location)[0]
+
+    @classmethod
+    def receive(cls, rows):
+        """
+        Crée les lots reçus en une instruction.
+
+        :param rows: dicts {'product_id', 'location', 'quantity', 'unit_cost',
+                     'lot_number', 'expiry_date', 'purchase_id', 'purchase_item_id'}.
+        :return: Nombre de lots créés.
+        """
+        now = datetime.utcnow()
+        lots = [{
+            'product_id': row['product_id'],
+            'stock_location': cls._location_type(row['location']),
+            'lot_number': row.get('lot_number') or None,
+            'expiry_date': row.get('expiry_date'),
+            'received_quantity': float(row['quantity']),
+            'remaining_quantity': float(row['quantity']),
+            'unit_cost': float(row.get('unit_cost') or 0),
+            'purchase_id': row.get('purchase_id'),
+            'purchase_item_id': row.get('purchase_item_id'),
+            'source_lot_id': row.get('source_lot_id'),
+            'received_at': now
+        } for row in rows if float(row['quantity'] or 0) > 0]
+        if lots:
+            db.session.execute(insert(StockLot), lots)
+        return len(lots)
+
+    @classmethod
+    def consume(cls, demands):
+        """
+        Consomme les lots ouverts, premier périmé premier sorti (sans date en dernier).
+
+        Les lignes Product concernées sont déjà verrouillées par le journal de
+        stock : deux sorties concurrentes d'un même produit ne se croisent pas.
+
+        :param demands: dict {(product_id, StockLocationType ou clé): quantité sortie}.
+        :return: Liste de dicts {'lot_id', 'product_id', 'stock_location', 'quantity',
+                 'lot_number', 'expiry_date', 'unit_cost', 'purchase_id'} dans l'ordre
+                 de consommation.
+        """
+        remaining = defaultdict(float)
+        for (product_id, location), quantity in demands.items():
+            if quantity > cls.EPSILON:
+                remaining[(product_id, cls._location_type(location))] += float(quantity)
+        if not remaining:
+            return []
+
+        lots = db.session.query(
+            StockLot.id, StockLot.product_id, StockLot.stock_location, StockLot.remaining_quantity,
+            StockLot.lot_number, StockLot.expiry_date, StockLot.unit_cost, StockLot.purchase_id
+        ).filter(
+            StockLot.product_id.in_({product_id for product_id, _ in remaining}),
+            StockLot.stock_location.in_({location for _, location in remaining}),
+            StockLot.remaining_quantity > 0
+        ).order_by(
+            StockLot.product_id, StockLot.stock_location,
+            StockLot.expiry_date.asc().nulls_last(), StockLot.id
+        ).all()
+
+        allocations, updates = [], []
+        for lot in lots:
+            key = (lot.product_id, lot.stock_location)
+            wanted = remaining.get(key, 0.0)
+            if wanted <= cls.EPSILON:
+                continue
+            taken = min(wanted, float(lot.remaining_quantity))
+            remaining[key] = wanted - taken
+            updates.append({'b_id': lot.id, 'b_left': float(lot.remaining_quantity) - taken})
+            allocations.append({
+                'lot_id': lot.id,
+                'product_id': lot.product_id,
+                'stock_location': lot.stock_location,
+                'quantity': taken,
+                'lot_number': lot.lot_number,
+                'expiry_date': lot.expiry_date,
+                'unit_cost': lot.unit_cost,
+                'purchase_id': lot.purchase_id
+            })
+
+        if updates:
+            table = StockLot.__table__
+            db.session.execute(
+                update(table).where(table.c.id == bindparam('b_id'))
+                .values(remaining_quantity=bindparam('b_left')),
+                updates
+            )
+        return allocations
+
+    @classmethod
+    def transfer(cls, moves):
+        """
+        Déplace les lots d'une localisation à l'autre : les lots source sont
+        consommés FEFO et recréés à destination avec le même numéro et la
+        même date de péremption.
+
+        :param moves: Liste de (product_id, source, destination, quantité).
+        :return: Nombre de lots créés à destination.
+        """
+        demands = defaultdict(float)
+        destinations = defaultdict(list)
+        for product_id, source, destination, quantity in moves:
+            key = (product_id, cls._location_type(source))
+            demands[key] += float(quantity)
+            destinations[key].append([cls._location_type(destination), float(quantity)])
+
+        rows = []
+        for allocation in cls.consume(demands):
+            key = (allocation['product_id'], allocation['stock_location'])
+            left = allocation['quantity']
+            # Un même produit peut partir vers plusieurs destinations
+            for target in destinations[key]:
+                if left <= cls.EPSILON:
+                    break
+                taken = min(left, target[1])
+                if taken <= cls.EPSILON:
+                    continue
+                target[1] -= taken
+                left -= taken
+                rows.append({
+                    'product_id': allocation['product_id'],
+                    'location': target[0],
+                    'quantity': taken,
+                    'unit_cost': allocation['unit_cost'],
+                    'lot_number': allocation['lot_number'],
+                    'expiry_date': allocation['expiry_date'],
+                    'purchase_id': allocation['purchase_id'],
+                    'source_lot_id': allocation['lot_id']
+                })
+        return cls.receive(rows)
+
+    @staticmethod
+    def reverse_purchase(purchase_id):
+        """
+        Retire les lots encore ouverts d'un bon d'achat reversé (annulation ou
+        modification d'un bon reçu).
+
+        :return: Nombre de lots soldés.
+        """
+        table = StockLot.__table__
+        result = db.session.execute(
+            update(table)
+            .where(table.c.purchase_id == purchase_id, table.c.remaining_quantity > 0)
+            .values(remaining_quantity=0.0)
+        )
+        return result.rowcount
+
+    # ------------------------------------------------------------------ #
+    # Lecture
+    # ------------------------------------------------------------------ #
+
+    @staticmethod
+    def open_lots(product_id, location=None):
+        """Lots non épuisés d'un produit, dans l'ordre de consommation FEFO."""
+        query = StockLot.query.filter(StockLot.product_id == product_id, StockLot.remaining_quantity > 0)
+        if location is not None:
+            query = query.filter(StockLot.stock_location == LotTracker._location_type(location))
+        return query.order_by(StockLot.stock_location, StockLot.expiry_date.asc().nulls_last(), StockLot.id).all()
+
+    @classmethod
+    def expiring(cls, days=None, location=None, limit=200, today=None):
+        """
+        Lots non épuisés périmés ou périmant dans les `days` prochains jours.
+        La requête est un parcours borné de l'index partiel ix_stock_lots_expiring.
+
+        :return: Liste de dicts triée par date de péremption.
+        """
+        from models import Product
+
+        today = today or date.today()
+        horizon = today + timedelta(days=cls.DEFAULT_EXPIRING_DAYS if days is None else days)
+        query = db.session.query(
+            StockLot.id, StockLot.product_id, StockLot.stock_location, StockLot.lot_number,
+            StockLot.expiry_date, StockLot.remaining_quantity, StockLot.unit_cost,
+            Product.name, Product.unit
+        ).join(Product, Product.id == StockLot.product_id)\
+         .filter(StockLot.expiry_date.isnot(None),
+                 StockLot.expiry_date <= horizon,
+                 StockLot.remaining_quantity > 0)
+        if location is not None:
+            query = query.filter(StockLot.stock_location == cls._location_type(location))
+        rows = query.order_by(StockLot.expiry_date, StockLot.id).limit(limit).all()
+
+        return [{
+            'lot_id': row.id,
+            'product_id': row.product_id,
+            'product_name': row.name,
+            'unit': row.unit,
+            'location': row.stock_location.value,
+            'lot_number': row.lot_number,
+            'expiry_date': row.expiry_date.isoformat(),
+            'days_left': (row.expiry_date - today).days,
+            'remaining_quantity': float(row.remaining_quantity),
+            'value': float(row.remaining_quantity) * float(row.unit_cost or 0)
+        } for row in rows]
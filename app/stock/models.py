@@ -36,12 +36,101 @@ class TransferStatus(Enum):
     COMPLETED = "completed"   # Terminé
     CANCELLED = "cancelled"   # Annulé
 
+class StockCountStatus(Enum):
+    """Statuts d'une session d'inventaire"""
+    OPEN = "open"             # Comptage en cours
+    POSTED = "posted"         # Écarts comptabilisés
+    CANCELLED = "cancelled"   # Abandonnée
+
+class ReferenceCounter(db.Model):
+    """
+    Compteurs journaliers des références (MVT-YYYYMMDD-NNNN, TML-YYYYMMDD-NNN...)
+    Une ligne par (préfixe, jour) incrémentée atomiquement : pas de COUNT(*)
+    par insertion et pas de doublon entre deux écritures concurrentes.
+    """
+    __tablename__ = 'reference_counters'
+
+    prefix = db.Column(db.String(10), primary_key=True)
+    day = db.Column(db.String(8), primary_key=True)  # YYYYMMDD
+    last_value = db.Column(db.Integer, nullable=False, default=0)
+
+    @classmethod
+    def allocate(cls, prefix, count=1, day=None):
+        """
+        Réserve `count` numéros consécutifs pour (préfixe, jour).
+
+        Sous PostgreSQL l'incrément est validé dans sa propre transaction
+        courte, comme un nextval() de séquence : les écritures concurrentes
+        ne s'attendent pas et un rollback laisse simplement un trou.
+        Sous SQLite il s'exécute sur la connexion de la session (le verrou
+        d'écriture de la base sérialise déjà les transactions).
+
+        :return: (day, premier numéro réservé)
+        """
+        day = day or datetime.now().strftime('%Y%m%d')
+        dialect = db.engine.dialect.name
+        table = cls.__table__
+
+        if dialect in ('postgresql', 'sqlite'):
+            if dialect == 'postgresql':
+                from sqlalchemy.dialects.postgresql import insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert
+            stmt = insert(table).values(prefix=prefix, day=day, last_value=count)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[table.c.prefix, table.c.day],
+                set_={'last_value': table.c.last_value + count}
+            ).returning(table.c.last_value)
+
+            if dialect == 'postgresql':
+                with db.engine.begin() as connection:
+                    last_value = connection.execute(stmt).scalar_one()
+            else:
+                last_value = db.session.execute(stmt).scalar_one()
+        else:
+            # Repli générique : verrou de ligne puis mise à jour
+            current = db.session.execute(
+                db.select(table.c.last_value)
+                .where(table.c.prefix == prefix, table.c.day == day)
+                .with_for_update()
+            ).scalar()
+            if current is None:
+                db.session.execute(table.insert().values(prefix=prefix, day=day, last_value=count))
+                last_value = count
+            else:
+                last_value = current + count
+                db.session.execute(
+                    table.update()
+                    .where(table.c.prefix == prefix, table.c.day == day)
+                    .values(last_value=last_value)
+                )
+        return day, last_value - count + 1
+
+    @classmethod
+    def next_references(cls, prefix, count=1, width=4):
+        """Retourne `count` références formatées PREFIX-YYYYMMDD-NNNN."""
+        if count <= 0:
+            return []
+        day, first = cls.allocate(prefix, count)
+        return [f'{prefix}-{day}-{first + i:0{width}d}' for i in range(count)]
+
+    def __repr__(self):
+        return f'<ReferenceCounter {self.prefix}-{self.day}: {self.last_value}>'
+
 class StockMovement(db.Model):
     """
     Historique complet des mouvements de stock
     Traçabilité : Qui, Quoi, Quand, Pourquoi, Combien
     """
     __tablename__ = 'stock_movements'
+    __table_args__ = (
+        # Rejeu borné du journal à partir d'un instantané (StockLedger)
+        db.Index('ix_stock_movements_product_location_id', 'product_id', 'stock_location', 'id'),
+        # Historique paginé par curseur (MovementHistoryQuery)
+        db.Index('ix_stock_movements_product_created', 'product_id', 'created_at'),
+        db.Index('ix_stock_movements_location_created', 'stock_location', 'created_at'),
+        db.Index('ix_stock_movements_created_id', 'created_at', 'id'),
+    )
     
     # Identifiants
     id = db.Column(db.Integer, primary_key=True)
@@ -85,11 +174,12 @@ class StockMovement(db.Model):
     
     def generate_reference(self):
         """Génère une référence unique pour le mouvement"""
-        date_str = datetime.now().strftime('%Y%m%d')
-        count = StockMovement.query.filter(
-            StockMovement.reference.like(f'MVT-{date_str}-%')
-        ).count()
-        self.reference = f'MVT-{date_str}-{count + 1:04d}'
+        self.reference = ReferenceCounter.next_references('MVT')[0]
+    
+    @classmethod
+    def reserve_references(cls, count):
+        """Réserve un bloc de références consécutives pour une insertion en masse"""
+        return ReferenceCounter.next_references('MVT', count)
     
     @property
     def is_positive(self):
@@ -157,7 +247,6 @@ class StockTransfer(db.Model):
     
     def generate_reference(self):
         """Génère une référence unique pour le transfert"""
-        date_str = datetime.now().strftime('%Y%m%d')
         # Préfixe selon type de transfert
         prefix_map = {
             'magasin_to_local': 'TML',      # Transfer Magasin to Local
@@ -169,10 +258,7 @@ class StockTransfer(db.Model):
         transfer_type = f"{self.source_location.value}_to_{self.destination_location.value}"
         prefix = prefix_map.get(transfer_type, 'TRF')
         
-        count = StockTransfer.query.filter(
-            StockTransfer.reference.like(f'{prefix}-{date_str}-%')
-        ).count()
-        self.reference = f'{prefix}-{date_str}-{count + 1:03d}'
+        self.reference = ReferenceCounter.next_references(prefix, width=3)[0]
     
     @property
     def is_pending(self):
@@ -319,6 +405,275 @@ class StockTransferLine(db.Model):
     def __repr__(self):
         return f'<TransferLine {self.product.name if self.product else "N/A"}: {self.quantity_requested:.2f}>'
 
+class StockSnapshot(db.Model):
+    """
+    Instantané périodique du stock par produit et localisation
+    Point de départ du rejeu : stock à une date = instantané + mouvements suivants
+    """
+    __tablename__ = 'stock_snapshots'
+    __table_args__ = (
+        db.Index('ix_stock_snapshots_lookup', 'product_id', 'stock_location', 'snapshot_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    stock_location = db.Column(db.Enum(StockLocationType), nullable=False)
+    quantity = db.Column(db.Float, nullable=False, default=0.0)
+    snapshot_at = db.Column(db.DateTime, nullable=False, index=True)
+    # Dernier mouvement inclus dans l'instantané (filigrane du rejeu)
+    last_movement_id = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<StockSnapshot {self.product_id} {self.stock_location.value} @ {self.snapshot_at}: {self.quantity:.2f}>'
+
+class StockForecast(db.Model):
+    """
+    Prévision de consommation par produit et localisation (ConsumptionForecast)
+    Débit moyen glissant, point de commande dynamique et jours de couverture
+    """
+    __tablename__ = 'stock_forecasts'
+
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), primary_key=True)
+    stock_location = db.Column(db.Enum(StockLocationType), primary_key=True)
+    avg_daily_consumption = db.Column(db.Float, nullable=False, default=0.0)
+    stddev_daily_consumption = db.Column(db.Float, nullable=False, default=0.0)
+    window_days = db.Column(db.Integer, nullable=False)
+    reorder_point = db.Column(db.Float, nullable=False, default=0.0)
+    stock_level = db.Column(db.Float, nullable=False, default=0.0)
+    days_of_cover = db.Column(db.Float)  # None : aucune consommation sur la fenêtre
+    last_consumed_at = db.Column(db.DateTime)
+    computed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    product = db.relationship('Product', lazy=True)
+
+    def __repr__(self):
+        return f'<StockForecast {self.product_id} {self.stock_location.value}: {self.avg_daily_consumption:.2f}/j>'
+
+class StockLocation(db.Model):
+    """
+    Localisation de stock déclarée en base (une ligne par emplacement).
+    Les quatre emplacements historiques ont une colonne miroir sur Product
+    (stock_column / threshold_column) ; un nouvel emplacement n'existe que
+    dans stock_levels.
+    """
+    __tablename__ = 'stock_locations'
+
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(50), unique=True, nullable=False)
+    name = db.Column(db.String(100), nullable=False)
+    stock_column = db.Column(db.String(50))
+    threshold_column = db.Column(db.String(50))
+    is_active = db.Column(db.Boolean, nullable=False, default=True)
+    display_order = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<StockLocation {self.key}>'
+
+class StockLevel(db.Model):
+    """
+    Niveau de stock d'un produit dans une localisation (StockLevelStore)
+    L'index partiel ix_stock_levels_low ne contient que les lignes sous leur
+    seuil : « stocks bas de la localisation X » est un parcours d'index.
+    """
+    __tablename__ = 'stock_levels'
+
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), primary_key=True)
+    location_id = db.Column(db.Integer, db.ForeignKey('stock_locations.id'), primary_key=True)
+    qty = db.Column(db.Float, nullable=False, default=0.0)
+    min_qty = db.Column(db.Float, nullable=False, default=0.0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    location = db.relationship('StockLocation', lazy=True)
+
+    __table_args__ = (
+        db.Index(
+            'ix_stock_levels_low', 'location_id', 'product_id',
+            postgresql_where=db.text('min_qty > 0 AND qty <= min_qty'),
+            sqlite_where=db.text('min_qty > 0 AND qty <= min_qty')
+        ),
+    )
+
+    def __repr__(self):
+        return f'<StockLevel {self.product_id}@{self.location_id}: {self.qty:.2f}/{self.min_qty:.2f}>'
+
+class StockCount(db.Model):
+    """
+    Session d'inventaire d'une localisation (StocktakeEngine)
+    Workflow: Open → Posted (ou Cancelled)
+    Le filigrane movement_watermark fige le stock théorique à l'ouverture :
+    les mouvements postés pendant le comptage ne faussent pas les écarts.
+    """
+    __tablename__ = 'stock_counts'
+
+    id = db.Column(db.Integer, primary_key=True)
+    reference = db.Column(db.String(50), unique=True, nullable=False)
+    stock_location = db.Column(db.Enum(StockLocationType), nullable=False)
+    status = db.Column(db.Enum(StockCountStatus), default=StockCountStatus.OPEN, nullable=False, index=True)
+    # Dernier mouvement du journal à l'ouverture de la session
+    movement_watermark = db.Column(db.Integer, nullable=False, default=0)
+    # Comptage complet : les produits non comptés en stock sont remis à zéro
+    full_count = db.Column(db.Boolean, nullable=False, default=False)
+    notes = db.Column(db.Text)
+
+    started_by_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    posted_by_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    posted_at = db.Column(db.DateTime)
+
+    # Totaux renseignés à la comptabilisation
+    lines_count = db.Column(db.Integer, nullable=False, default=0)
+    variance_lines_count = db.Column(db.Integer, nullable=False, default=0)
+    variance_value = db.Column(db.Float, nullable=False, default=0.0)
+
+    started_by = db.relationship('User', foreign_keys=[started_by_id])
+    posted_by = db.relationship('User', foreign_keys=[posted_by_id])
+    lines = db.relationship('StockCountLine', backref='stock_count', lazy='dynamic',
+                            cascade='all, delete-orphan')
+
+    def __init__(self, **kwargs):
+        super(StockCount, self).__init__(**kwargs)
+        if not self.reference:
+            self.reference = ReferenceCounter.next_references('INV', width=3)[0]
+
+    @property
+    def is_open(self):
+        return self.status == StockCountStatus.OPEN
+
+    def cancel(self):
+        """Abandonne la session (aucun mouvement n'a été écrit)"""
+        if self.is_open:
+            self.status = StockCountStatus.CANCELLED
+            return True
+        return False
+
+    def __repr__(self):
+        return f'<StockCount {self.reference} {self.stock_location.value} {self.status.value}>'
+
+class StockCountLine(db.Model):
+    """
+    Quantité comptée d'un produit dans une session d'inventaire
+    system_quantity / variance sont figés à la comptabilisation
+    """
+    __tablename__ = 'stock_count_lines'
+    __table_args__ = (
+        db.UniqueConstraint('count_id', 'product_id', name='uq_stock_count_lines_count_product'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    count_id = db.Column(db.Integer, db.ForeignKey('stock_counts.id', ondelete='CASCADE'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    counted_quantity = db.Column(db.Float, nullable=False, default=0.0)
+    system_quantity = db.Column(db.Float)
+    variance = db.Column(db.Float)
+    unit_cost = db.Column(db.Float)
+    counted_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    product = db.relationship('Product', lazy=True)
+
+    def __repr__(self):
+        return f'<StockCountLine {self.count_id}/{self.product_id}: {self.counted_quantity:.2f}>'
+
+class StockLot(db.Model):
+    """
+    Lot reçu d'un produit dans une localisation (LotTracker)
+    Les sorties consomment les lots premier-périmé-premier-sorti (FEFO) ;
+    seuls les lots non épuisés figurent dans les index partiels.
+    """
+    __tablename__ = 'stock_lots'
+    __table_args__ = (
+        # Consommation FEFO : lots ouverts d'un produit dans une localisation, par péremption
+        db.Index(
+            'ix_stock_lots_fefo', 'product_id', 'stock_location', 'expiry_date',
+            postgresql_where=db.text('remaining_quantity > 0'),
+            sqlite_where=db.text('remaining_quantity > 0')
+        ),
+        # Rapport « bientôt périmés » : parcours borné par date
+        db.Index(
+            'ix_stock_lots_expiring', 'expiry_date',
+            postgresql_where=db.text('remaining_quantity > 0 AND expiry_date IS NOT NULL'),
+            sqlite_where=db.text('remaining_quantity > 0 AND expiry_date IS NOT NULL')
+        ),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    stock_location = db.Column(db.Enum(StockLocationType), nullable=False)
+    lot_number = db.Column(db.String(50))
+    expiry_date = db.Column(db.Date)
+
+    received_quantity = db.Column(db.Float, nullable=False, default=0.0)
+    remaining_quantity = db.Column(db.Float, nullable=False, default=0.0)
+    unit_cost = db.Column(db.Float, default=0.0)
+
+    # Origine : ligne d'achat, ou lot source d'un transfert
+    purchase_id = db.Column(db.Integer, db.ForeignKey('purchases.id'), nullable=True, index=True)
+    purchase_item_id = db.Column(db.Integer, db.ForeignKey('purchase_items.id', ondelete='SET NULL'), nullable=True)
+    source_lot_id = db.Column(db.Integer, db.ForeignKey('stock_lots.id'), nullable=True)
+    received_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    product = db.relationship('Product', lazy=True)
+
+    @property
+    def is_expired(self):
+        return self.expiry_date is not None and self.expiry_date < datetime.utcnow().date()
+
+    def __repr__(self):
+        return f'<StockLot {self.lot_number or self.id} {self.product_id}@{self.stock_location.value}: {self.remaining_quantity:.2f}>'
+
+class CostLayer(db.Model):
+    """
+    Couche de coût FIFO d'un produit (CostLayerEngine)
+    Chaque entrée valorisée ouvre une couche ; les sorties épuisent les couches
+    les plus anciennes. L'index partiel ne contient que les couches ouvertes :
+    la plus ancienne couche d'un produit est une recherche d'index O(log n).
+    """
+    __tablename__ = 'cost_layers'
+    __table_args__ = (
+        db.Index(
+            'ix_cost_layers_open', 'product_id', 'id',
+            postgresql_where=db.text('remaining_quantity > 0'),
+            sqlite_where=db.text('remaining_quantity > 0')
+        ),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    quantity = db.Column(db.Float, nullable=False, default=0.0)
+    remaining_quantity = db.Column(db.Float, nullable=False, default=0.0)
+    unit_cost = db.Column(db.Float, nullable=False, default=0.0)
+
+    # Origine (NULL = couche d'ouverture reprise du stock existant)
+    movement_type = db.Column(db.Enum(StockMovementType), nullable=True)
+    purchase_id = db.Column(db.Integer, db.ForeignKey('purchases.id'), nullable=True, index=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    @property
+    def remaining_value(self):
+        return self.remaining_quantity * self.unit_cost
+
+    def __repr__(self):
+        return f'<CostLayer {self.product_id}#{self.id}: {self.remaining_quantity:.2f} @ {self.unit_cost:.4f}>'
+
+class ValuationSnapshot(db.Model):
+    """
+    Valorisation de fin de mois par produit : FIFO (couches ouvertes) et PMP
+    Écrite par `flask close-valuation` ; les mois clos se lisent sans rejeu.
+    """
+    __tablename__ = 'valuation_snapshots'
+
+    period = db.Column(db.String(7), primary_key=True)  # AAAA-MM
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), primary_key=True)
+    quantity = db.Column(db.Float, nullable=False, default=0.0)
+    fifo_quantity = db.Column(db.Float, nullable=False, default=0.0)
+    fifo_value = db.Column(db.Float, nullable=False, default=0.0)
+    pmp_value = db.Column(db.Float, nullable=False, default=0.0)    # quantité × PMP
+    book_value = db.Column(db.Float, nullable=False, default=0.0)   # total_stock_value
+    taken_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<ValuationSnapshot {self.period} {self.product_id}: FIFO {self.fifo_value:.2f} / PMP {self.pmp_value:.2f}>'
+
 # Fonctions utilitaires pour les stocks
 
 def get_stock_by_location(product_id, location_type):
@@ -352,7 +707,7 @@ def get_stock_by_location(product_id, location_type):
     
     return getattr(product, attr_name, 0.0)
 
-def update_stock_quantity(product_id, location_type, quantity_change, user_id, reason=None, order_id=None):
+def update_stock_quantity(product_id, location_type, quantity_change, user_id, reason=None, order_id=None, movement_type=None):
     """
     Met à jour le stock et crée un mouvement de traçabilité
     
@@ -363,11 +718,13 @@ def update_stock_quantity(product_id, location_type, quantity_change, user_id, r
         user_id (int): ID de l'utilisateur effectuant l'opération
         reason (str): Raison du mouvement
         order_id (int): ID de la commande liée (optionnel)
+        movement_type (StockMovementType): Type du mouvement (entrée/sortie par défaut)
     
     Returns:
         bool: Succès de l'opération
     """
     from models import Product
+    from app.stock.ledger import StockLedger
     
     try:
         # Récupération du produit
@@ -375,49 +732,15 @@ def update_stock_quantity(product_id, location_type, quantity_change, user_id, r
         if not product:
             return False
         
-        # Mapping vers les attributs du modèle Product
-        location_attrs = {
-            StockLocationType.COMPTOIR: 'stock_comptoir',
-            StockLocationType.INGREDIENTS_LOCAL: 'stock_ingredients_local',
-            StockLocationType.INGREDIENTS_MAGASIN: 'stock_ingredients_magasin',
-            StockLocationType.CONSOMMABLES: 'stock_consommables'
-        }
-        
-        attr_name = location_attrs.get(location_type)
-        if not attr_name:
-            return False
-        
-        # Stock avant modification
-        stock_before = getattr(product, attr_name, 0.0)
-        
-        # Nouveau stock après modification
-        stock_after = max(0, stock_before + quantity_change)
-        
-        # Mise à jour du stock
-        setattr(product, attr_name, stock_after)
-        
-        # Détermination du type de mouvement
-        if quantity_change > 0:
-            movement_type = StockMovementType.ENTREE
-        else:
-            movement_type = StockMovementType.SORTIE
-        
-        # Création du mouvement de traçabilité
-        movement = StockMovement(
-            product_id=product_id,
-            stock_location=location_type,
+        # Mise à jour du stock et mouvement de traçabilité via le journal
+        StockLedger(user_id).record(
+            product,
+            location_type,
+            quantity_change,
             movement_type=movement_type,
-            quantity=quantity_change,
-            unit_cost=product.cost_price or 0.0,
-            stock_before=stock_before,
-            stock_after=stock_after,
-            user_id=user_id,
-            order_id=order_id,
-            reason=reason
+            reason=reason,
+            order_id=order_id
         )
-        
-        # Sauvegarde
-        db.session.add(movement)
         db.session.commit()
         
         return True
@@ -7,15 +7,29 @@ Auteur: ERP Fée Maison
 
 """
 
-from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app, jsonify
+from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app, jsonify, Response, stream_with_context
 from flask_login import login_required, current_user
 from extensions import db
 from models import Product, User
-from .models import StockMovement, StockTransfer, StockTransferLine, StockLocationType, StockMovementType, TransferStatus
-from .forms import StockAdjustmentForm, QuickStockEntryForm, StockTransferForm, MultiLocationAdjustmentForm
+from .models import StockMovement, StockTransfer, StockTransferLine, StockLocationType, StockMovementType, TransferStatus, StockCount
+from .aggregation import StockAggregationService
+from .ledger import StockLedger
+from .levels import StockLevelStore
+from .history import MovementHistoryQuery
+from .forecast import ConsumptionForecast
+from .transfers import TransferPostingEngine, TransferStatusError, TransferStockError
+from .stocktake import StocktakeEngine, StocktakeError
+from .lots import LotTracker
+from .valuation import CostLayerEngine
+from app.orders.changefeed import ChangeFeed
+from app.orders.rollups import SalesRollup
+from app.purchases.mrp import RequirementsPlanner
+from app.recipes.bom import BomError
+from .forms import StockAdjustmentForm, QuickStockEntryForm, StockTransferForm, MultiLocationAdjustmentForm, StockCountForm, StockCountImportForm
 from decorators import admin_required
 from sqlalchemy import func, and_, or_
 from datetime import datetime, timedelta
+import json
 
 # Import du blueprint depuis __init__.py
 from . import bp as stock
@@ -28,51 +42,15 @@ from . import bp as stock
 def overview():
     """Vue d'ensemble globale des 4 stocks"""
     low_stock_threshold = current_app.config.get('LOW_STOCK_THRESHOLD', 5)
+    list_limit = current_app.config.get('STOCK_OVERVIEW_LIST_LIMIT', 50)
     
-    # Récupération de tous les produits
-    products = Product.query.all()
+    # Agrégats des 4 stocks calculés en une seule requête SQL
+    summary = StockAggregationService.get_location_summary(default_threshold=low_stock_threshold)
+    locations = summary['locations']
     
-    # ✅ CORRECTION : Analyse par localisation avec vrais attributs
-    comptoir_low = []
-    local_low = []
-    magasin_low = []
-    consommables_low = []
-    out_of_stock_products = []  # ✅ AJOUT : Variable manquante
-    
-    for product in products:
-        # Stock comptoir bas
-        if (product.stock_comptoir or 0) <= (product.seuil_min_comptoir or 5):
-            comptoir_low.append(product)
-        
-        # Stock local bas
-        if (product.stock_ingredients_local or 0) <= (product.seuil_min_ingredients_local or 5):
-            local_low.append(product)
-        
-        # Stock magasin bas
-        if (product.stock_ingredients_magasin or 0) <= (product.seuil_min_ingredients_magasin or 5):
-            magasin_low.append(product)
-        
-        # Stock consommables bas
-        if (product.stock_consommables or 0) <= (product.seuil_min_consommables or 5):
-            consommables_low.append(product)
-        
-        # ✅ AJOUT : Produits en rupture totale (toutes localisations)
-        total_stock = ((product.stock_comptoir or 0) + 
-                      (product.stock_ingredients_local or 0) + 
-                      (product.stock_ingredients_magasin or 0) + 
-                      (product.stock_consommables or 0))
-        if total_stock <= 0:
-            out_of_stock_products.append(product)
-    
-    # Calcul des valeurs totales par stock
-    total_value_comptoir = sum((p.stock_comptoir or 0) * float(p.cost_price or 0) for p in products)
-    total_value_local = sum((p.stock_ingredients_local or 0) * float(p.cost_price or 0) for p in products)
-    total_value_magasin = sum((p.stock_ingredients_magasin or 0) * float(p.cost_price or 0) for p in products)
-    total_value_consommables = sum((p.stock_consommables or 0) * float(p.cost_price or 0) for p in products)
-    
-    # Calculs corrigés
-    total_stock_value = total_value_comptoir + total_value_local + total_value_magasin + total_value_consommables
-    low_stock_products = comptoir_low + local_low + magasin_low + consommables_low
+    # Seules les lignes affichées par le template sont chargées
+    low_stock_products = StockAggregationService.get_low_stock_rows(list_limit, default_threshold=low_stock_threshold)
+    out_of_stock_products = StockAggregationService.get_out_of_stock_rows(list_limit)
     
     # Transferts en attente (simulation si table pas encore créée)
     try:
@@ -85,19 +63,20 @@ def overview():
     return render_template(
         'stock/stock_overview.html',
         title="Vue d'ensemble des 4 Stocks",
-        comptoir_low=comptoir_low,
-        local_low=local_low,
-        magasin_low=magasin_low,
-        consommables_low=consommables_low,
-        total_value_comptoir=total_value_comptoir,
-        total_value_local=total_value_local,
-        total_value_magasin=total_value_magasin,
-        total_value_consommables=total_value_consommables,
+        comptoir_low_count=locations['comptoir']['low_count'],
+        local_low_count=locations['ingredients_local']['low_count'],
+        magasin_low_count=locations['ingredients_magasin']['low_count'],
+        consommables_low_count=locations['consommables']['low_count'],
+        total_value_comptoir=locations['comptoir']['value'],
+        total_value_local=locations['ingredients_local']['value'],
+        total_value_magasin=locations['ingredients_magasin']['value'],
+        total_value_consommables=locations['consommables']['value'],
         pending_transfers=pending_transfers,
-        total_stock_value=total_stock_value,
+        total_stock_value=summary['total_value'],
         low_stock_products=low_stock_products,
-        # ✅ AJOUT : Variable manquante pour le template
-        out_of_stock_products=out_of_stock_products
+        low_stock_count=summary['low_stock_count'],
+        out_of_stock_products=out_of_stock_products,
+        out_of_stock_count=summary['out_of_stock_count']
     )
 
 @stock.route('/quick_entry', methods=['GET', 'POST'])
@@ -108,24 +87,19 @@ def quick_entry():
     form = QuickStockEntryForm()
     
     if form.validate_on_submit():
-        product_obj = form.product.data
+        product_obj = db.session.get(Product, form.product.data)
         quantity_received = form.quantity_received.data
         location_type = form.location_type.data
         
-        # Mise à jour du stock selon la localisation
-        if product_obj.update_stock_location(location_type, quantity_received):
-            db.session.commit()
-            
-            # Création du mouvement de traçabilité
-            from .models import update_stock_quantity
-            update_stock_quantity(
-                product_obj.id,
-                getattr(StockLocationType, location_type.upper()),
-                quantity_received,
-                current_user.id,
-                reason=f"Réception rapide - {form.reason.data or 'Arrivage marchandise'}"
-            )
-            
+        # Mise à jour du stock et traçabilité en une seule écriture du journal
+        from .models import update_stock_quantity
+        if update_stock_quantity(
+            product_obj.id,
+            location_type,
+            quantity_received,
+            current_user.id,
+            reason=f"Réception rapide - {form.reason.data or 'Arrivage marchandise'}"
+        ):
             flash(f'Stock {product_obj.get_location_display_name(location_type)} pour "{product_obj.name}" mis à jour : +{quantity_received}.', 'success')
         else:
             flash('Erreur lors de la mise à jour du stock.', 'danger')
@@ -142,7 +116,7 @@ def adjustment():
     form = MultiLocationAdjustmentForm()
     
     if form.validate_on_submit():
-        product_obj = form.product.data
+        product_obj = db.session.get(Product, form.product.data)
         location_type = form.location_type.data
         quantity_change = form.quantity.data
         reason = form.reason.data
@@ -154,20 +128,16 @@ def adjustment():
         if new_stock < 0:
             flash(f'Le stock {product_obj.get_location_display_name(location_type)} de "{product_obj.name}" ne peut pas devenir négatif.', 'danger')
         else:
-            # Mise à jour du stock
-            if product_obj.update_stock_location(location_type, quantity_change):
-                db.session.commit()
-                
-                # Création du mouvement de traçabilité
-                from .models import update_stock_quantity
-                update_stock_quantity(
-                    product_obj.id,
-                    getattr(StockLocationType, location_type.upper()),
-                    quantity_change,
-                    current_user.id,
-                    reason=reason or "Ajustement manuel"
-                )
-                
+            # Mise à jour du stock et traçabilité en une seule écriture du journal
+            from .models import update_stock_quantity
+            if update_stock_quantity(
+                product_obj.id,
+                location_type,
+                quantity_change,
+                current_user.id,
+                reason=reason or "Ajustement manuel",
+                movement_type=StockMovementType.AJUSTEMENT_POSITIF if quantity_change > 0 else StockMovementType.AJUSTEMENT_NEGATIF
+            ):
                 flash(f'Stock {product_obj.get_location_display_name(location_type)} de "{product_obj.name}" ajusté : {current_stock:+.2f} → {new_stock:.2f}.', 'success')
             else:
                 flash('Erreur lors de l\'ajustement du stock.', 'danger')
@@ -183,6 +153,9 @@ def adjustment():
 def dashboard_magasin():
     """Dashboard Stock Magasin - Interface Amel"""
     
+    # Version du flux de changements lue avant les données affichées
+    feed_version = ChangeFeed.current_version()
+    
     # Tous les ingrédients (pas seulement ceux en stock)
     all_ingredients = Product.query.filter(Product.product_type == 'ingredient').all()
     
@@ -197,29 +170,25 @@ def dashboard_magasin():
     # Stock critique (rupture totale)
     critical_ingredients = [p for p in all_ingredients if (p.stock_ingredients_magasin or 0) <= 0]
     
-    # Suggestions d'achat (produits avec stock bas)
-    suggested_purchases = []
-    for product in all_ingredients:
-        stock_level = product.stock_ingredients_magasin or 0
-        seuil = product.seuil_min_ingredients_magasin or 50
-        if stock_level <= seuil and stock_level > 0:
-            suggested_purchases.append({
-                'product_id': product.id,
-                'product_name': product.name,
-                'suggested_quantity': seuil * 2,  # Suggestion: 2x le seuil
-                'unit': product.unit or 'unités'
-            })
+    # Suggestions d'achat : besoins nets des commandes ouvertes (labo magasin)
+    planner = RequirementsPlanner(locations=('ingredients_magasin',))
+    try:
+        suggested_purchases = planner.plan()
+    except BomError as e:
+        current_app.logger.warning(f"Suggestions d'achat indisponibles: {e}")
+        suggested_purchases = []
     
     # Calculs statistiques
     total_ingredients_magasin = len([p for p in all_ingredients if (p.stock_ingredients_magasin or 0) > 0])
     critical_stock_count = len(critical_ingredients)
     total_value = sum((p.stock_ingredients_magasin or 0) * float(p.cost_price or 0) for p in all_ingredients)
     
-    # Achats en attente (simulation)
-    pending_purchases = 3  # À remplacer par vraie requête purchases
+    # Achats engagés pas encore reçus
+    pending_purchases = planner.open_purchase_count()
     
     return render_template(
         'stock/dashboard_magasin.html',
+        feed_version=feed_version,
         title="Dashboard Stock Magasin",
         # ✅ Variables templates corrigées
         ingredients_by_category=ingredients_by_category,
@@ -236,22 +205,20 @@ def dashboard_magasin():
 def dashboard_local():
     """Dashboard Stock Local - Interface Rayan"""
     
+    # Version du flux de changements lue avant les données affichées
+    feed_version = ChangeFeed.current_version()
+    
     # Ingrédients avec stock local
     ingredients_local = Product.query.filter(
         Product.product_type == 'ingredient'
     ).all()
     
-    # Ingrédients manquants pour production urgent
-    missing_ingredients_urgent = []
-    for product in ingredients_local:
-        stock_level = product.stock_ingredients_local or 0
-        seuil = product.seuil_min_ingredients_local or 10
-        if stock_level <= 0:
-            missing_ingredients_urgent.append({
-                'name': product.name,
-                'needed_quantity': seuil,
-                'unit': product.unit or 'unités'
-            })
+    # Ingrédients manquants pour production urgent (quantité : prévision de consommation)
+    missing_ingredients_urgent = [
+        {'name': alert['product_name'], 'needed_quantity': alert['suggested_quantity'], 'unit': alert['unit']}
+        for alert in ConsumptionForecast.alerts('ingredients_local', product_type='ingredient', default_threshold=10)
+        if alert['stock'] <= 0
+    ]
     
     # Commandes en attente (simulation)
     from models import Order
@@ -270,6 +237,7 @@ def dashboard_local():
     
     return render_template(
         'stock/dashboard_local.html',
+        feed_version=feed_version,
         title="Dashboard Stock Local",
         # ✅ Variables templates corrigées
         ingredients_local=ingredients_local,
@@ -287,6 +255,9 @@ def dashboard_local():
 def dashboard_comptoir():
     """Dashboard Stock Comptoir - Interface Yasmine"""
     
+    # Version du flux de changements lue avant les données affichées
+    feed_version = ChangeFeed.current_version()
+    
     # Produits finis
     all_products = Product.query.filter(Product.product_type == 'finished').all()
     
@@ -301,30 +272,29 @@ def dashboard_comptoir():
     # Produits en rupture
     out_of_stock_products = [p for p in all_products if (p.stock_comptoir or 0) <= 0]
     
-    # Ventes récentes (simulation)
+    # Ventes du jour (cumuls journaliers)
+    today = datetime.utcnow().date()
+    today_totals = SalesRollup.totals(today, today)
     recent_sales = [
         {
-            'product_name': 'Éclair au Chocolat',
-            'quantity': 2,
-            'total_amount': '800',
-            'time_ago': 'Il y a 15 min'
-        },
-        {
-            'product_name': 'Tarte aux Fraises',
-            'quantity': 1,
-            'total_amount': '1200',
-            'time_ago': 'Il y a 1h'
+            'product_name': row['product_name'],
+            'quantity': f"{row['quantity_sold']:g}",
+            'total_amount': f"{row['revenue']:.0f}",
+            'time_ago': "Aujourd'hui"
         }
+        for row in SalesRollup.by_product(today, today, limit=5)
+        if row['quantity_sold'] > 0
     ]
     
     # Statistiques
     total_products_comptoir = len([p for p in all_products if (p.stock_comptoir or 0) > 0])
     products_out_of_stock = len(out_of_stock_products)
-    sales_today = 12  # Simulation
-    revenue_today = '15750'  # Simulation
+    sales_today = today_totals['orders_delivered']
+    revenue_today = f"{today_totals['revenue']:.0f}"
     
     return render_template(
         'stock/dashboard_comptoir.html',
+        feed_version=feed_version,
         title="Dashboard Stock Comptoir",
         # ✅ Variables templates corrigées
         products_by_category=products_by_category,
@@ -341,6 +311,9 @@ def dashboard_comptoir():
 def dashboard_consommables():
     """Dashboard Stock Consommables - Interface Amel"""
     
+    # Version du flux de changements lue avant les données affichées
+    feed_version = ChangeFeed.current_version()
+    
     # Consommables
     all_consommables = Product.query.filter(Product.product_type == 'consommable').all()
     
@@ -352,18 +325,11 @@ def dashboard_consommables():
             consumables_by_category[category_name] = []
         consumables_by_category[category_name].append(consumable)
     
-    # Suggestions d'ajustement automatique
-    suggested_adjustments = []
-    for product in all_consommables:
-        stock_level = product.stock_consommables or 0
-        seuil = product.seuil_min_consommables or 20
-        if stock_level <= seuil:
-            suggested_adjustments.append({
-                'product_id': product.id,
-                'product_name': product.name,
-                'estimated_consumption': seuil * 3,  # Suggestion: 3x le seuil
-                'unit': product.unit or 'unités'
-            })
+    # Suggestions de réapprovisionnement : prévisions précalculées
+    suggested_adjustments = [
+        dict(alert, estimated_consumption=alert['suggested_quantity'])
+        for alert in ConsumptionForecast.alerts('consommables', product_type='consommable', default_threshold=20)
+    ]
     
     # Ajustements récents (simulation)
     recent_adjustments = [
@@ -389,6 +355,7 @@ def dashboard_consommables():
     
     return render_template(
         'stock/dashboard_consommables.html',
+        feed_version=feed_version,
         title="Dashboard Stock Consommables",
         # ✅ Variables templates corrigées
         consumables_by_category=consumables_by_category,
@@ -483,65 +450,175 @@ def complete_transfer(transfer_id):
         return redirect(url_for('stock.transfers_list'))
     
     try:
-        # Traitement de chaque ligne de transfert
-        for line in transfer.transfer_lines:
-            product = line.product
-            quantity = line.quantity_requested
-            
-            # Vérification du stock source
-            source_stock = product.get_stock_by_location_type(transfer.source_location.value)
-            if source_stock < quantity:
-                flash(f'Stock insuffisant pour {product.name} (disponible: {source_stock}, demandé: {quantity}).', 'danger')
-                return redirect(url_for('stock.transfers_list'))
-            
-            # Décrémentation stock source
-            product.update_stock_location(transfer.source_location.value, -quantity)
-            
-            # Incrémentation stock destination
-            product.update_stock_location(transfer.destination_location.value, quantity)
-            
-            # Création des mouvements de traçabilité
-            # Mouvement sortie
-            movement_out = StockMovement(
-                product_id=product.id,
-                stock_location=transfer.source_location,
-                movement_type=StockMovementType.TRANSFERT_SORTIE,
-                quantity=-quantity,
-                unit_cost=line.unit_cost,
-                user_id=current_user.id,
-                transfer_id=transfer.id,
-                reason=f"Transfert {transfer.reference} - Sortie"
-            )
-            db.session.add(movement_out)
-            
-            # Mouvement entrée
-            movement_in = StockMovement(
-                product_id=product.id,
-                stock_location=transfer.destination_location,
-                movement_type=StockMovementType.TRANSFERT_ENTREE,
-                quantity=quantity,
-                unit_cost=line.unit_cost,
-                user_id=current_user.id,
-                transfer_id=transfer.id,
-                reason=f"Transfert {transfer.reference} - Entrée"
-            )
-            db.session.add(movement_in)
-            
-            # Mise à jour de la ligne de transfert
-            line.quantity_transferred = quantity
-        
-        # Finalisation du transfert
-        transfer.complete(current_user.id)
+        TransferPostingEngine(current_user.id).complete(transfer)
         db.session.commit()
         
         flash(f'Transfert {transfer.reference} finalisé avec succès.', 'success')
         
+    except (TransferStatusError, TransferStockError) as e:
+        db.session.rollback()
+        flash(str(e), 'danger')
     except Exception as e:
         db.session.rollback()
         flash(f'Erreur lors de la finalisation du transfert: {str(e)}', 'danger')
     
     return redirect(url_for('stock.transfers_list'))
 
+# ==================== ROUTES INVENTAIRES ====================
+
+@stock.route('/counts', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def stock_counts():
+    """Sessions d'inventaire et ouverture d'une nouvelle session"""
+    form = StockCountForm()
+    
+    if form.validate_on_submit():
+        try:
+            count = StocktakeEngine(current_user.id).open(
+                form.location_type.data,
+                full_count=form.full_count.data,
+                notes=form.notes.data
+            )
+            db.session.commit()
+            flash(f'Inventaire {count.reference} ouvert.', 'success')
+            return redirect(url_for('stock.stock_count_detail', count_id=count.id))
+        except StocktakeError as e:
+            db.session.rollback()
+            flash(str(e), 'danger')
+    
+    counts = StockCount.query.order_by(StockCount.started_at.desc()).limit(50).all()
+    
+    return render_template(
+        'stock/stock_counts.html',
+        title="Inventaires",
+        form=form,
+        counts=counts
+    )
+
+@stock.route('/counts/<int:count_id>')
+@login_required
+@admin_required
+def stock_count_detail(count_id):
+    """Détail d'une session : lignes comptées et écarts"""
+    count = StockCount.query.get_or_404(count_id)
+    report = StocktakeEngine.variance_report(count)
+    
+    return render_template(
+        'stock/stock_count.html',
+        title=f"Inventaire {count.reference}",
+        count=count,
+        report=report,
+        variance_value=sum(item['value'] for item in report),
+        import_form=StockCountImportForm()
+    )
+
+@stock.route('/counts/<int:count_id>/import', methods=['POST'])
+@login_required
+@admin_required
+def import_stock_count(count_id):
+    """Import en masse d'un fichier de comptage"""
+    count = StockCount.query.get_or_404(count_id)
+    form = StockCountImportForm()
+    
+    if not form.validate_on_submit():
+        for errors in form.errors.values():
+            for error in errors:
+                flash(error, 'danger')
+        return redirect(url_for('stock.stock_count_detail', count_id=count.id))
+    
+    try:
+        result = StocktakeEngine(current_user.id).import_counts(count, form.count_file.data.read(), form.mode.data)
+        db.session.commit()
+        flash(f'{result["products"]} produit(s) importé(s) : {result["created"]} nouveau(x), {result["updated"]} mis à jour.', 'success')
+        if result['unknown']:
+            flash(f'Produits inconnus ({len(result["unknown"])}) : {", ".join(result["unknown"][:20])}', 'warning')
+        if result['errors']:
+            flash(f'Lignes ignorées ({len(result["errors"])}) : {" ".join(result["errors"][:10])}', 'warning')
+    except StocktakeError as e:
+        db.session.rollback()
+        flash(str(e), 'danger')
+    
+    return redirect(url_for('stock.stock_count_detail', count_id=count.id))
+
+@stock.route('/counts/<int:count_id>/post', methods=['POST'])
+@login_required
+@admin_required
+def post_stock_count(count_id):
+    """Comptabilisation de tous les écarts de la session"""
+    count = StockCount.query.get_or_404(count_id)
+    
+    try:
+        movements = StocktakeEngine(current_user.id).post(count)
+        db.session.commit()
+        flash(f'Inventaire {count.reference} comptabilisé : {movements} écart(s) posté(s).', 'success')
+    except StocktakeError as e:
+        db.session.rollback()
+        flash(str(e), 'danger')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Erreur lors de la comptabilisation de l\'inventaire: {str(e)}', 'danger')
+    
+    return redirect(url_for('stock.stock_count_detail', count_id=count.id))
+
+@stock.route('/counts/<int:count_id>/cancel', methods=['POST'])
+@login_required
+@admin_required
+def cancel_stock_count(count_id):
+    """Abandon d'une session d'inventaire"""
+    count = StockCount.query.get_or_404(count_id)
+    
+    if count.cancel():
+        db.session.commit()
+        flash(f'Inventaire {count.reference} annulé.', 'success')
+    else:
+        flash('Impossible d\'annuler cet inventaire.', 'danger')
+    
+    return redirect(url_for('stock.stock_counts'))
+
+# ==================== ROUTES LOTS ====================
+
+@stock.route('/lots/expiring')
+@login_required
+def expiring_lots():
+    """Lots périmés ou à consommer en priorité"""
+    days = max(request.args.get('days', LotTracker.DEFAULT_EXPIRING_DAYS, type=int), 0)
+    location = request.args.get('location') or None
+    try:
+        lots = LotTracker.expiring(days, location=location)
+    except ValueError:
+        location, lots = None, LotTracker.expiring(days)
+    
+    return render_template(
+        'stock/expiring_lots.html',
+        title="Lots à consommer en priorité",
+        lots=lots,
+        days=days,
+        location=location
+    )
+
+# ==================== ROUTES VALORISATION ====================
+
+@stock.route('/valuation')
+@login_required
+@admin_required
+def valuation():
+    """Valorisation du stock : FIFO par couches de coût et PMP côte à côte"""
+    period = request.args.get('period') or None
+    product_type = request.args.get('type') or None
+    periods = CostLayerEngine.periods()
+    if period not in periods:
+        period = None
+    
+    return render_template(
+        'stock/valuation.html',
+        title="Valorisation du stock",
+        report=CostLayerEngine.valuation(period, product_type=product_type),
+        periods=periods,
+        period=period,
+        product_type=product_type
+    )
+
 # ==================== ROUTES API/AJAX ====================
 
 @stock.route('/api/stock_levels/<int:product_id>')
@@ -556,28 +633,132 @@ def api_stock_levels(product_id):
         'ingredients_magasin': product.stock_ingredients_magasin,
         'consommables': product.stock_consommables,
         'total': product.total_stock_all_locations,
-        'low_stock_locations': product.get_low_stock_locations()
+        'low_stock_locations': product.get_low_stock_locations(),
+        # Toutes les localisations déclarées (stock_levels)
+        'locations': StockLevelStore.levels(product.id)
+    })
+
+@stock.route('/api/low_stock')
+@login_required
+def api_low_stock():
+    """
+    API : produits sous leur seuil dans une localisation (index partiel de stock_levels).
+    Paramètres : location (obligatoire), type (type de produit), limit (100 par défaut).
+    """
+    limit = min(request.args.get('limit', 100, type=int), 500)
+    try:
+        rows = StockLevelStore.low_stock(request.args.get('location', ''),
+                                         product_type=request.args.get('type') or None,
+                                         limit=limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'location': request.args['location'], 'count': len(rows), 'products': rows})
+
+@stock.route('/api/expiring_lots')
+@login_required
+def api_expiring_lots():
+    """
+    API : lots périmés ou périmant bientôt (index partiel de stock_lots).
+    Paramètres : days (7 par défaut), location (optionnel), limit (200 par défaut).
+    """
+    days = max(request.args.get('days', LotTracker.DEFAULT_EXPIRING_DAYS, type=int), 0)
+    limit = min(request.args.get('limit', 200, type=int), 1000)
+    try:
+        lots = LotTracker.expiring(days, location=request.args.get('location') or None, limit=limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'days': days, 'count': len(lots), 'lots': lots})
+
+@stock.route('/api/stock_levels/<int:product_id>/lots')
+@login_required
+def api_product_lots(product_id):
+    """API : lots ouverts d'un produit, dans l'ordre de consommation FEFO"""
+    product = Product.query.get_or_404(product_id)
+    return jsonify({
+        'product_id': product.id,
+        'lots': [{
+            'lot_id': lot.id,
+            'location': lot.stock_location.value,
+            'lot_number': lot.lot_number,
+            'expiry_date': lot.expiry_date.isoformat() if lot.expiry_date else None,
+            'remaining_quantity': lot.remaining_quantity,
+            'is_expired': lot.is_expired
+        } for lot in LotTracker.open_lots(product.id)]
     })
 
+@stock.route('/api/valuation')
+@login_required
+@admin_required
+def api_valuation():
+    """
+    API : valorisation FIFO / PMP par produit.
+    Paramètres : period (AAAA-MM d'un mois clos, sinon valorisation courante), type.
+    """
+    report = CostLayerEngine.valuation(request.args.get('period') or None,
+                                       product_type=request.args.get('type') or None)
+    return jsonify(report)
+
+@stock.route('/api/stock_levels/<int:product_id>/as_of')
+@login_required
+def api_stock_levels_as_of(product_id):
+    """API : niveaux de stock d'un produit à une date (?date=AAAA-MM-JJ ou ISO complet)"""
+    product = Product.query.get_or_404(product_id)
+    try:
+        at = datetime.fromisoformat(request.args.get('date', ''))
+    except ValueError:
+        return jsonify({'error': 'Paramètre date invalide (format ISO attendu).'}), 400
+    if len(request.args['date']) == 10:
+        # Date seule : stock en fin de journée
+        at = at + timedelta(days=1) - timedelta(microseconds=1)
+    
+    balances = StockLedger.balances_as_of(at, product_ids=[product.id])
+    levels = {
+        location.value: balances.get((product.id, location.value), 0.0)
+        for location in StockLocationType
+    }
+    levels['total'] = sum(levels.values())
+    levels['as_of'] = at.isoformat()
+    return jsonify(levels)
+
 @stock.route('/api/movements_history/<int:product_id>')
 @login_required
 def api_movements_history(product_id):
-    """API pour l'historique des mouvements d'un produit"""
-    movements = StockMovement.query.filter_by(product_id=product_id)\
-        .order_by(StockMovement.created_at.desc())\
-        .limit(20).all()
-    
-    movements_data = []
-    for movement in movements:
-        movements_data.append({
-            'reference': movement.reference,
-            'date': movement.created_at.strftime('%d/%m/%Y %H:%M'),
-            'type': movement.movement_type.value,
-            'location': movement.stock_location.value,
-            'quantity': movement.quantity,
-            'stock_after': movement.stock_after,
-            'reason': movement.reason,
-            'user': movement.user.username if movement.user else 'N/A'
-        })
-    
+    """API pour l'historique des mouvements d'un produit (?limit=20 par défaut)"""
+    limit = request.args.get('limit', 20, type=int)
+    movements_data, _ = MovementHistoryQuery(product_id=product_id).page(limit=limit)
     return jsonify(movements_data)
+
+@stock.route('/api/movements')
+@login_required
+def api_movements():
+    """
+    API paginée du journal des mouvements.
+    Filtres : product_id, location, type, order_id, from, to (ISO) ; pagination : cursor, limit.
+    """
+    try:
+        history = MovementHistoryQuery.from_args(request.args)
+        items, next_cursor = history.page(request.args.get('cursor'), request.args.get('limit', type=int))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'items': items, 'next_cursor': next_cursor})
+
+@stock.route('/api/movements/export.ndjson')
+@login_required
+@admin_required
+def api_movements_export():
+    """Export NDJSON (une ligne JSON par mouvement) diffusé au fil de l'eau, mêmes filtres que /api/movements"""
+    try:
+        history = MovementHistoryQuery.from_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    def generate():
+        for movement in history.iter_all():
+            yield json.dumps(movement, ensure_ascii=False) + '\n'
+
+    filename = f"mouvements_{datetime.now().strftime('%Y%m%d_%H%M%S')}.ndjson"
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
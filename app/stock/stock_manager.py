@@ -8,8 +8,10 @@ entre la terminologie métier (ex: 'Labo A') et la structure de la base de donn
 
 class StockLocationManager:
     """
-    Fournit des méthodes statiques pour gérer les emplacements de stock
-    sans avoir besoin d'un modèle de base de données dédié pour l'instant.
+    Fournit des méthodes statiques pour gérer les emplacements de stock.
+    Les correspondances ci-dessous ne concernent que les quatre emplacements
+    historiques (colonnes de Product) ; la liste complète des localisations
+    est en base (stock_locations, voir app/stock/levels.py).
     """
     
     # Dictionnaire de correspondance : Clé métier -> Nom de la colonne en BDD
@@ -23,6 +25,14 @@ class StockLocationManager:
         'consommables': 'stock_consommables'
     }
 
+    # Valeur de localisation (StockLocationType.value) -> Nom de la colonne en BDD
+    LOCATION_COLUMNS = {
+        'comptoir': 'stock_comptoir',
+        'ingredients_local': 'stock_ingredients_local',
+        'ingredients_magasin': 'stock_ingredients_magasin',
+        'consommables': 'stock_consommables'
+    }
+
     # Liste des emplacements de production valides pour les recettes
     PRODUCTION_LOCATIONS = [
         ('ingredients_magasin', 'Labo Magasin'),
@@ -47,4 +57,16 @@ class StockLocationManager:
         Retourne une liste de tuples (valeur, label) pour les formulaires WTForms,
         permettant de sélectionner un lieu de production.
         """
-        return cls.PRODUCTION_LOCATIONS
\ No newline at end of file
+        return cls.PRODUCTION_LOCATIONS
+
+    @classmethod
+    def get_stock_column(cls, location_key: str) -> str | None:
+        """
+        Retourne la colonne de stock pour une localisation, quelle que soit la
+        forme de la clé reçue : valeur de localisation ('ingredients_magasin'),
+        clé métier ('labo_a') ou nom de colonne ('stock_ingredients_magasin').
+        """
+        key = location_key.lower()
+        if key in cls.LOCATION_COLUMNS.values():
+            return key
+        return cls.LOCATION_COLUMNS.get(key) or cls.STOCK_MAPPINGS.get(key)
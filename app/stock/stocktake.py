@@ -0,0 +1,427 @@
+"""
+Sessions d'inventaire (comptage physique) par localisation
+Module: app/stock/stocktake.py
+Auteur: ERP Fée Maison
+
+Une session est ouverte pour une localisation ; le dernier mouvement du
+journal à l'ouverture est retenu comme filigrane. Les quantités comptées sont
+importées en masse depuis un CSV ou un fichier de douchette (une ligne par
+scan ou « code;quantité »), par lots de quelques requêtes quel que soit le
+nombre de lignes.
+
+Le stock théorique à l'ouverture vaut le stock courant moins les mouvements
+postés depuis le filigrane (une requête agrégée) : les ventes ou réceptions
+faites pendant le comptage ne faussent pas les écarts. À la comptabilisation,
+tous les écarts sont postés comme mouvements INVENTAIRE par le journal de stock
+(post_batch : un UPDATE des colonnes de stock, un INSERT multi-lignes).
+"""
+
+import csv
+import io
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import bindparam, func, insert, update
+
+from extensions import db
+from app.products.search import fold_search_text
+from app.stock.ledger import StockLedger
+from app.stock.models import (StockCount, StockCountLine, StockCountStatus,
+                              StockMovement, StockMovementType)
+
+
+class StocktakeError(ValueError):
+    """Session d'inventaire non modifiable ou fichier de comptage illisible."""
+
+
+class StocktakeEngine:
+    """
+    Ouverture, import et comptabilisation des sessions d'inventaire.
+    L'appelant reste responsable du commit / rollback de la session.
+    """
+
+    # En-têtes reconnus (minuscules, sans accents)
+    HEADER_ALIASES = {
+        'product_id': ('product_id', 'id', 'id_produit'),
+        'sku': ('sku', 'code', 'barcode', 'ean', 'reference', 'ref'),
+        'name': ('name', 'nom', 'produit', 'product', 'designation'),
+        'quantity': ('quantity', 'qty', 'quantite', 'qte', 'counted', 'compte'),
+    }
+    DELIMITERS = ',;\t'
+    IMPORT_MODES = ('replace', 'add')
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+
+    # ------------------------------------------------------------------ #
+    # Ouverture
+    # ------------------------------------------------------------------ #
+
+    def open(self, location, full_count=False, notes=None):
+        """
+        Ouvre une session d'inventaire pour une localisation.
+
+        :param full_count: Les produits en stock non comptés seront remis à zéro.
+        :raises StocktakeError: si une session est déjà ouverte sur la localisation.
+        """
+        location_type, _ = StockLedger.resolve_location(location)
+        already_open = db.session.query(StockCount.reference)\
+            .filter(StockCount.stock_location == location_type,
+                    StockCount.status == StockCountStatus.OPEN).first()
+        if already_open:
+            raise StocktakeError(f"L'inventaire {already_open.reference} est déjà ouvert pour cette localisation.")
+
+        count = StockCount(
+            stock_location=location_type,
+            movement_watermark=db.session.query(func.max(StockMovement.id)).scalar() or 0,
+            full_count=bool(full_count),
+            started_by_id=self.user_id,
+            notes=notes
+        )
+        db.session.add(count)
+        db.session.flush()
+        return count
+
+    # ------------------------------------------------------------------ #
+    # Import des quantités comptées
+    # ------------------------------------------------------------------ #
+
+    @classmethod
+    def parse(cls, content):
+        """
+        Lit un fichier de comptage.
+
+        Formats acceptés : CSV avec en-tête (product_id / sku / nom + quantité,
+        séparateur « , », « ; » ou tabulation) ou fichier de douchette sans
+        en-tête (« code » = 1 unité par scan, « code;quantité »).
+        Les quantités d'un même identifiant sont cumulées.
+
+        :return: (dict {(type d'identifiant, valeur): quantité}, liste d'erreurs)
+        :raises StocktakeError: si le fichier est vide ou illisible.
+        """
+        if isinstance(content, bytes):
+            try:
+                content = content.decode('utf-8-sig')
+            except UnicodeDecodeError:
+                content = content.decode('latin-1')
+        content = content.lstrip('\ufeff')
+        if not content.strip():
+            raise StocktakeError("Le fichier de comptage est vide.")
+
+        sample = content[:4096]
+        try:
+            delimiter = csv.Sniffer().sniff(sample, delimiters=cls.DELIMITERS).delimiter
+        except csv.Error:
+            # Fichier de douchette à une colonne : aucun séparateur à détecter
+            delimiter = next((d for d in cls.DELIMITERS if d in sample), ',')
+        rows = [row for row in csv.reader(io.StringIO(content), delimiter=delimiter)
+                if any(cell.strip() for cell in row)]
+
+        columns = cls._header_columns(rows[0]) if rows else None
+        if columns is not None:
+            rows = rows[1:]
+            if 'quantity' not in columns or not ({'product_id', 'sku', 'name'} & columns.keys()):
+                raise StocktakeError("En-tête incomplet : une colonne produit (product_id, sku ou nom) et une colonne quantité sont requises.")
+
+        quantities = defaultdict(float)
+        errors = []
+        first_line = 2 if columns is not None else 1
+        for line_number, row in enumerate(rows, start=first_line):
+            cells = [cell.strip() for cell in row]
+            if columns is not None:
+                key = next(((kind, cells[columns[kind]]) for kind in ('product_id', 'sku', 'name')
+                            if kind in columns and columns[kind] < len(cells) and cells[columns[kind]]), None)
+                raw_quantity = cells[columns['quantity']] if columns['quantity'] < len(cells) else ''
+            else:
+                key = ('code', cells[0]) if cells[0] else None
+                raw_quantity = cells[1] if len(cells) > 1 else '1'
+            if key is None:
+                errors.append(f"Ligne {line_number} : produit manquant.")
+                continue
+            try:
+                quantity = float(raw_quantity.replace(' ', '').replace(',', '.'))
+            except ValueError:
+                errors.append(f"Ligne {line_number} : quantité invalide « {raw_quantity} ».")
+                continue
+            if quantity < 0:
+                errors.append(f"Ligne {line_number} : quantité négative « {raw_quantity} ».")
+                continue
+            quantities[key] += quantity
+        return dict(quantities), errors
+
+    @classmethod
+    def _header_columns(cls, row):
+        """Index des colonnes reconnues si la ligne est un en-tête, sinon None."""
+        columns = {}
+        for index, cell in enumerate(row):
+            label = fold_search_text(cell).strip().replace(' ', '_')
+            for kind, aliases in cls.HEADER_ALIASES.items():
+                if label in aliases and kind not in columns:
+                    columns[kind] = index
+        return columns or None
+
+    @staticmethod
+    def resolve_products(keys):
+        """
+        Associe les identifiants lus aux produits, une requête IN par type.
+        Un code de douchette est cherché comme SKU, puis comme id numérique,
+        puis comme nom.
+
+        :return: (dict {clé: product_id}, liste des clés inconnues)
+        """
+        from models import Product
+
+        by_kind = defaultdict(set)
+        for kind, value in keys:
+            if kind in ('sku', 'code'):
+                by_kind['sku'].add(value)
+            if kind in ('product_id', 'code') and value.isdigit():
+                by_kind['product_id'].add(int(value))
+            if kind in ('name', 'code'):
+                by_kind['name'].add(fold_search_text(value))
+
+        skus, ids, names = {}, set(), {}
+        if by_kind['sku']:
+            skus = dict(db.session.query(Product.sku, Product.id).filter(Product.sku.in_(by_kind['sku'])).all())
+        if by_kind['product_id']:
+            ids = {row.id for row in db.session.query(Product.id).filter(Product.id.in_(by_kind['product_id'])).all()}
+        if by_kind['name']:
+            for search_name, product_id in db.session.query(Product.search_name, Product.id)\
+                    .filter(Product.search_name.in_(by_kind['name'])).order_by(Product.id).all():
+                names.setdefault(search_name, product_id)
+
+        resolved, unknown = {}, []
+        for key in keys:
+            kind, value = key
+            product_id = None
+            if kind in ('sku', 'code'):
+                product_id = skus.get(value)
+            if product_id is None and kind in ('product_id', 'code') and value.isdigit() and int(value) in ids:
+                product_id = int(value)
+            if product_id is None and kind in ('name', 'code'):
+                product_id = names.get(fold_search_text(value))
+            if product_id is None:
+                unknown.append(value)
+            else:
+                resolved[key] = product_id
+        return resolved, unknown
+
+    def import_counts(self, count, content, mode='replace'):
+        """
+        Importe un fichier de comptage dans une session ouverte.
+
+        :param mode: 'replace' remplace la quantité déjà comptée d'un produit,
+                     'add' la cumule (plusieurs fichiers de douchette par zone).
+        :return: dict {'identifiers', 'products', 'created', 'updated', 'unknown', 'errors'}.
+        :raises StocktakeError: si la session n'est pas ouverte ou le fichier illisible.
+        """
+        if not count.is_open:
+            raise StocktakeError(f"L'inventaire {count.reference} n'est plus modifiable.")
+        if mode not in self.IMPORT_MODES:
+            raise StocktakeError(f"Mode d'import inconnu : {mode!r}")
+
+        quantities, errors = self.parse(content)
+        resolved, unknown = self.resolve_products(list(quantities))
+
+        counted = defaultdict(float)
+        for key, product_id in resolved.items():
+            counted[product_id] += quantities[key]
+
+        existing = dict(
+            db.session.query(StockCountLine.product_id, StockCountLine.id)
+            .filter(StockCountLine.count_id == count.id, StockCountLine.product_id.in_(list(counted))).all()
+        ) if counted else {}
+
+        now = datetime.utcnow()
+        new_rows = [
+            {'count_id': count.id, 'product_id': product_id, 'counted_quantity': quantity, 'counted_at': now}
+            for product_id, quantity in counted.items() if product_id not in existing
+        ]
+        if new_rows:
+            db.session.execute(insert(StockCountLine), new_rows)
+        if existing:
+            table = StockCountLine.__table__
+            new_value = bindparam('b_qty') if mode == 'replace' else table.c.counted_quantity + bindparam('b_qty')
+            db.session.execute(
+                update(table).where(table.c.id == bindparam('b_id'))
+                .values(counted_quantity=new_value, counted_at=now),
+                [{'b_id': line_id, 'b_qty': counted[product_id]} for product_id, line_id in existing.items()]
+            )
+
+        return {
+            'identifiers': len(quantities),
+            'products': len(counted),
+            'created': len(new_rows),
+            'updated': len(existing),
+            'unknown': unknown,
+            'errors': errors
+        }
+
+    # ------------------------------------------------------------------ #
+    # Écarts
+    # ------------------------------------------------------------------ #
+
+    @staticmethod
+    def movements_since_open(count, product_ids=None):
+        """Mouvements nets postés sur la localisation depuis l'ouverture, par produit."""
+        query = db.session.query(StockMovement.product_id, func.sum(StockMovement.quantity))\
+            .filter(StockMovement.stock_location == count.stock_location,
+                    StockMovement.id > count.movement_watermark)
+        if product_ids is not None:
+            query = query.filter(StockMovement.product_id.in_(list(product_ids)))
+        return {product_id: float(total or 0) for product_id, total in query.group_by(StockMovement.product_id).all()}
+
+    @classmethod
+    def variance_report(cls, count):
+        """
+        Lignes de la session avec stock théorique et écart.
+        Une session comptabilisée restitue les valeurs figées ; une session
+        ouverte les calcule à partir du stock courant et du filigrane.
+
+        :return: Liste de dicts triée par valeur d'écart absolue décroissante.
+        """
+        from models import Product
+
+        _, column = StockLedger.resolve_location(count.stock_location)
+        rows = db.session.query(
+            StockCountLine.product_id, StockCountLine.counted_quantity,
+            StockCountLine.system_quantity, StockCountLine.variance, StockCountLine.unit_cost,
+            Product.name, Product.sku, Product.unit, Product.cost_price,
+            getattr(Product, column).label('current')
+        ).join(Product, Product.id == StockCountLine.product_id)\
+         .filter(StockCountLine.count_id == count.id).all()
+
+        since = {} if not count.is_open else cls.movements_since_open(count)
+        report = []
+        for row in rows:
+            counted = float(row.counted_quantity or 0)
+            if count.is_open:
+                system = float(row.current or 0) - since.get(row.product_id, 0.0)
+                variance = counted - system
+                unit_cost = float(row.cost_price or 0)
+            else:
+                system = float(row.system_quantity or 0)
+                variance = float(row.variance or 0)
+                unit_cost = float(row.unit_cost or 0)
+            report.append({
+                'product_id': row.product_id,
+                'name': row.name,
+                'sku': row.sku,
+                'unit': row.unit,
+                'counted': counted,
+                'system': system,
+                'variance': variance,
+                'value': variance * unit_cost
+            })
+        report.sort(key=lambda item: (-abs(item['value']), -abs(item['variance']), item['name']))
+        return report
+
+    # ------------------------------------------------------------------ #
+    # Comptabilisation
+    # ------------------------------------------------------------------ #
+
+    def post(self, count):
+        """
+        Poste tous les écarts de la session en une transaction.
+
+        Les produits de la session sont verrouillés, le stock théorique à
+        l'ouverture déduit du stock verrouillé et des mouvements postérieurs,
+        puis chaque écart non nul devient un mouvement INVENTAIRE. Les
+        mouvements postés pendant le comptage sont ainsi conservés.
+
+        :return: Nombre de mouvements créés.
+        :raises StocktakeError: si la session n'est pas ouverte.
+        """
+        from models import Product
+
+        # Réservation atomique : deux validations concurrentes ne postent pas deux fois
+        table = StockCount.__table__
+        claimed = db.session.execute(
+            update(table)
+            .where(table.c.id == count.id, table.c.status == StockCountStatus.OPEN)
+            .values(status=StockCountStatus.POSTED)
+        ).rowcount
+        if not claimed:
+            raise StocktakeError(f"L'inventaire {count.reference} n'est plus modifiable.")
+
+        location_type, column = StockLedger.resolve_location(count.stock_location)
+        stock_column = getattr(Product, column)
+
+        if count.full_count:
+            # Produits en stock non comptés : comptés à zéro
+            counted_ids = db.session.query(StockCountLine.product_id).filter(StockCountLine.count_id == count.id)
+            missing = db.session.query(Product.id)\
+                .filter(stock_column != 0, Product.id.notin_(counted_ids.scalar_subquery())).all()
+            if missing:
+                now = datetime.utcnow()
+                db.session.execute(insert(StockCountLine), [
+                    {'count_id': count.id, 'product_id': row.id, 'counted_quantity': 0.0, 'counted_at': now}
+                    for row in missing
+                ])
+
+        lines = db.session.query(StockCountLine.id, StockCountLine.product_id, StockCountLine.counted_quantity)\
+            .filter(StockCountLine.count_id == count.id).all()
+
+        ledger = StockLedger(self.user_id)
+        balances = ledger.lock_balances({line.product_id for line in lines}, Product.cost_price)
+        since = self.movements_since_open(count)
+
+        entries, line_updates, values = [], [], {}
+        total_value = 0.0
+        for line in lines:
+            balance = balances[line.product_id]
+            system = float(getattr(balance, column) or 0) - since.get(line.product_id, 0.0)
+            variance = float(line.counted_quantity or 0) - system
+            unit_cost = float(balance.cost_price or 0)
+            line_updates.append({'b_id': line.id, 'b_system': system, 'b_variance': variance, 'b_cost': unit_cost})
+            if abs(variance) < 1e-9:
+                continue
+            entries.append({
+                'product_id': line.product_id,
+                'location': location_type,
+                'quantity': variance,
+                'movement_type': StockMovementType.INVENTAIRE,
+                'unit_cost': unit_cost,
+                'reason': f"Inventaire {count.reference}"
+            })
+
+        movement_rows = ledger.post_batch(entries, balances=balances)
+        for row in movement_rows:
+            # Écart réellement appliqué (après plancher à 0)
+            value = row['quantity'] * row['unit_cost']
+            values[row['product_id']] = values.get(row['product_id'], 0.0) + value
+            total_value += value
+
+        if line_updates:
+            table = StockCountLine.__table__
+            db.session.execute(
+                update(table).where(table.c.id == bindparam('b_id'))
+                .values(system_quantity=bindparam('b_system'), variance=bindparam('b_variance'),
+                        unit_cost=bindparam('b_cost')),
+                line_updates
+            )
+        self._bulk_update_values(values)
+        ledger.expire_products(balances)
+
+        count.status = StockCountStatus.POSTED
+        count.posted_by_id = self.user_id
+        count.posted_at = datetime.utcnow()
+        count.lines_count = len(lines)
+        count.variance_lines_count = len(movement_rows)
+        count.variance_value = total_value
+        return len(movement_rows)
+
+    @staticmethod
+    def _bulk_update_values(values):
+        """total_stock_value += écart valorisé au PMP, en un UPDATE exécuté en lot."""
+        from models import Product
+
+        values = {product_id: value for product_id, value in values.items() if value}
+        if not values:
+            return
+        table = Product.__table__
+        db.session.execute(
+            update(table).where(table.c.id == bindparam('b_id'))
+            .values(total_stock_value=func.coalesce(table.c.total_stock_value, 0) + bindparam('b_value')),
+            [{'b_id': product_id, 'b_value': value} for product_id, value in values.items()]
+        )
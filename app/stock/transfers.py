@@ -0,0 +1,144 @@
+"""
+Finalisation groupée des transferts de stock
+Module: app/stock/transfers.py
+Auteur: ERP Fée Maison
+
+Toutes les lignes d'un transfert sont lues en une requête, les produits
+concernés verrouillés en un SELECT ... FOR UPDATE et le stock source validé
+pour chaque ligne avant toute écriture. Les deltas sont ensuite appliqués par
+le journal de stock (une instruction UPDATE) et les mouvements insérés en masse.
+Les lots suivent le stock : consommés FEFO à la source, recréés à destination.
+"""
+
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import update
+
+from extensions import db
+from app.stock.ledger import StockLedger
+from app.stock.lots import LotTracker
+from app.stock.models import StockMovementType, StockTransfer, StockTransferLine, TransferStatus
+
+
+class TransferStockError(ValueError):
+    """Stock source insuffisant pour une ou plusieurs lignes du transfert."""
+
+    def __init__(self, shortages):
+        self.shortages = shortages
+        details = ", ".join(
+            f"{item['product_name']} (disponible: {item['available']}, demandé: {item['requested']})"
+            for item in shortages
+        )
+        super().__init__(f"Stock insuffisant pour {details}.")
+
+
+class TransferStatusError(ValueError):
+    """Le transfert n'est plus finalisable (déjà terminé, annulé ou non approuvé)."""
+
+    def __init__(self, transfer):
+        super().__init__(f"Le transfert {transfer.reference} ne peut pas être finalisé.")
+
+
+class TransferPostingEngine:
+    """
+    Finalise un transfert en une transaction.
+    L'appelant reste responsable du commit / rollback de la session.
+    """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+
+    def complete(self, transfer):
+        """
+        Déplace le stock de toutes les lignes et marque le transfert terminé.
+
+        :raises TransferStatusError: si le transfert n'est pas (ou plus) finalisable.
+        :raises TransferStockError: si le stock source ne couvre pas une ligne
+                                    (aucune écriture de stock n'a alors été faite).
+        :return: Nombre de mouvements créés.
+        """
+        from models import Product
+
+        # Réservation atomique : deux finalisations concurrentes ne déplacent pas deux fois le stock
+        table = StockTransfer.__table__
+        claimed = db.session.execute(
+            update(table)
+            .where(table.c.id == transfer.id,
+                   table.c.status.in_([TransferStatus.APPROVED, TransferStatus.IN_TRANSIT]))
+            .values(status=TransferStatus.COMPLETED,
+                    completed_by_id=self.user_id,
+                    completed_date=datetime.utcnow())
+        ).rowcount
+        if not claimed:
+            raise TransferStatusError(transfer)
+
+        lines = db.session.query(
+            StockTransferLine.product_id,
+            StockTransferLine.quantity_requested,
+            StockTransferLine.unit_cost,
+            Product.name
+        ).join(Product, Product.id == StockTransferLine.product_id)\
+         .filter(StockTransferLine.transfer_id == transfer.id)\
+         .order_by(StockTransferLine.id).all()
+
+        ledger = StockLedger(self.user_id)
+        _, source_column = ledger.resolve_location(transfer.source_location)
+        balances = ledger.lock_balances({line.product_id for line in lines})
+
+        # Validation de toutes les lignes avant la moindre écriture
+        requested = defaultdict(float)
+        names = {}
+        for line in lines:
+            requested[line.product_id] += float(line.quantity_requested or 0)
+            names[line.product_id] = line.name
+        shortages = []
+        for product_id, quantity in requested.items():
+            available = float(getattr(balances[product_id], source_column) or 0)
+            if available < quantity:
+                shortages.append({
+                    'product_id': product_id,
+                    'product_name': names[product_id],
+                    'available': available,
+                    'requested': quantity
+                })
+        if shortages:
+            raise TransferStockError(shortages)
+
+        entries = []
+        for line in lines:
+            quantity = float(line.quantity_requested or 0)
+            common = {
+                'product_id': line.product_id,
+                'unit_cost': line.unit_cost,
+                'transfer_id': transfer.id
+            }
+            entries.append(dict(common,
+                                location=transfer.source_location,
+                                quantity=-quantity,
+                                movement_type=StockMovementType.TRANSFERT_SORTIE,
+                                reason=f"Transfert {transfer.reference} - Sortie",
+                                track_lots=False))
+            entries.append(dict(common,
+                                location=transfer.destination_location,
+                                quantity=quantity,
+                                movement_type=StockMovementType.TRANSFERT_ENTREE,
+                                reason=f"Transfert {transfer.reference} - Entrée"))
+        movement_rows = ledger.post_batch(entries, balances=balances)
+        LotTracker.transfer([
+            (line.product_id, transfer.source_location, transfer.destination_location,
+             float(line.quantity_requested or 0))
+            for line in lines
+        ])
+
+        # Toutes les lignes sont transférées intégralement
+        table = StockTransferLine.__table__
+        db.session.execute(
+            update(table)
+            .where(table.c.transfer_id == transfer.id)
+            .values(quantity_transferred=table.c.quantity_requested)
+        )
+        for line in transfer.__dict__.get('transfer_lines', ()):
+            db.session.expire(line, ['quantity_transferred'])
+        db.session.expire(transfer, ['status', 'completed_by_id', 'completed_date'])
+        return len(movement_rows)
@@ -0,0 +1,338 @@
+"""
+Valorisation FIFO par couches de coût, à côté du PMP
+Module: app/stock/valuation.py
+Auteur: ERP Fée Maison
+
+Chaque entrée valorisée passée au journal de stock (achat, production,
+inventaire...) ouvre une couche (quantité, coût unitaire). Chaque sortie
+épuise les couches les plus anciennes du produit. Les couches ouvertes sont
+lues sur l'index partiel ix_cost_layers_open (product_id, id) par paquets
+bornés : le premier paquet de tous les produits en une requête, puis produit
+par produit (LIMIT), en reprenant après la dernière couche lue, jusqu'à
+couvrir la quantité sortie. Les couches épuisées sortent de l'index.
+
+Les transferts entre localisations ne changent pas la valeur du produit et
+ne touchent pas aux couches. La valorisation FIFO (somme des couches
+ouvertes) est restituée à côté du PMP (quantité × cost_price) et de la
+valeur comptable (total_stock_value). La commande `flask close-valuation`
+fige les soldes de fin de mois dans valuation_snapshots.
+"""
+
+import re
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import bindparam, func, insert, update
+
+from extensions import db
+from app.stock.models import CostLayer, StockMovementType, ValuationSnapshot
+from app.stock.stock_manager import StockLocationManager
+
+
+class CostLayerEngine:
+    """
+    Ouverture et consommation des couches FIFO.
+    L'appelant reste responsable du commit / rollback de la session.
+    """
+
+    # Mouvements internes : la valeur du produit ne change pas
+    INTERNAL_TYPES = (StockMovementType.TRANSFERT_SORTIE, StockMovementType.TRANSFERT_ENTREE)
+    EPSILON = 1e-9
+    CHUNK_SIZE = 50
+
+    @classmethod
+    def is_valued(cls, movement_type):
+        return movement_type not in cls.INTERNAL_TYPES
+
+    @classmethod
+    def post(cls, inflows=(), outflows=None):
+        """
+        Ouvre les couches des entrées et épuise les couches pour les sorties.
+
+        :param inflows: dicts {'product_id', 'quantity', 'unit_cost', 'movement_type',
+                        'purchase_id', 'order_id'} (quantités positives).
+        :param outflows: dict {(product_id, purchase_id ou None): quantité sortie}.
+                         Avec un purchase_id, les couches de cet achat sont épuisées
+                         d'abord (annulation d'un bon reçu), puis FIFO.
+        :return: dict {product_id: coût FIFO des quantités sorties}.
+        """
+        cost = cls.consume(outflows or {})
+        now = datetime.utcnow()
+        layers = [{
+            'product_id': row['product_id'],
+            'quantity': float(row['quantity']),
+            'remaining_quantity': float(row['quantity']),
+            'unit_cost': float(row.get('unit_cost') or 0),
+            'movement_type': row.get('movement_type'),
+            'purchase_id': row.get('purchase_id'),
+            'order_id': row.get('order_id'),
+            'created_at': now
+        } for row in inflows if float(row['quantity'] or 0) > cls.EPSILON]
+        if layers:
+            db.session.execute(insert(CostLayer), layers)
+        return cost
+
+    @classmethod
+    def consume(cls, outflows):
+        """
+        Épuise les couches ouvertes, de la plus ancienne à la plus récente.
+        Une sortie au-delà des couches ouvertes (stock non valorisé) n'est pas
+        comptée dans le coût retourné.
+
+        :param outflows: dict {(product_id, purchase_id ou None): quantité}.
+        :return: dict {product_id: coût FIFO consommé}.
+        """
+        wanted = defaultdict(float)
+        targeted = defaultdict(float)
+        for (product_id, purchase_id), quantity in outflows.items():
+            if quantity > cls.EPSILON:
+                wanted[product_id] += float(quantity)
+                if purchase_id is not None:
+                    targeted[(product_id, purchase_id)] += float(quantity)
+        if not wanted:
+            return {}
+
+        left = {}        # layer_id -> quantité restante après la sortie
+        original = {}    # layer_id -> quantité restante avant la sortie
+        cost = defaultdict(float)
+
+        def walk(product_id, quantity, purchase_id=None, first_chunk=None):
+            for layer in cls._open_layers(product_id, purchase_id, first_chunk):
+                if layer.id not in left:
+                    left[layer.id] = original[layer.id] = float(layer.remaining_quantity)
+                taken = min(quantity, left[layer.id])
+                if taken <= cls.EPSILON:
+                    continue
+                left[layer.id] -= taken
+                quantity -= taken
+                cost[product_id] += taken * float(layer.unit_cost)
+                if quantity <= cls.EPSILON:
+                    break
+            return quantity
+
+        # Couches de l'achat annulé d'abord, puis FIFO sur le reste
+        for (product_id, purchase_id), quantity in targeted.items():
+            wanted[product_id] -= quantity - walk(product_id, quantity, purchase_id)
+        pending = [product_id for product_id, quantity in wanted.items() if quantity > cls.EPSILON]
+        first_chunks = cls._first_chunks(pending)
+        for product_id in pending:
+            walk(product_id, wanted[product_id], first_chunk=first_chunks.get(product_id, []))
+
+        updates = [
+            {'b_id': layer_id, 'b_left': remaining if remaining > cls.EPSILON else 0.0}
+            for layer_id, remaining in left.items() if remaining != original[layer_id]
+        ]
+        if updates:
+            table = CostLayer.__table__
+            db.session.execute(
+                update(table).where(table.c.id == bindparam('b_id'))
+                .values(remaining_quantity=bindparam('b_left')),
+                updates
+            )
+        return dict(cost)
+
+    @classmethod
+    def _first_chunks(cls, product_ids):
+        """
+        Premier paquet (CHUNK_SIZE couches au plus) de chaque produit, en une
+        requête : ROW_NUMBER() par produit sur les couches ouvertes.
+
+        :return: dict {product_id: [couches, de la plus ancienne à la plus récente]}.
+        """
+        if not product_ids:
+            return {}
+        ranked = db.session.query(
+            CostLayer.id, CostLayer.product_id, CostLayer.remaining_quantity, CostLayer.unit_cost,
+            func.row_number().over(partition_by=CostLayer.product_id, order_by=CostLayer.id).label('rank')
+        ).filter(
+            CostLayer.product_id.in_(product_ids),
+            CostLayer.remaining_quantity > 0
+        ).subquery()
+        chunks = defaultdict(list)
+        for layer in db.session.query(ranked.c.id, ranked.c.product_id, ranked.c.remaining_quantity,
+                                      ranked.c.unit_cost)\
+                .filter(ranked.c.rank <= cls.CHUNK_SIZE)\
+                .order_by(ranked.c.product_id, ranked.c.id).all():
+            chunks[layer.product_id].append(layer)
+        return chunks
+
+    @classmethod
+    def _open_layers(cls, product_id, purchase_id=None, first_chunk=None):
+        """
+        Couches ouvertes d'un produit, de la plus ancienne à la plus récente,
+        lues par paquets de CHUNK_SIZE : l'appelant arrête l'itération dès que
+        la quantité sortie est couverte.
+
+        :param first_chunk: Premier paquet déjà lu (voir _first_chunks).
+        """
+        last_id = 0
+        if first_chunk is not None:
+            yield from first_chunk
+            if len(first_chunk) < cls.CHUNK_SIZE:
+                return
+            last_id = first_chunk[-1].id
+        while True:
+            query = db.session.query(
+                CostLayer.id, CostLayer.remaining_quantity, CostLayer.unit_cost
+            ).filter(
+                CostLayer.product_id == product_id,
+                CostLayer.remaining_quantity > 0,
+                CostLayer.id > last_id
+            )
+            if purchase_id is not None:
+                query = query.filter(CostLayer.purchase_id == purchase_id)
+            chunk = query.order_by(CostLayer.id).limit(cls.CHUNK_SIZE).all()
+            yield from chunk
+            if len(chunk) < cls.CHUNK_SIZE:
+                return
+            last_id = chunk[-1].id
+
+    # ------------------------------------------------------------------ #
+    # Valorisation
+    # ------------------------------------------------------------------ #
+
+    @staticmethod
+    def _balances_query():
+        """Quantité et valeur FIFO des couches ouvertes, par produit (sous-requête)."""
+        return db.session.query(
+            CostLayer.product_id.label('product_id'),
+            func.sum(CostLayer.remaining_quantity).label('fifo_quantity'),
+            func.sum(CostLayer.remaining_quantity * CostLayer.unit_cost).label('fifo_value')
+        ).filter(CostLayer.remaining_quantity > 0)\
+         .group_by(CostLayer.product_id).subquery()
+
+    @classmethod
+    def _valuation_rows(cls, product_type=None):
+        from models import Product
+
+        layers = cls._balances_query()
+        total_qty = sum(func.coalesce(getattr(Product, column), 0)
+                        for column in StockLocationManager.LOCATION_COLUMNS.values())
+        query = db.session.query(
+            Product.id, Product.name, Product.product_type, Product.unit,
+            total_qty.label('quantity'),
+            func.coalesce(Product.cost_price, 0).label('cost_price'),
+            func.coalesce(Product.total_stock_value, 0).label('book_value'),
+            func.coalesce(layers.c.fifo_quantity, 0).label('fifo_quantity'),
+            func.coalesce(layers.c.fifo_value, 0).label('fifo_value')
+        ).outerjoin(layers, layers.c.product_id == Product.id)\
+         .filter((total_qty != 0) | (layers.c.product_id.isnot(None)))
+        if product_type:
+            query = query.filter(Product.product_type == product_type)
+        return query.order_by(Product.name).all()
+
+    @classmethod
+    def valuation(cls, period=None, product_type=None):
+        """
+        Valorisation par produit : FIFO, PMP et valeur comptable côte à côte.
+
+        :param period: 'AAAA-MM' d'un mois clos (lu dans valuation_snapshots) ;
+                       None pour la valorisation courante.
+        :return: dict {'period', 'rows': [...], 'totals': {...}}.
+        """
+        from models import Product
+
+        if period:
+            query = db.session.query(
+                ValuationSnapshot.product_id.label('id'), Product.name, Product.product_type, Product.unit,
+                ValuationSnapshot.quantity, ValuationSnapshot.fifo_quantity, ValuationSnapshot.fifo_value,
+                ValuationSnapshot.pmp_value, ValuationSnapshot.book_value
+            ).join(Product, Product.id == ValuationSnapshot.product_id)\
+             .filter(ValuationSnapshot.period == period)
+            if product_type:
+                query = query.filter(Product.product_type == product_type)
+            rows = [{
+                'product_id': row.id, 'name': row.name, 'product_type': row.product_type, 'unit': row.unit,
+                'quantity': row.quantity, 'fifo_quantity': row.fifo_quantity,
+                'fifo_value': row.fifo_value, 'pmp_value': row.pmp_value, 'book_value': row.book_value
+            } for row in query.order_by(Product.name).all()]
+        else:
+            rows = [{
+                'product_id': row.id, 'name': row.name, 'product_type': row.product_type, 'unit': row.unit,
+                'quantity': float(row.quantity), 'fifo_quantity': float(row.fifo_quantity),
+                'fifo_value': float(row.fifo_value),
+                'pmp_value': float(row.quantity) * float(row.cost_price),
+                'book_value': float(row.book_value)
+            } for row in cls._valuation_rows(product_type)]
+
+        for row in rows:
+            row['drift'] = row['fifo_value'] - row['pmp_value']
+        totals = {key: sum(row[key] for row in rows) for key in ('fifo_value', 'pmp_value', 'book_value', 'drift')}
+        return {'period': period, 'rows': rows, 'totals': totals}
+
+    @staticmethod
+    def periods():
+        """Mois clos disponibles, du plus récent au plus ancien."""
+        return [row.period for row in db.session.query(ValuationSnapshot.period)
+                .distinct().order_by(ValuationSnapshot.period.desc()).all()]
+
+    PERIOD_PATTERN = re.compile(r'^\d{4}-(0[1-9]|1[0-2])$')
+
+    @classmethod
+    def close_period(cls, period=None, overwrite=False):
+        """
+        Fige les soldes des couches ouvertes et le PMP du mois courant
+        (à planifier le dernier jour du mois). Les soldes lus sont ceux de
+        l'instant présent : un autre mois ne peut pas être clos après coup.
+
+        :param period: 'AAAA-MM', mois courant par défaut (seul mois accepté).
+        :param overwrite: Réécrit un mois déjà clos au lieu de refuser.
+        :return: Nombre de lignes écrites.
+        :raises ValueError: période mal formée, autre que le mois courant, ou
+                            déjà close sans overwrite.
+        """
+        now = datetime.utcnow()
+        current = now.strftime('%Y-%m')
+        period = period or current
+        if not cls.PERIOD_PATTERN.match(period):
+            raise ValueError(f"Période invalide : '{period}' (format attendu AAAA-MM).")
+        if period != current:
+            raise ValueError(f"Seul le mois courant ({current}) peut être clos : "
+                             f"les soldes de {period} ne sont plus disponibles.")
+        exists = db.session.query(ValuationSnapshot.product_id).filter_by(period=period).first() is not None
+        if exists and not overwrite:
+            raise ValueError(f"Le mois {period} est déjà clos.")
+
+        rows = [{
+            'period': period,
+            'product_id': row.id,
+            'quantity': float(row.quantity),
+            'fifo_quantity': float(row.fifo_quantity),
+            'fifo_value': float(row.fifo_value),
+            'pmp_value': float(row.quantity) * float(row.cost_price),
+            'book_value': float(row.book_value),
+            'taken_at': now
+        } for row in cls._valuation_rows()]
+
+        if exists:
+            ValuationSnapshot.query.filter_by(period=period).delete(synchronize_session=False)
+        if rows:
+            db.session.execute(insert(ValuationSnapshot), rows)
+        return len(rows)
+
+    @classmethod
+    def rebuild(cls):
+        """
+        Repart d'une couche d'ouverture par produit : stock total courant au PMP.
+        Sert à l'initialisation ou après une correction hors journal.
+
+        :return: Nombre de couches écrites.
+        """
+        from models import Product
+
+        CostLayer.query.delete(synchronize_session=False)
+        total_qty = sum(func.coalesce(getattr(Product, column), 0)
+                        for column in StockLocationManager.LOCATION_COLUMNS.values())
+        now = datetime.utcnow()
+        layers = [{
+            'product_id': row.id,
+            'quantity': float(row.quantity),
+            'remaining_quantity': float(row.quantity),
+            'unit_cost': float(row.cost_price or 0),
+            'movement_type': None,
+            'created_at': now
+        } for row in db.session.query(Product.id, total_qty.label('quantity'), Product.cost_price)
+                                .filter(total_qty > 0).all()]
+        if layers:
+            db.session.execute(insert(CostLayer), layers)
+        return len(layers)
@@ -2,17 +2,30 @@ from datetime import datetime
 from decimal import Decimal
 from werkzeug.security import generate_password_hash, check_password_hash
 from sqlalchemy import func
+from sqlalchemy.orm import validates
 from flask_login import UserMixin
 from extensions import db
 
 # Import de la table de liaison depuis employees
 from app.employees.models import order_employees
+from app.products.search import fold_search_text, search_word_prefixes
 
 CONVERSION_FACTORS = {
     'kg_g': 1000, 'g_kg': 0.001,
     'l_ml': 1000, 'ml_l': 0.001,
 }
 
+# Facteur appliqué au coût unitaire du produit (unité de stock) pour obtenir
+# le coût dans l'unité de la recette : (unité produit, unité recette) -> facteur
+RECIPE_UNIT_COST_FACTORS = {
+    ('KG', 'G'): Decimal('0.001'),
+    ('L', 'ML'): Decimal('0.001'),
+    ('G', 'KG'): Decimal('1000'),
+    ('ML', 'L'): Decimal('1000'),
+    ('KG', 'MG'): Decimal('0.000001'),
+    ('L', 'CL'): Decimal('0.01'),
+}
+
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
     
@@ -58,6 +71,8 @@ class Product(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False, index=True)
+    # Nom normalisé (minuscules, sans accents) pour la recherche indexée
+    search_name = db.Column(db.String(200), nullable=False, default='', server_default='', index=True)
     product_type = db.Column(db.String(50), nullable=False)
     description = db.Column(db.Text)
     price = db.Column(db.Numeric(10, 2))
@@ -90,6 +105,15 @@ class Product(db.Model):
     
     # Relations
     order_items = db.relationship('OrderItem', backref='product', lazy='dynamic')
+    search_prefixes = db.relationship('ProductSearchPrefix', cascade='all, delete-orphan',
+                                      passive_deletes=True)
+
+    @validates('name')
+    def _sync_search_name(self, key, value):
+        self.search_name = fold_search_text(value)
+        self.search_prefixes = [ProductSearchPrefix(prefix=prefix)
+                                for prefix in search_word_prefixes(self.search_name)]
+        return value
 
     @property
     def to_dict(self):
@@ -119,7 +143,10 @@ class Product(db.Model):
             'ingredients_magasin': self.stock_ingredients_magasin,
             'consommables': self.stock_consommables
         }
-        return location_mapping.get(location_type, 0.0)
+        if location_type in location_mapping:
+            return location_mapping[location_type]
+        # Localisation ajoutée après les quatre historiques : stock_levels
+        return self._stock_level(location_type, 'qty')
     
     def get_seuil_min_by_location(self, location_type):
         seuil_mapping = {
@@ -128,7 +155,18 @@ class Product(db.Model):
             'ingredients_magasin': self.seuil_min_ingredients_magasin or 0.0,
             'consommables': self.seuil_min_consommables or 0.0
         }
-        return seuil_mapping.get(location_type, 0.0)
+        if location_type in seuil_mapping:
+            return seuil_mapping[location_type]
+        return self._stock_level(location_type, 'min_qty')
+    
+    def _stock_level(self, location_key, field):
+        from app.stock.levels import StockLevelStore
+        try:
+            if field == 'min_qty':
+                return StockLevelStore.get_min_qty(self.id, location_key)
+            return StockLevelStore.get(self.id, location_key)
+        except ValueError:
+            return 0.0
     
     def is_low_stock_by_location(self, location_type):
         current_stock = self.get_stock_by_location_type(location_type)
@@ -136,8 +174,13 @@ class Product(db.Model):
         return current_stock <= min_threshold
     
     def get_low_stock_locations(self):
+        from app.stock.levels import StockLevelStore
         locations = ['comptoir', 'ingredients_local', 'ingredients_magasin', 'consommables']
-        return [loc for loc in locations if self.is_low_stock_by_location(loc)]
+        low = [loc for loc in locations if self.is_low_stock_by_location(loc)]
+        if StockLevelStore.extra_locations():
+            levels = StockLevelStore.levels(self.id)
+            low += [info.key for info in StockLevelStore.extra_locations() if levels[info.key]['is_low']]
+        return low
     
     def get_location_display_name(self, location_type):
         names = {
@@ -158,25 +201,37 @@ class Product(db.Model):
     def get_stock_by_location(self, location_key: str) -> float:
         """
         Récupère le stock pour un emplacement donné.
-        :param location_key: Le nom de la colonne (ex: 'ingredients_magasin').
-        :return: La valeur du stock.
+        :param location_key: L'emplacement (ex: 'ingredients_magasin'), la clé métier ou le nom de la colonne.
+        :return: La valeur du stock (colonne historique si elle existe, sinon stock_levels).
         """
-        return getattr(self, location_key, 0.0)
+        from app.stock.stock_manager import StockLocationManager
+        column = StockLocationManager.get_stock_column(location_key)
+        if column:
+            return getattr(self, column) or 0.0
+        return self._stock_level(location_key, 'qty')
 
     def update_stock_by_location(self, location_key: str, quantity_change: float) -> bool:
         """
-        Met à jour le stock pour un emplacement donné.
-        :param location_key: Le nom de la colonne (ex: 'ingredients_magasin').
+        Met à jour le stock pour un emplacement donné, de façon atomique côté SQL
+        (UPDATE ... SET col = GREATEST(col + :delta, 0)). Aucun mouvement n'est
+        journalisé : utiliser StockLedger.record pour la traçabilité.
+        :param location_key: L'emplacement (ex: 'ingredients_magasin') ou le nom de la colonne.
         :param quantity_change: La quantité à ajouter (valeur positive) ou à retirer (valeur négative).
         :return: True si la mise à jour a réussi, False sinon.
         """
-        if hasattr(self, location_key):
-            current_value = getattr(self, location_key, 0.0)
-            new_value = max(0, current_value + quantity_change)
-            setattr(self, location_key, new_value)
-            self.last_stock_update = datetime.utcnow()
+        from app.stock.ledger import StockLedger
+        from app.stock.levels import StockLevelStore
+        try:
+            _, column = StockLedger.resolve_location(location_key)
+        except ValueError:
+            # Localisation sans colonne historique : stock_levels uniquement
+            try:
+                StockLevelStore.apply_deltas({(self.id, location_key): quantity_change})
+            except ValueError:
+                return False
             return True
-        return False
+        StockLedger.apply_deltas({(self.id, column): quantity_change})
+        return True
     # ### FIN DES MÉTHODES AJOUTÉES/MODIFIÉES ###
 
     def get_stock_display(self, location_type='total'):
@@ -217,6 +272,21 @@ class Product(db.Model):
     def __repr__(self):
         return f'<Product {self.name}>'
 
+class ProductSearchPrefix(db.Model):
+    """
+    Débuts de mots (1 et 2 caractères) du nom normalisé d'un produit.
+    Sert aux termes trop courts pour les trigrammes (« ta » -> « pate a tartiner »)
+    par égalité indexée ; maintenu avec search_name par Product._sync_search_name.
+    """
+    __tablename__ = 'product_search_prefixes'
+    __table_args__ = (
+        db.Index('ix_product_search_prefixes_prefix_product', 'prefix', 'product_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), nullable=False)
+    prefix = db.Column(db.String(2), nullable=False)
+
 # ### DEBUT DE LA MODIFICATION ###
 # AJOUT DE LA CLASSE MANQUANTE
 class RecipeIngredient(db.Model):
@@ -224,7 +294,7 @@ class RecipeIngredient(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     recipe_id = db.Column(db.Integer, db.ForeignKey('recipes.id'), nullable=False)
-    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False, index=True)
     quantity_needed = db.Column(db.Numeric(10, 3), nullable=False)
     unit = db.Column(db.String(50), nullable=False)
     notes = db.Column(db.String(255))
@@ -241,17 +311,9 @@ class RecipeIngredient(db.Model):
         base_cost = Decimal(self.product.cost_price)
         if product_unit == recipe_unit:
             return base_cost
-        conversions = {
-            ('KG', 'G'): base_cost / 1000,
-            ('L', 'ML'): base_cost / 1000,
-            ('G', 'KG'): base_cost * 1000,
-            ('ML', 'L'): base_cost * 1000,
-            ('KG', 'MG'): base_cost / 1000000,
-            ('L', 'CL'): base_cost / 100,
-        }
         conversion_key = (product_unit, recipe_unit)
-        if conversion_key in conversions:
-            return conversions[conversion_key]
+        if conversion_key in RECIPE_UNIT_COST_FACTORS:
+            return base_cost * RECIPE_UNIT_COST_FACTORS[conversion_key]
         print(f"⚠️ Conversion non trouvée: {product_unit} → {recipe_unit} pour {self.product.name}")
         return base_cost
     
@@ -287,16 +349,33 @@ class Recipe(db.Model):
         server_default='ingredients_magasin'
     )
     
+    # Coûts matérialisés (recalculés par app/recipes/costing.py quand un PMP change)
+    stored_total_cost = db.Column(db.Numeric(14, 4), nullable=True)
+    stored_cost_per_unit = db.Column(db.Numeric(14, 4), nullable=True)
+    cost_updated_at = db.Column(db.DateTime, nullable=True)
+    
     # Relations
     ingredients = db.relationship('RecipeIngredient', backref='recipe', lazy='dynamic', cascade='all, delete-orphan')
     finished_product = db.relationship('Product', foreign_keys=[product_id], backref=db.backref('recipe_definition', uselist=False))
     
+    def compute_total_cost(self):
+        """Calcul complet (sous-recettes développées), sans passer par le cache."""
+        if self.id is None:
+            return sum((ing.cost for ing in self.ingredients), Decimal('0.0'))
+        from app.recipes.costing import compute_recipe_costs
+        total, _ = compute_recipe_costs([self.id]).get(self.id, (Decimal('0.0'), None))
+        return total
+    
     @property
     def total_cost(self):
-        return sum(ing.cost for ing in self.ingredients)
+        if self.stored_total_cost is not None:
+            return Decimal(self.stored_total_cost)
+        return self.compute_total_cost()
     
     @property
     def cost_per_unit(self):
+        if self.stored_cost_per_unit is not None:
+            return Decimal(self.stored_cost_per_unit)
         return self.total_cost / Decimal(self.yield_quantity) if self.yield_quantity > 0 else Decimal('0.0')
     
     def __repr__(self):
@@ -304,6 +383,10 @@ class Recipe(db.Model):
 
 class Order(db.Model):
     __tablename__ = 'orders'
+    __table_args__ = (
+        # Fenêtre du calendrier : plage de due_date filtrée par statut
+        db.Index('ix_orders_due_date_status', 'due_date', 'status'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
@@ -352,28 +435,33 @@ class Order(db.Model):
         if employee in self.produced_by:
             self.produced_by.remove(employee)
     
+    ORDER_TYPE_LABELS = {
+        'customer_order': 'Commande Client',
+        'counter_production_request': 'Ordre de Production',
+        'in_store': 'Vente au Comptoir'
+    }
+    
+    STATUS_LABELS = {
+        'pending': 'En attente',
+        'cancelled': 'Annulée',
+        'completed': 'Terminée',
+        'in_production': 'En production',
+        'ready_at_shop': 'Reçue au magasin',
+        'out_for_delivery': 'En livraison',
+        'delivered': 'Livrée',
+        'in_progress': 'En préparation',
+        'ready': 'Prête',
+        'awaiting_payment': 'En attente de paiement'
+    }
+    
+    # Statuts affichés dans le calendrier de production
+    CALENDAR_STATUSES = ('pending', 'in_production')
+    
     def get_order_type_display(self):
-        order_types = {
-            'customer_order': 'Commande Client',
-            'counter_production_request': 'Ordre de Production',
-            'in_store': 'Vente au Comptoir'
-        }
-        return order_types.get(self.order_type, self.order_type.title())
+        return self.ORDER_TYPE_LABELS.get(self.order_type, self.order_type.title())
     
     def get_status_display(self):
-        status_types = {
-            'pending': 'En attente',
-            'cancelled': 'Annulée',
-            'completed': 'Terminée',
-            'in_production': 'En production',
-            'ready_at_shop': 'Reçue au magasin',
-            'out_for_delivery': 'En livraison',
-            'delivered': 'Livrée',
-            'in_progress': 'En préparation',
-            'ready': 'Prête',
-            'awaiting_payment': 'En attente de paiement'
-        }
-        return status_types.get(self.status, self.status.title())
+        return self.STATUS_LABELS.get(self.status, self.status.title())
     
     def get_delivery_option_display(self):
         if not self.delivery_option:
@@ -398,7 +486,7 @@ class Order(db.Model):
         return status_colors.get(self.status, 'secondary')
     
     def should_appear_in_calendar(self):
-        return self.status in ['pending', 'in_production']
+        return self.status in self.CALENDAR_STATUSES
     
     def can_be_received_at_shop(self):
         return self.status == 'in_production'
@@ -428,25 +516,36 @@ class Order(db.Model):
     
     def _increment_shop_stock(self):
         """Méthode dépréciée. Utiliser _increment_shop_stock_with_value."""
+        from app.stock.ledger import StockLedger
+        from app.stock.models import StockMovementType
         print("AVERTISSEMENT: _increment_shop_stock est dépréciée et ne met pas à jour la valeur du stock.")
+        ledger = StockLedger(self._stock_user_id())
         for item in self.items:
             if item.product:
-                item.product.update_stock_by_location('comptoir', float(item.quantity))
+                ledger.record(item.product, 'comptoir', float(item.quantity),
+                              movement_type=StockMovementType.PRODUCTION,
+                              order_id=self.id, reason=f"Réception commande #{self.id}")
 
     def _increment_shop_stock_with_value(self):
         """
         Incrémente le stock de vente (comptoir) pour le produit fini,
         et met à jour sa valeur en se basant sur le coût de sa recette.
         """
+        from app.stock.ledger import StockLedger
+        from app.stock.models import StockMovementType
+        ledger = StockLedger(self._stock_user_id())
         for item in self.items:
             product_fini = item.product
             if product_fini and product_fini.recipe_definition:
-                # 1. On incrémente la quantité
-                product_fini.update_stock_by_location('comptoir', float(item.quantity))
-                
                 # 2. On calcule la valeur de ce qui a été produit
                 cost_per_unit = float(product_fini.recipe_definition.cost_per_unit)
                 value_to_increment = cost_per_unit * float(item.quantity)
+
+                # 1. On incrémente la quantité (via le journal de stock)
+                ledger.record(product_fini, 'comptoir', float(item.quantity),
+                              movement_type=StockMovementType.PRODUCTION,
+                              unit_cost=cost_per_unit,
+                              order_id=self.id, reason=f"Réception commande #{self.id}")
                 
                 # 3. On met à jour la valeur totale du stock du produit fini
                 product_fini.total_stock_value = float(product_fini.total_stock_value or 0.0) + value_to_increment
@@ -459,10 +558,20 @@ class Order(db.Model):
                 print(f"INCREMENT: Stock de '{product_fini.name}' augmenté de {item.quantity}. Nouvelle valeur: {product_fini.total_stock_value:.2f} DA. Nouveau PMP: {product_fini.cost_price}")
     
     def _decrement_shop_stock(self):
+        from app.stock.ledger import StockLedger
+        from app.stock.models import StockMovementType
+        ledger = StockLedger(self._stock_user_id())
         for item in self.items:
             if item.product:
-                item.product.update_stock_location('comptoir', -float(item.quantity))
+                ledger.record(item.product, 'comptoir', -float(item.quantity),
+                              movement_type=StockMovementType.VENTE,
+                              order_id=self.id, reason=f"Livraison commande #{self.id}")
                 print(f"📦 Stock comptoir décrémenté: {item.product.name} -{item.quantity}")
+
+    def _stock_user_id(self):
+        """Auteur des mouvements de stock : utilisateur connecté, sinon créateur de la commande."""
+        from app.stock.ledger import current_user_id
+        return current_user_id() or self.user_id
     
     def calculate_total_amount(self):
         items_total = Decimal('0.0')
@@ -532,6 +641,82 @@ class OrderItem(db.Model):
     def __repr__(self):
         return f'<OrderItem {self.product.name if self.product else "N/A"}: {self.quantity}x{self.unit_price}>'
 
+class DailySalesStats(db.Model):
+    """
+    Cumul journalier des ventes et de la production (toutes catégories).
+    Maintenu par app.orders.rollups.SalesRollup à partir du journal de stock.
+    """
+    __tablename__ = 'daily_sales_stats'
+
+    day = db.Column(db.Date, primary_key=True)
+    orders_delivered = db.Column(db.Integer, nullable=False, default=0)
+    quantity_sold = db.Column(db.Float, nullable=False, default=0.0)
+    revenue = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    quantity_produced = db.Column(db.Float, nullable=False, default=0.0)
+    ingredient_cost = db.Column(db.Float, nullable=False, default=0.0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<DailySalesStats {self.day}: {self.revenue} DA>'
+
+class DailyProductStats(db.Model):
+    """
+    Cumul journalier par produit (la catégorie est dénormalisée pour les
+    agrégats par catégorie sans jointure).
+    """
+    __tablename__ = 'daily_product_stats'
+    __table_args__ = (
+        db.Index('ix_daily_product_stats_day_category', 'day', 'category_id'),
+    )
+
+    day = db.Column(db.Date, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), primary_key=True)
+    category_id = db.Column(db.Integer, db.ForeignKey('categories.id'), nullable=True)
+    quantity_sold = db.Column(db.Float, nullable=False, default=0.0)
+    revenue = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    quantity_produced = db.Column(db.Float, nullable=False, default=0.0)
+    ingredient_cost = db.Column(db.Float, nullable=False, default=0.0)
+
+    product = db.relationship('Product')
+
+    def __repr__(self):
+        return f'<DailyProductStats {self.day} #{self.product_id}>'
+
+class RollupWatermark(db.Model):
+    """Dernier mouvement de stock pris en compte par un cumul incrémental."""
+    __tablename__ = 'rollup_watermarks'
+
+    name = db.Column(db.String(50), primary_key=True)
+    last_movement_id = db.Column(db.Integer, nullable=False, default=0)
+    refreshed_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+class ChangeFeedCounter(db.Model):
+    """
+    Version courante du flux de changements (une ligne).
+    Incrémentée juste après le commit qui modifie commandes ou stock, dans une
+    courte transaction dédiée : le verrou de ligne ordonne les versions sans
+    être tenu pendant la transaction métier.
+    """
+    __tablename__ = 'change_feed_counters'
+
+    name = db.Column(db.String(20), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    # Versions <= pruned_version ne sont plus détaillées dans change_events
+    pruned_version = db.Column(db.Integer, nullable=False, default=0)
+
+class ChangeEvent(db.Model):
+    """Entité modifiée à une version donnée du flux (commande, produit en stock)."""
+    __tablename__ = 'change_events'
+    __table_args__ = (
+        db.Index('ix_change_events_topic_version', 'topic', 'version'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, index=True)
+    topic = db.Column(db.String(20), nullable=False)
+    entity_id = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
 class Unit(db.Model):
     __tablename__ = 'units'
     
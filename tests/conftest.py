@@ -6,7 +6,8 @@ from flask import url_for
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from app import create_app, User, Category # Importer Category aussi si utilisé dans une fixture
+from app import create_app
+from models import User, Category # Importer Category aussi si utilisé dans une fixture
 from extensions import db as _db
 
 @pytest.fixture(scope='session')
@@ -0,0 +1,92 @@
+import pytest
+from datetime import datetime
+from sqlalchemy import extract
+from models import Order
+from app.employees.models import Employee, EmployeeMonthlyStats
+from app.employees.performance import EmployeePerformanceService
+
+
+def previous_month(year, month):
+    return (year - 1, 12) if month == 1 else (year, month - 1)
+
+
+def create_test_employee(db_session, name, salary=30000):
+    employee = Employee(name=name, role='production', salaire_fixe=salary, prime=0)
+    db_session.add(employee)
+    db_session.commit()
+    return employee
+
+
+def create_test_order(db_session, employees, year, month, total, status='delivered'):
+    order = Order(order_type='customer_order', status=status, customer_name='Client',
+                  due_date=datetime(year, month, 10, 12), total_amount=total)
+    order.produced_by = list(employees)
+    db_session.add(order)
+    db_session.commit()
+    return order
+
+
+def legacy_monthly_revenue(employee, year, month):
+    """Calcul d'origine, commande par commande."""
+    orders = Order.query.filter(
+        Order.produced_by.contains(employee),
+        extract('year', Order.due_date) == year,
+        extract('month', Order.due_date) == month,
+        Order.status.in_(['delivered', 'completed'])
+    ).all()
+    return sum(float(order.total_amount or 0) for order in orders)
+
+
+def legacy_orders_count(employee, year, month):
+    return Order.query.filter(
+        Order.produced_by.contains(employee),
+        extract('year', Order.due_date) == year,
+        extract('month', Order.due_date) == month
+    ).count()
+
+
+class TestEmployeePerformance:
+
+    def test_rollup_mix_matches_per_employee_totals(self, db_session):
+        today = datetime.utcnow()
+        current = (today.year, today.month)
+        missing = previous_month(*current)
+        rolled_up = previous_month(*missing)
+
+        alice = create_test_employee(db_session, 'Alice')
+        bruno = create_test_employee(db_session, 'Bruno')
+        create_test_order(db_session, [alice], *rolled_up, 100)
+        create_test_order(db_session, [alice, bruno], *rolled_up, 250)
+        create_test_order(db_session, [bruno], *rolled_up, 80, status='pending')
+        create_test_order(db_session, [alice], *missing, 40, status='completed')
+        create_test_order(db_session, [bruno], *missing, 60)
+        create_test_order(db_session, [alice, bruno], *current, 300)
+        create_test_order(db_session, [alice], *current, 20, status='in_production')
+
+        EmployeePerformanceService.refresh_rollup(rolled_up, rolled_up)
+        db_session.commit()
+        assert {(row.year, row.month) for row in EmployeeMonthlyStats.query} == {rolled_up}
+
+        results = EmployeePerformanceService.performance(rolled_up, current, use_rollup=True)
+
+        assert results == EmployeePerformanceService.performance(rolled_up, current)
+        for result in results:
+            employee = db_session.get(Employee, result['id'])
+            for month in result['months']:
+                key = (month['year'], month['month'])
+                assert month['revenue'] == pytest.approx(legacy_monthly_revenue(employee, *key))
+                assert month['revenue'] == pytest.approx(employee.get_monthly_revenue(*key))
+                assert month['orders_count'] == legacy_orders_count(employee, *key)
+                assert month['orders_count'] == employee.get_orders_count(*key)
+
+        by_name = {result['name']: result for result in results}
+        assert by_name['Alice']['monthly_revenue'] == pytest.approx(100 + 250 + 40 + 300)
+        assert by_name['Alice']['orders_count'] == 5
+        assert by_name['Bruno']['monthly_revenue'] == pytest.approx(250 + 60 + 300)
+        assert by_name['Bruno']['orders_count'] == 4
+
+        # Le mois clos est bien lu dans la table de cumul
+        EmployeeMonthlyStats.query.filter_by(employee_id=alice.id).update({'revenue': 0})
+        db_session.commit()
+        alice_result, = EmployeePerformanceService.performance(rolled_up, current, [alice.id], use_rollup=True)
+        assert [month['revenue'] for month in alice_result['months']] == [0, 40, 300]
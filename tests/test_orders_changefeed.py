@@ -0,0 +1,140 @@
+import pytest
+from datetime import datetime, timedelta
+from models import Product, Category, Order, OrderItem, ChangeEvent, ChangeFeedCounter
+from app.orders.changefeed import ChangeFeed
+
+
+def create_test_category(db_session, name="Test Category"):
+    category = Category.query.filter_by(name=name).first()
+    if not category:
+        category = Category(name=name, description="A test category")
+        db_session.add(category)
+        db_session.commit()
+    return category
+
+
+def create_test_product(db_session, name="Pain"):
+    category = create_test_category(db_session)
+    product = Product(name=name, product_type='finished', unit='pièce', price=2, category_id=category.id)
+    db_session.add(product)
+    db_session.commit()
+    return product
+
+
+def create_test_order(db_session, product, status='pending'):
+    order = Order(order_type='customer_order', status=status, customer_name='Client',
+                  due_date=datetime.utcnow() + timedelta(days=1))
+    db_session.add(order)
+    db_session.flush()
+    db_session.add(OrderItem(order_id=order.id, product_id=product.id, quantity=1, unit_price=product.price))
+    db_session.commit()
+    return order
+
+
+def login(client, user):
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user.id)
+        session['_fresh'] = True
+
+
+class TestChangeFeed:
+
+    def test_changes_lists_entities_modified_since_version(self, db_session):
+        product = create_test_product(db_session)
+        first = create_test_order(db_session, product)
+        since = ChangeFeed.current_version()
+
+        second = create_test_order(db_session, product)
+        first.status = 'in_production'
+        db_session.commit()
+
+        feed = ChangeFeed.changes(since)
+        assert feed['version'] == since + 2
+        assert not feed['reset']
+        assert feed['orders'] == {first.id, second.id}
+        assert ChangeFeed.changes(feed['version'])['orders'] == set()
+
+    def test_stock_write_is_recorded(self, db_session):
+        product = create_test_product(db_session)
+        since = ChangeFeed.current_version()
+
+        product.stock_comptoir = 12
+        db_session.commit()
+
+        feed = ChangeFeed.changes(since)
+        assert feed['stock'] == {product.id}
+        assert feed['orders'] == set()
+
+    def test_rollback_records_nothing(self, db_session):
+        product = create_test_product(db_session)
+        since = ChangeFeed.current_version()
+
+        product.stock_comptoir = 12
+        db_session.flush()
+        db_session.rollback()
+
+        assert ChangeFeed.current_version() == since
+
+    def test_prune_resets_clients_older_than_retention(self, db_session, monkeypatch):
+        product = create_test_product(db_session)
+        create_test_order(db_session, product)
+        old = ChangeFeed.current_version()
+        ChangeEvent.query.update({'created_at': datetime.utcnow() - ChangeFeed.RETENTION - timedelta(hours=1)})
+        db_session.commit()
+
+        monkeypatch.setattr(ChangeFeed, 'PRUNE_EVERY', 1)
+        order = create_test_order(db_session, product)
+
+        counter = db_session.get(ChangeFeedCounter, ChangeFeed.COUNTER)
+        db_session.refresh(counter)
+        assert counter.pruned_version == old
+        assert ChangeEvent.query.filter(ChangeEvent.version <= old).count() == 0
+        assert ChangeFeed.changes(old - 1)['reset']
+        assert ChangeFeed.changes(old)['orders'] == {order.id}
+
+    def test_version_ahead_of_counter_is_reset(self, db_session):
+        create_test_product(db_session)
+
+        assert ChangeFeed.changes(ChangeFeed.current_version() + 1)['reset']
+
+
+class TestChangesApi:
+
+    def test_invalid_since_is_reset(self, client, admin_user):
+        login(client, admin_user)
+
+        data = client.get('/dashboard/api/changes?since=abc').get_json()
+
+        assert data['reset']
+
+    def test_no_change_returns_empty_payload(self, client, admin_user):
+        login(client, admin_user)
+        version = ChangeFeed.current_version()
+
+        data = client.get(f'/dashboard/api/changes?since={version}&view=production').get_json()
+
+        assert data == {'version': version, 'reset': False, 'orders_changed': False,
+                        'stock_changed': False, 'cards': [], 'removed': []}
+
+    def test_changed_orders_are_rendered_or_removed(self, db_session, client, admin_user):
+        login(client, admin_user)
+        product = create_test_product(db_session)
+        shown = create_test_order(db_session, product, status='pending')
+        gone = create_test_order(db_session, product, status='pending')
+        since = ChangeFeed.current_version()
+        shown.customer_name = 'Autre client'
+        gone.status = 'ready_at_shop'
+        db_session.commit()
+
+        data = client.get(f'/dashboard/api/changes?since={since}&view=production').get_json()
+
+        assert data['version'] == since + 1
+        assert data['orders_changed']
+        assert [card['id'] for card in data['cards']] == [shown.id]
+        assert data['cards'][0]['section'] == 'production'
+        assert data['removed'] == [gone.id]
+
+    def test_requires_admin(self, client, regular_user):
+        login(client, regular_user)
+
+        assert client.get('/dashboard/api/changes?since=0').status_code == 403
@@ -0,0 +1,94 @@
+import pytest
+from datetime import datetime, timedelta
+from models import Product, Category, Recipe, RecipeIngredient, Order, OrderItem
+from app.orders.production import ProductionPostingEngine
+from app.stock.models import StockMovement
+
+
+def create_test_category(db_session, name="Test Category"):
+    category = Category.query.filter_by(name=name).first()
+    if not category:
+        category = Category(name=name, description="A test category")
+        db_session.add(category)
+        db_session.commit()
+    return category
+
+
+@pytest.fixture
+def bread_recipe(db_session):
+    """Pain (fournée de 10) : 1000 g de farine, labo magasin."""
+    category = create_test_category(db_session)
+    flour = Product(name='Farine', product_type='ingredient', unit='g', cost_price=0.1,
+                    stock_ingredients_magasin=5000, total_stock_value=500, category_id=category.id)
+    bread = Product(name='Pain', product_type='finished', unit='pièce', price=2, category_id=category.id)
+    db_session.add_all([flour, bread])
+    db_session.flush()
+    recipe = Recipe(name='Pain', product_id=bread.id, yield_quantity=10, production_location='ingredients_magasin')
+    db_session.add(recipe)
+    db_session.flush()
+    db_session.add(RecipeIngredient(recipe_id=recipe.id, product_id=flour.id, quantity_needed=1000, unit='g'))
+    db_session.commit()
+    return flour, bread
+
+
+def create_test_order(db_session, product, quantity, order_type='customer_order'):
+    order = Order(order_type=order_type, status='in_production', customer_name='Client',
+                  due_date=datetime.utcnow() + timedelta(days=1))
+    db_session.add(order)
+    db_session.flush()
+    db_session.add(OrderItem(order_id=order.id, product_id=product.id, quantity=quantity, unit_price=product.price))
+    db_session.commit()
+    return order
+
+
+class TestProductionPosting:
+
+    def test_post_orders_moves_stock_and_finalizes(self, db_session, admin_user, bread_recipe):
+        flour, bread = bread_recipe
+        order = create_test_order(db_session, bread, 5)
+
+        result = ProductionPostingEngine(admin_user.id).post_orders([order.id])
+        db_session.commit()
+
+        assert [o.id for o in result['posted']] == [order.id]
+        db_session.refresh(flour)
+        db_session.refresh(bread)
+        db_session.refresh(order)
+        assert flour.stock_ingredients_magasin == 4500
+        assert float(flour.total_stock_value) == pytest.approx(450)
+        assert bread.stock_comptoir == 5
+        assert order.status == 'ready_at_shop'
+
+    def test_posting_same_order_twice_moves_stock_once(self, db_session, admin_user, bread_recipe):
+        flour, bread = bread_recipe
+        order = create_test_order(db_session, bread, 5)
+        engine = ProductionPostingEngine(admin_user.id)
+
+        engine.post_orders([order.id])
+        db_session.commit()
+        result = engine.post_orders([order.id])
+        db_session.commit()
+
+        assert result['posted'] == []
+        assert [o.id for o in result['skipped']] == [order.id]
+        db_session.refresh(flour)
+        db_session.refresh(bread)
+        assert flour.stock_ingredients_magasin == 4500
+        assert bread.stock_comptoir == 5
+        assert StockMovement.query.filter_by(order_id=order.id).count() == 2
+
+    def test_order_finalized_by_another_request_is_skipped(self, db_session, admin_user, bread_recipe):
+        flour, bread = bread_recipe
+        order = create_test_order(db_session, bread, 5)
+        assert order.status == 'in_production'
+
+        # Une autre requête finalise la commande : l'objet en session reste « in_production »
+        table = Order.__table__
+        db_session.execute(table.update().where(table.c.id == order.id).values(status='ready_at_shop'))
+        result = ProductionPostingEngine(admin_user.id).post_orders([order.id])
+        db_session.commit()
+
+        assert result['posted'] == []
+        assert order.status == 'ready_at_shop'
+        db_session.refresh(flour)
+        assert flour.stock_ingredients_magasin == 5000
@@ -0,0 +1,102 @@
+import pytest
+from datetime import datetime, timedelta
+from models import Product, Category, Order, OrderItem, DailySalesStats, DailyProductStats
+from app.stock.ledger import StockLedger
+from app.stock.models import StockMovement, StockMovementType
+from app.orders.rollups import SalesRollup
+
+
+def create_test_category(db_session, name="Test Category"):
+    category = Category.query.filter_by(name=name).first()
+    if not category:
+        category = Category(name=name, description="A test category")
+        db_session.add(category)
+        db_session.commit()
+    return category
+
+
+def create_test_product(db_session, name, price):
+    category = create_test_category(db_session)
+    product = Product(name=name, product_type='finished', unit='pièce', price=price,
+                      stock_comptoir=100, category_id=category.id)
+    db_session.add(product)
+    db_session.commit()
+    return product
+
+
+def create_delivered_order(db_session, user, lines, delivered_at):
+    """Commande livrée : un mouvement VENTE par ligne, daté de delivered_at."""
+    order = Order(order_type='customer_order', status='delivered', customer_name='Client',
+                  due_date=delivered_at)
+    db_session.add(order)
+    db_session.flush()
+    for product, quantity in lines:
+        db_session.add(OrderItem(order_id=order.id, product_id=product.id, quantity=quantity,
+                                 unit_price=product.price))
+    StockLedger(user.id).post_batch([{
+        'product_id': product.id, 'location': 'comptoir', 'quantity': -quantity,
+        'movement_type': StockMovementType.VENTE, 'order_id': order.id
+    } for product, quantity in lines])
+    StockMovement.query.filter_by(order_id=order.id).update({'created_at': delivered_at})
+    db_session.commit()
+    return order
+
+
+@pytest.fixture
+def products(db_session):
+    return create_test_product(db_session, 'Tarte', 10), create_test_product(db_session, 'Éclair', 2)
+
+
+class TestSalesRollup:
+
+    def test_rebuild_is_idempotent(self, db_session, admin_user, products):
+        tarte, eclair = products
+        day = datetime.utcnow().date() - timedelta(days=3)
+        create_delivered_order(db_session, admin_user, [(tarte, 2), (eclair, 5)],
+                               datetime.combine(day, datetime.min.time()) + timedelta(hours=10))
+
+        SalesRollup.rebuild(day, day)
+        db_session.commit()
+        first = SalesRollup.daily(day, day)
+        SalesRollup.rebuild(day, day)
+        db_session.commit()
+
+        assert SalesRollup.daily(day, day) == first
+        assert first[0]['revenue'] == pytest.approx(30)
+        assert first[0]['quantity_sold'] == 7
+        assert DailySalesStats.query.count() == 1
+        assert DailyProductStats.query.count() == 2
+
+    def test_order_with_several_sale_movements_is_counted_once(self, db_session, admin_user, products):
+        tarte, eclair = products
+        now = datetime.utcnow()
+        create_delivered_order(db_session, admin_user, [(tarte, 1), (eclair, 3)], now)
+        create_delivered_order(db_session, admin_user, [(tarte, 1)], now)
+
+        SalesRollup.refresh()
+        db_session.commit()
+
+        totals = SalesRollup.totals(now.date(), now.date())
+        assert StockMovement.query.filter_by(movement_type=StockMovementType.VENTE).count() == 3
+        assert totals['orders_delivered'] == 2
+        assert totals['revenue'] == pytest.approx(26)
+        assert totals['quantity_sold'] == 5
+
+    def test_late_movement_on_earlier_day_is_picked_up(self, db_session, admin_user, products):
+        tarte, _ = products
+        today = datetime.utcnow().date()
+        yesterday = today - timedelta(days=1)
+        SalesRollup.refresh(today)
+        db_session.commit()
+
+        # Validé après le dernier rafraîchissement, mais daté de la veille
+        create_delivered_order(db_session, admin_user, [(tarte, 3)],
+                               datetime.combine(yesterday, datetime.min.time()) + timedelta(hours=23))
+
+        assert SalesRollup.refresh(today) == 2
+        db_session.commit()
+
+        assert SalesRollup.totals(yesterday, yesterday)['revenue'] == pytest.approx(30)
+        assert SalesRollup.totals(today, today)['orders_delivered'] == 0
+        # Rien de nouveau : seul le jour courant est recalculé
+        assert SalesRollup.refresh(today) == 1
@@ -0,0 +1,72 @@
+import pytest
+from models import Product, Category
+from app.orders.changefeed import ChangeFeed
+from app.products.catalogue import ProductCatalogue
+from extensions import db
+
+
+def create_test_product(db_session, name="Tarte", price=10):
+    category = Category.query.filter_by(name="Test Category").first()
+    if not category:
+        category = Category(name="Test Category", description="A test category")
+        db_session.add(category)
+        db_session.commit()
+    product = Product(name=name, product_type='finished', unit='pièce', price=price, category_id=category.id)
+    db_session.add(product)
+    db_session.commit()
+    return product
+
+
+def rename_from_other_process(product_id, name):
+    """Écriture hors de ce processus : aucun listener local, seule la version du flux avance."""
+    table = Product.__table__
+    with db.engine.begin() as connection:
+        connection.execute(table.update().where(table.c.id == product_id).values(name=name))
+    with db.engine.begin() as connection:
+        ChangeFeed._bump(connection, {ProductCatalogue.FEED_TOPIC: {None}})
+
+
+@pytest.fixture(autouse=True)
+def empty_catalogue():
+    ProductCatalogue.invalidate()
+    yield
+    ProductCatalogue.invalidate()
+
+
+class TestProductCatalogue:
+
+    def test_local_commit_invalidates_snapshot(self, db_session):
+        product = create_test_product(db_session)
+        before = ProductCatalogue.snapshot()
+
+        product.price = 12
+        db_session.commit()
+
+        after = ProductCatalogue.snapshot()
+        assert after is not before
+        assert after.by_id[product.id].price == 12
+
+    def test_unchanged_catalogue_reuses_snapshot(self, db_session, monkeypatch):
+        create_test_product(db_session)
+        monkeypatch.setattr(ProductCatalogue, 'REVALIDATE_SECONDS', 0)
+
+        assert ProductCatalogue.snapshot() is ProductCatalogue.snapshot()
+
+    def test_change_in_other_process_reloads_after_revalidation(self, db_session, monkeypatch):
+        product = create_test_product(db_session)
+        before = ProductCatalogue.snapshot()
+
+        rename_from_other_process(product.id, 'Tarte aux pommes')
+
+        assert ProductCatalogue.snapshot() is before
+        monkeypatch.setattr(ProductCatalogue, 'REVALIDATE_SECONDS', 0)
+        assert ProductCatalogue.snapshot().by_id[product.id].name == 'Tarte aux pommes'
+
+    def test_mark_changed_publishes_catalogue_version(self, db_session):
+        create_test_product(db_session)
+        version = ChangeFeed.latest_version(ProductCatalogue.FEED_TOPIC)
+
+        ProductCatalogue.mark_changed(db_session)
+        db_session.commit()
+
+        assert ChangeFeed.latest_version(ProductCatalogue.FEED_TOPIC) > version
@@ -0,0 +1,106 @@
+import pytest
+from models import Product, Category, ProductSearchPrefix
+from app.orders.changefeed import ChangeFeed
+from app.products.search import ProductSearch, fold_search_text, search_word_prefixes
+from extensions import db
+
+
+def create_test_category(db_session, name="Test Category"):
+    category = Category.query.filter_by(name=name).first()
+    if not category:
+        category = Category(name=name, description="A test category")
+        db_session.add(category)
+        db_session.commit()
+    return category
+
+
+def create_test_products(db_session, *names, product_type='finished'):
+    category = create_test_category(db_session)
+    products = [Product(name=name, product_type=product_type, unit='pièce', category_id=category.id)
+                for name in names]
+    db_session.add_all(products)
+    db_session.commit()
+    return products
+
+
+def search_names(term, **kwargs):
+    return [product.name for product in ProductSearch.search(term, **kwargs)]
+
+
+@pytest.fixture(autouse=True)
+def empty_search_cache():
+    ProductSearch.invalidate()
+    yield
+    ProductSearch.invalidate()
+
+
+class TestFoldSearchText:
+
+    def test_accents_and_case_are_folded(self):
+        assert fold_search_text('Éclair') == 'eclair'
+        assert fold_search_text('Crème Brûlée') == 'creme brulee'
+        assert fold_search_text('Œuf') == 'oeuf'
+
+    def test_punctuation_becomes_single_space(self):
+        assert fold_search_text("  Pâte d'amande -- 1kg ") == 'pate d amande 1kg'
+
+    def test_word_prefixes(self):
+        assert search_word_prefixes('pate a tartiner') == ['a', 'p', 'pa', 't', 'ta']
+
+
+class TestProductSearch:
+
+    def test_accented_name_found_without_accents(self, db_session):
+        create_test_products(db_session, 'Éclair', 'Croissant')
+
+        assert search_names('eclair') == ['Éclair']
+        assert search_names('ÉCLAIR') == ['Éclair']
+
+    def test_ranking_exact_then_prefix_then_word_then_substring(self, db_session):
+        create_test_products(db_session, 'Mini tarte', 'Tartelettes', 'Tarte', 'Flan tartelette', 'Supertarte')
+
+        assert search_names('tarte') == ['Tarte', 'Tartelettes', 'Mini tarte', 'Flan tartelette', 'Supertarte']
+
+    def test_all_words_must_match(self, db_session):
+        create_test_products(db_session, 'Tarte aux pommes', 'Tarte aux fraises', 'Compote de pommes')
+
+        assert search_names('pomme tarte') == ['Tarte aux pommes']
+
+    def test_short_term_matches_word_starts_only(self, db_session):
+        create_test_products(db_session, 'Pâte à tartiner', 'Tarte', 'Baguette')
+
+        assert search_names('ta') == ['Tarte', 'Pâte à tartiner']
+        assert search_names('p t') == ['Pâte à tartiner']
+        assert search_names('et') == []
+
+    def test_rename_updates_word_prefixes(self, db_session):
+        product, = create_test_products(db_session, 'Tarte')
+
+        product.name = 'Éclair'
+        db_session.commit()
+
+        assert sorted(row.prefix for row in ProductSearchPrefix.query.filter_by(product_id=product.id)) \
+            == ['e', 'ec']
+        assert search_names('ta') == []
+        assert search_names('ec') == ['Éclair']
+
+    def test_product_types_filter(self, db_session):
+        create_test_products(db_session, 'Sucre glace', product_type='ingredient')
+        create_test_products(db_session, 'Sucre d\'orge')
+
+        assert search_names('sucre', product_types=['ingredient']) == ['Sucre glace']
+
+    def test_rename_in_other_process_clears_cache_after_revalidation(self, db_session, monkeypatch):
+        product, = create_test_products(db_session, 'Tarte')
+        assert search_names('tarte') == ['Tarte']
+
+        # Autre processus : aucun listener local, seule la version du flux avance
+        table = Product.__table__
+        with db.engine.begin() as connection:
+            connection.execute(table.update().where(table.c.id == product.id)
+                               .values(name='Flan', search_name='flan'))
+        with db.engine.begin() as connection:
+            ChangeFeed._bump(connection, {ProductSearch.FEED_TOPIC: {None}})
+
+        monkeypatch.setattr(ProductSearch, 'REVALIDATE_SECONDS', 0)
+        assert ProductSearch.search_ids('tarte') == []
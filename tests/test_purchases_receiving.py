@@ -0,0 +1,86 @@
+import pytest
+from datetime import datetime
+from models import Product, Category
+from app.purchases.models import Purchase
+from app.purchases.receiving import PurchaseReceivingEngine
+
+
+def create_test_category(db_session, name="Test Category"):
+    category = Category.query.filter_by(name=name).first()
+    if not category:
+        category = Category(name=name, description="A test category")
+        db_session.add(category)
+        db_session.commit()
+    return category
+
+
+def create_test_ingredient(db_session, name="Farine", stock=1000.0, cost_price=0.1):
+    category = create_test_category(db_session)
+    product = Product(name=name, product_type='ingredient', unit='g', cost_price=cost_price,
+                      stock_ingredients_magasin=stock, total_stock_value=stock * cost_price,
+                      category_id=category.id)
+    db_session.add(product)
+    db_session.commit()
+    return product
+
+
+def create_test_purchase(db_session, user, reference="BA-TEST-001"):
+    purchase = Purchase(reference=reference, supplier_name="Moulin", requested_by_id=user.id,
+                        requested_date=datetime.utcnow())
+    db_session.add(purchase)
+    db_session.commit()
+    return purchase
+
+
+def raw_line(product, quantity, unit_price):
+    return {'product_id': product.id, 'quantity': quantity, 'unit_price': unit_price,
+            'unit_id': None, 'stock_location': 'ingredients_magasin'}
+
+
+class TestPurchaseReceiving:
+
+    def test_receive_updates_weighted_average_cost(self, db_session, admin_user):
+        flour = create_test_ingredient(db_session, stock=1000, cost_price=0.1)
+        purchase = create_test_purchase(db_session, admin_user)
+        engine = PurchaseReceivingEngine(admin_user.id)
+
+        lines = engine.prepare([raw_line(flour, 1000, 0.3)])
+        engine.receive(purchase, lines, engine.add_items(purchase, lines))
+        db_session.commit()
+
+        db_session.refresh(flour)
+        assert flour.stock_ingredients_magasin == 2000
+        assert float(flour.total_stock_value) == pytest.approx(400)
+        assert float(flour.cost_price) == pytest.approx(0.2)
+
+    def test_reverse_restores_stock_and_cost(self, db_session, admin_user):
+        flour = create_test_ingredient(db_session, stock=1000, cost_price=0.1)
+        purchase = create_test_purchase(db_session, admin_user)
+        engine = PurchaseReceivingEngine(admin_user.id)
+        lines = engine.prepare([raw_line(flour, 1000, 0.3)])
+        engine.receive(purchase, lines, engine.add_items(purchase, lines))
+        db_session.commit()
+
+        engine.reverse(purchase)
+        db_session.commit()
+
+        db_session.refresh(flour)
+        assert flour.stock_ingredients_magasin == 1000
+        assert float(flour.total_stock_value) == pytest.approx(100)
+        assert float(flour.cost_price) == pytest.approx(0.1)
+
+    def test_prepare_skips_zero_quantity_lines(self, db_session, admin_user):
+        flour = create_test_ingredient(db_session)
+        engine = PurchaseReceivingEngine(admin_user.id)
+
+        lines = engine.prepare([raw_line(flour, 0, 0.3), raw_line(flour, 500, 0.2)])
+
+        assert [line.quantity for line in lines] == [500]
+
+    def test_prepare_skips_free_lines(self, db_session, admin_user):
+        flour = create_test_ingredient(db_session)
+        engine = PurchaseReceivingEngine(admin_user.id)
+
+        lines = engine.prepare([raw_line(flour, 500, 0), raw_line(flour, 500, 0.2)])
+
+        assert [line.unit_price for line in lines] == [0.2]
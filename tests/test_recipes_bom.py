@@ -0,0 +1,82 @@
+import pytest
+from models import Product, Category, Recipe, RecipeIngredient
+from app.recipes.bom import BillOfMaterials, BomCycleError, BomUnitError
+
+
+def create_test_category(db_session, name="Test Category"):
+    category = Category.query.filter_by(name=name).first()
+    if not category:
+        category = Category(name=name, description="A test category")
+        db_session.add(category)
+        db_session.commit()
+    return category
+
+
+def create_test_product(db_session, name, product_type='ingredient', unit='g'):
+    category = create_test_category(db_session)
+    product = Product(name=name, product_type=product_type, unit=unit, category_id=category.id)
+    db_session.add(product)
+    db_session.commit()
+    return product
+
+
+def create_test_recipe(db_session, name, product, yield_quantity, yield_unit, lines,
+                       location='ingredients_magasin'):
+    recipe = Recipe(name=name, product_id=product.id, yield_quantity=yield_quantity,
+                    yield_unit=yield_unit, production_location=location)
+    db_session.add(recipe)
+    db_session.flush()
+    for component, quantity, unit in lines:
+        db_session.add(RecipeIngredient(recipe_id=recipe.id, product_id=component.id,
+                                        quantity_needed=quantity, unit=unit))
+    db_session.commit()
+    return recipe
+
+
+@pytest.fixture
+def eclair_recipes(db_session):
+    """Éclairs (10 pièces) : 300 g de farine et 500 g de crème (sous-recette rendant 1 kg)."""
+    flour = create_test_product(db_session, 'Farine')
+    sugar = create_test_product(db_session, 'Sucre')
+    cream = create_test_product(db_session, 'Crème pâtissière', product_type='finished')
+    eclair = create_test_product(db_session, 'Éclair', product_type='finished', unit='pièce')
+    cream_recipe = create_test_recipe(db_session, 'Crème', cream, 1, 'kg',
+                                      [(sugar, 500, 'g'), (flour, 200, 'g')], location='ingredients_local')
+    eclair_recipe = create_test_recipe(db_session, 'Éclairs', eclair, 10, 'pièces',
+                                       [(cream, 500, 'g'), (flour, 300, 'g')])
+    return dict(flour=flour, sugar=sugar, cream=cream, eclair=eclair,
+                cream_recipe=cream_recipe, eclair_recipe=eclair_recipe)
+
+
+class TestBillOfMaterials:
+
+    def test_nested_recipe_is_scaled_in_yield_unit(self, eclair_recipes):
+        r = eclair_recipes
+        bom = BillOfMaterials.load(product_ids=[r['eclair'].id])
+
+        vector = {key: float(quantity) for key, (quantity, _) in bom.explode_product(r['eclair'].id).items()}
+
+        # 500 g de crème = 0,5 fournée de crème, pour 10 éclairs
+        assert vector == {
+            (r['flour'].id, 'ingredients_magasin'): pytest.approx(30),
+            (r['sugar'].id, 'ingredients_local'): pytest.approx(25),
+            (r['flour'].id, 'ingredients_local'): pytest.approx(10),
+        }
+
+    def test_unconvertible_line_unit_is_rejected(self, db_session, eclair_recipes):
+        r = eclair_recipes
+        line = RecipeIngredient.query.filter_by(recipe_id=r['eclair_recipe'].id, product_id=r['cream'].id).one()
+        line.unit = 'L'
+        db_session.commit()
+
+        with pytest.raises(BomUnitError):
+            BillOfMaterials.load(recipe_ids=[r['eclair_recipe'].id]).explode_recipe(r['eclair_recipe'].id)
+
+    def test_cycle_is_detected(self, db_session, eclair_recipes):
+        r = eclair_recipes
+        db_session.add(RecipeIngredient(recipe_id=r['cream_recipe'].id, product_id=r['eclair'].id,
+                                        quantity_needed=1, unit='pièce'))
+        db_session.commit()
+
+        with pytest.raises(BomCycleError):
+            BillOfMaterials.load(product_ids=[r['eclair'].id]).explode_product(r['eclair'].id)
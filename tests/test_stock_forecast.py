@@ -0,0 +1,111 @@
+import math
+import pytest
+from datetime import datetime, time, timedelta
+from models import Product, Category
+from app.stock.forecast import ConsumptionForecast
+from app.stock.ledger import StockLedger
+from app.stock.models import StockForecast, StockMovement, StockMovementType
+
+MAGASIN = 'ingredients_magasin'
+
+
+def create_test_ingredient(db_session, name="Farine", stock=1000.0):
+    category = Category.query.filter_by(name="Test Category").first()
+    if not category:
+        category = Category(name="Test Category", description="A test category")
+        db_session.add(category)
+        db_session.commit()
+    product = Product(name=name, product_type='ingredient', unit='g', cost_price=0.1,
+                      stock_ingredients_magasin=stock, total_stock_value=stock * 0.1,
+                      category_id=category.id)
+    db_session.add(product)
+    db_session.commit()
+    return product
+
+
+def consume(db_session, user, product, quantity, day):
+    """Sortie de stock datée de `day` (midi)."""
+    StockLedger(user.id).post_batch([{
+        'product_id': product.id, 'location': MAGASIN, 'quantity': -quantity,
+        'movement_type': StockMovementType.SORTIE, 'unit_cost': 0.1, 'reason': 'Test'
+    }])
+    movement = StockMovement.query.filter_by(product_id=product.id).order_by(StockMovement.id.desc()).first()
+    movement.created_at = datetime.combine(day, time(12))
+    db_session.commit()
+
+
+def forecast_for(product):
+    return StockForecast.query.filter_by(product_id=product.id).one()
+
+
+class TestConsumptionForecast:
+
+    def test_statistics_on_known_series(self, db_session, admin_user):
+        product = create_test_ingredient(db_session, stock=1000)
+        now = datetime.utcnow()
+        today = now.date()
+        for days_ago, quantity in ((27, 10), (10, 20), (0, 30)):
+            consume(db_session, admin_user, product, quantity, today - timedelta(days=days_ago))
+
+        assert ConsumptionForecast.rebuild(now=now) == 1
+        db_session.commit()
+
+        window = ConsumptionForecast.WINDOW_DAYS
+        mean = 60 / window
+        stddev = math.sqrt((10 ** 2 + 20 ** 2 + 30 ** 2) / window - mean ** 2)
+        lead_time = ConsumptionForecast.LEAD_TIME_DAYS[MAGASIN]
+        forecast = forecast_for(product)
+        assert forecast.window_days == window
+        assert forecast.avg_daily_consumption == pytest.approx(mean, abs=1e-4)
+        assert forecast.stddev_daily_consumption == pytest.approx(stddev, abs=1e-4)
+        assert forecast.reorder_point == pytest.approx(
+            mean * lead_time + ConsumptionForecast.SERVICE_FACTOR * stddev * math.sqrt(lead_time), abs=1e-3)
+        assert forecast.stock_level == 940
+        assert forecast.days_of_cover == pytest.approx(940 / mean, abs=0.1)
+
+    def test_movements_outside_window_are_ignored(self, db_session, admin_user):
+        product = create_test_ingredient(db_session)
+        today = datetime.utcnow().date()
+        consume(db_session, admin_user, product, 500, today - timedelta(days=ConsumptionForecast.WINDOW_DAYS))
+        consume(db_session, admin_user, product, 14, today - timedelta(days=6))
+
+        ConsumptionForecast.rebuild()
+        db_session.commit()
+
+        assert forecast_for(product).avg_daily_consumption == pytest.approx(14 / 7)
+
+    def test_recent_product_uses_shortened_window(self, db_session, admin_user):
+        recent = create_test_ingredient(db_session, name="Levure")
+        newer = create_test_ingredient(db_session, name="Sel")
+        today = datetime.utcnow().date()
+        consume(db_session, admin_user, recent, 20, today - timedelta(days=9))
+        consume(db_session, admin_user, newer, 14, today - timedelta(days=2))
+
+        ConsumptionForecast.rebuild()
+        db_session.commit()
+
+        assert forecast_for(recent).window_days == 10
+        assert forecast_for(recent).avg_daily_consumption == pytest.approx(2)
+        # Jamais en dessous de MIN_WINDOW_DAYS
+        assert forecast_for(newer).window_days == ConsumptionForecast.MIN_WINDOW_DAYS
+        assert forecast_for(newer).avg_daily_consumption == pytest.approx(14 / ConsumptionForecast.MIN_WINDOW_DAYS)
+
+    def test_incremental_refresh_recomputes_touched_products_only(self, db_session, admin_user):
+        flour = create_test_ingredient(db_session, name="Farine")
+        sugar = create_test_ingredient(db_session, name="Sucre")
+        now = datetime.utcnow()
+        consume(db_session, admin_user, flour, 70, now.date())
+        consume(db_session, admin_user, sugar, 70, now.date())
+        assert ConsumptionForecast.refresh(now) == 2
+        db_session.commit()
+        flour_computed_at = forecast_for(flour).computed_at
+
+        consume(db_session, admin_user, sugar, 140, now.date())
+        later = now + timedelta(seconds=1)
+        assert ConsumptionForecast.refresh(later) == 1
+        db_session.commit()
+
+        assert forecast_for(flour).computed_at == flour_computed_at
+        assert forecast_for(sugar).computed_at == later
+        assert forecast_for(sugar).avg_daily_consumption == pytest.approx(210 / 7)
+        assert ConsumptionForecast.refresh(later) == 0
@@ -0,0 +1,77 @@
+import pytest
+from models import Product, Category
+from app.stock.global_stats import GlobalStockStats
+from app.stock.ledger import StockLedger
+from app.stock.models import StockMovementType
+
+
+def create_test_product(db_session, name="Farine", quantity=100.0):
+    category = Category.query.filter_by(name="Test Category").first()
+    if not category:
+        category = Category(name="Test Category", description="A test category")
+        db_session.add(category)
+        db_session.commit()
+    product = Product(name=name, product_type='ingredient', unit='g', cost_price=0.1,
+                      quantity_in_stock=quantity, stock_ingredients_magasin=quantity,
+                      total_stock_value=quantity * 0.1, category_id=category.id)
+    db_session.add(product)
+    db_session.commit()
+    return product
+
+
+@pytest.fixture(autouse=True)
+def empty_stats_cache():
+    GlobalStockStats.invalidate()
+    yield
+    GlobalStockStats.invalidate()
+
+
+class TestGlobalStockStats:
+
+    def test_committed_stock_write_invalidates_cache(self, db_session):
+        product = create_test_product(db_session, quantity=100)
+        assert GlobalStockStats.get()['out_of_stock_products'] == 0
+
+        product.quantity_in_stock = 0
+        db_session.commit()
+
+        stats = GlobalStockStats.get()
+        assert stats['out_of_stock_products'] == 1
+        assert stats['low_stock_products'] == 1
+
+    def test_ledger_write_invalidates_cache_at_commit(self, db_session, admin_user):
+        product = create_test_product(db_session)
+        GlobalStockStats.get()
+
+        StockLedger(admin_user.id).post_batch([{
+            'product_id': product.id, 'location': 'ingredients_magasin', 'quantity': -10,
+            'movement_type': StockMovementType.SORTIE, 'unit_cost': 0.1
+        }])
+        assert GlobalStockStats._cached is not None
+        db_session.commit()
+
+        assert GlobalStockStats._cached is None
+
+    def test_rolled_back_write_keeps_cache(self, db_session):
+        product = create_test_product(db_session)
+        cached = GlobalStockStats.get()
+
+        product.quantity_in_stock = 0
+        db_session.flush()
+        db_session.rollback()
+
+        assert GlobalStockStats.get() is cached
+
+    def test_invalidation_during_compute_is_not_overwritten(self, db_session, monkeypatch):
+        create_test_product(db_session)
+        compute = GlobalStockStats.compute
+
+        def compute_then_invalidate(low_stock_threshold=5):
+            stats = compute(low_stock_threshold)
+            GlobalStockStats.invalidate()  # commit concurrent pendant le calcul
+            return stats
+
+        monkeypatch.setattr(GlobalStockStats, 'compute', compute_then_invalidate)
+        GlobalStockStats.get()
+
+        assert GlobalStockStats._cached is None
@@ -0,0 +1,292 @@
+import pytest
+from datetime import date, datetime, timedelta
+from models import Product, Category
+from app.stock.ledger import StockLedger
+from app.stock.lots import LotTracker
+from app.stock.models import (CostLayer, StockLot, StockMovement, StockMovementType, StockLocationType,
+                              StockTransfer, StockTransferLine, TransferStatus)
+from app.stock.stocktake import StocktakeEngine, StocktakeError
+from app.stock.transfers import TransferPostingEngine, TransferStatusError, TransferStockError
+from app.stock.valuation import CostLayerEngine
+
+MAGASIN = 'ingredients_magasin'
+
+
+def create_test_category(db_session, name="Test Category"):
+    category = Category.query.filter_by(name=name).first()
+    if not category:
+        category = Category(name=name, description="A test category")
+        db_session.add(category)
+        db_session.commit()
+    return category
+
+
+def create_test_ingredient(db_session, name="Farine", stock=100.0, cost_price=0.1):
+    category = create_test_category(db_session)
+    product = Product(
+        name=name,
+        product_type='ingredient',
+        unit='g',
+        cost_price=cost_price,
+        stock_ingredients_magasin=stock,
+        total_stock_value=stock * cost_price,
+        category_id=category.id
+    )
+    db_session.add(product)
+    db_session.commit()
+    return product
+
+
+def outflow(product, quantity, movement_type=StockMovementType.SORTIE):
+    return {
+        'product_id': product.id,
+        'location': MAGASIN,
+        'quantity': -quantity,
+        'movement_type': movement_type,
+        'unit_cost': float(product.cost_price or 0),
+        'reason': 'Test'
+    }
+
+
+class TestStockLedger:
+
+    def test_post_batch_clamps_outflow_at_zero(self, db_session, admin_user):
+        product = create_test_ingredient(db_session, stock=100)
+
+        rows = StockLedger(admin_user.id).post_batch([outflow(product, 150)])
+        db_session.commit()
+
+        assert len(rows) == 1
+        assert rows[0]['quantity'] == -100
+        assert rows[0]['stock_before'] == 100
+        assert rows[0]['stock_after'] == 0
+        db_session.refresh(product)
+        assert product.stock_ingredients_magasin == 0
+        movement = StockMovement.query.filter_by(product_id=product.id).one()
+        assert movement.quantity == -100
+
+    def test_post_batch_allow_negative(self, db_session, admin_user):
+        product = create_test_ingredient(db_session, stock=100)
+
+        rows = StockLedger(admin_user.id).post_batch([outflow(product, 150)], allow_negative=True)
+        db_session.commit()
+
+        assert rows[0]['quantity'] == -150
+        db_session.refresh(product)
+        assert product.stock_ingredients_magasin == -50
+
+    def test_post_batch_tracks_running_balance_within_batch(self, db_session, admin_user):
+        product = create_test_ingredient(db_session, stock=100)
+
+        rows = StockLedger(admin_user.id).post_batch([outflow(product, 60), outflow(product, 60)])
+        db_session.commit()
+
+        assert [row['quantity'] for row in rows] == [-60, -40]
+        assert [row['stock_after'] for row in rows] == [40, 0]
+
+    def test_apply_deltas_returns_before_and_after(self, db_session):
+        product = create_test_ingredient(db_session, stock=100)
+        key = (product.id, 'stock_ingredients_magasin')
+
+        assert StockLedger.apply_deltas({key: -30}, lock=True)[key] == (100, 70)
+        assert StockLedger.apply_deltas({key: -500}, lock=True)[key] == (70, 0)
+        db_session.commit()
+        db_session.refresh(product)
+        assert product.stock_ingredients_magasin == 0
+
+    def test_balances_as_of_replays_movements_after_snapshot(self, db_session, admin_user):
+        product = create_test_ingredient(db_session, stock=100)
+        ledger = StockLedger(admin_user.id)
+
+        ledger.post_batch([outflow(product, 20)])
+        db_session.commit()
+        StockLedger.take_snapshot()
+        db_session.commit()
+        ledger.post_batch([outflow(product, 30)])
+        db_session.commit()
+        later = StockMovement.query.filter_by(product_id=product.id).order_by(StockMovement.id.desc()).first()
+        later.created_at = datetime.utcnow() + timedelta(days=1)
+        db_session.commit()
+
+        key = (product.id, StockLocationType.INGREDIENTS_MAGASIN.value)
+        assert StockLedger.balances_as_of(datetime.utcnow(), [product.id])[key] == 80
+        assert StockLedger.balances_as_of(datetime.utcnow() + timedelta(days=2), [product.id])[key] == 50
+
+
+def create_test_transfer(db_session, user, product, quantity, reference="TRF-TEST-001"):
+    transfer = StockTransfer(reference=reference,
+                             source_location=StockLocationType.INGREDIENTS_MAGASIN,
+                             destination_location=StockLocationType.INGREDIENTS_LOCAL,
+                             status=TransferStatus.APPROVED, requested_by_id=user.id)
+    db_session.add(transfer)
+    db_session.flush()
+    db_session.add(StockTransferLine(transfer_id=transfer.id, product_id=product.id,
+                                     quantity_requested=quantity, unit_cost=float(product.cost_price or 0)))
+    db_session.commit()
+    return transfer
+
+
+class TestTransferPostingEngine:
+
+    def test_complete_moves_stock_between_locations(self, db_session, admin_user):
+        product = create_test_ingredient(db_session, stock=100)
+        transfer = create_test_transfer(db_session, admin_user, product, 40)
+
+        movements = TransferPostingEngine(admin_user.id).complete(transfer)
+        db_session.commit()
+
+        assert movements == 2
+        db_session.refresh(product)
+        assert product.stock_ingredients_magasin == 60
+        assert product.stock_ingredients_local == 40
+        assert transfer.status == TransferStatus.COMPLETED
+        assert transfer.completed_by_id == admin_user.id
+        assert [line.quantity_transferred for line in transfer.transfer_lines] == [40]
+        quantities = sorted(m.quantity for m in StockMovement.query.filter_by(transfer_id=transfer.id))
+        assert quantities == [-40, 40]
+
+    def test_insufficient_source_stock_is_rejected(self, db_session, admin_user):
+        product = create_test_ingredient(db_session, stock=30)
+        transfer = create_test_transfer(db_session, admin_user, product, 40)
+
+        with pytest.raises(TransferStockError) as error:
+            TransferPostingEngine(admin_user.id).complete(transfer)
+        db_session.rollback()
+
+        assert error.value.shortages == [{'product_id': product.id, 'product_name': 'Farine',
+                                          'available': 30, 'requested': 40}]
+        db_session.refresh(product)
+        db_session.refresh(transfer)
+        assert product.stock_ingredients_magasin == 30
+        assert product.stock_ingredients_local == 0
+        assert transfer.status == TransferStatus.APPROVED
+        assert StockMovement.query.count() == 0
+
+    def test_second_complete_is_rejected(self, db_session, admin_user):
+        product = create_test_ingredient(db_session, stock=100)
+        transfer = create_test_transfer(db_session, admin_user, product, 40)
+        engine = TransferPostingEngine(admin_user.id)
+        engine.complete(transfer)
+        db_session.commit()
+
+        with pytest.raises(TransferStatusError):
+            engine.complete(transfer)
+        db_session.rollback()
+
+        db_session.refresh(product)
+        assert product.stock_ingredients_magasin == 60
+        assert StockMovement.query.filter_by(transfer_id=transfer.id).count() == 2
+
+
+class TestStocktakeEngine:
+
+    def test_post_keeps_movements_made_during_count(self, db_session, admin_user):
+        product = create_test_ingredient(db_session, stock=100, cost_price=0.5)
+        engine = StocktakeEngine(admin_user.id)
+        count = engine.open(MAGASIN)
+        db_session.commit()
+
+        # Sortie de 30 pendant le comptage, puis 90 comptés : le stock à l'ouverture était 100
+        StockLedger(admin_user.id).post_batch([outflow(product, 30)])
+        engine.import_counts(count, f"product_id;quantity\n{product.id};90\n")
+        movements = engine.post(count)
+        db_session.commit()
+
+        assert movements == 1
+        db_session.refresh(product)
+        assert product.stock_ingredients_magasin == 60
+        assert float(product.total_stock_value) == pytest.approx(50 - 10 * 0.5)
+        assert float(count.variance_value) == pytest.approx(-5)
+        movement = StockMovement.query.filter_by(movement_type=StockMovementType.INVENTAIRE).one()
+        assert movement.quantity == -10
+
+    def test_post_twice_is_refused(self, db_session, admin_user):
+        product = create_test_ingredient(db_session, stock=100)
+        engine = StocktakeEngine(admin_user.id)
+        count = engine.open(MAGASIN)
+        engine.import_counts(count, f"product_id;quantity\n{product.id};100\n")
+        engine.post(count)
+        db_session.commit()
+
+        with pytest.raises(StocktakeError):
+            engine.post(count)
+
+
+class TestLotTracker:
+
+    def test_outflow_consumes_lots_first_expired_first_out(self, db_session, admin_user):
+        product = create_test_ingredient(db_session, stock=600)
+        today = date.today()
+        LotTracker.receive([
+            {'product_id': product.id, 'location': MAGASIN, 'quantity': 200, 'lot_number': 'SANS-DATE'},
+            {'product_id': product.id, 'location': MAGASIN, 'quantity': 200, 'lot_number': 'TARD',
+             'expiry_date': today + timedelta(days=30)},
+            {'product_id': product.id, 'location': MAGASIN, 'quantity': 200, 'lot_number': 'TOT',
+             'expiry_date': today + timedelta(days=3)},
+        ])
+        db_session.commit()
+
+        StockLedger(admin_user.id).post_batch([outflow(product, 300)])
+        db_session.commit()
+
+        remaining = {lot.lot_number: lot.remaining_quantity for lot in StockLot.query.all()}
+        assert remaining == {'TOT': 0, 'TARD': 100, 'SANS-DATE': 200}
+        assert [lot.lot_number for lot in LotTracker.open_lots(product.id)] == ['TARD', 'SANS-DATE']
+
+
+class TestCostLayerEngine:
+
+    def test_outflow_consumes_oldest_layers(self, db_session, admin_user):
+        product = create_test_ingredient(db_session, stock=0, cost_price=0)
+        ledger = StockLedger(admin_user.id)
+        for unit_cost in (1.0, 2.0, 3.0):
+            ledger.post_batch([{
+                'product_id': product.id, 'location': MAGASIN, 'quantity': 10,
+                'movement_type': StockMovementType.ENTREE, 'unit_cost': unit_cost
+            }])
+        db_session.commit()
+
+        cost = CostLayerEngine.consume({(product.id, None): 15})
+        db_session.commit()
+
+        assert cost == {product.id: pytest.approx(10 * 1.0 + 5 * 2.0)}
+        layers = CostLayer.query.filter_by(product_id=product.id).order_by(CostLayer.id).all()
+        assert [layer.remaining_quantity for layer in layers] == [0, 5, 10]
+
+    def test_consume_walks_beyond_first_chunk(self, db_session, monkeypatch):
+        product = create_test_ingredient(db_session, stock=0, cost_price=0)
+        monkeypatch.setattr(CostLayerEngine, 'CHUNK_SIZE', 2)
+        CostLayerEngine.post(inflows=[{'product_id': product.id, 'quantity': 1, 'unit_cost': cost}
+                                      for cost in (1.0, 2.0, 3.0, 4.0, 5.0)])
+        db_session.commit()
+
+        cost = CostLayerEngine.consume({(product.id, None): 4.5})
+
+        assert cost == {product.id: pytest.approx(1 + 2 + 3 + 4 + 0.5 * 5)}
+
+    def test_purchase_layers_are_consumed_first(self, db_session):
+        product = create_test_ingredient(db_session, stock=0, cost_price=0)
+        CostLayerEngine.post(inflows=[
+            {'product_id': product.id, 'quantity': 10, 'unit_cost': 1.0},
+            {'product_id': product.id, 'quantity': 10, 'unit_cost': 3.0, 'purchase_id': 42},
+        ])
+        db_session.commit()
+
+        cost = CostLayerEngine.consume({(product.id, 42): 10})
+
+        assert cost == {product.id: pytest.approx(30)}
+        layers = CostLayer.query.filter_by(product_id=product.id).order_by(CostLayer.id).all()
+        assert [layer.remaining_quantity for layer in layers] == [10, 0]
+
+    def test_close_period_refuses_other_months_and_overwrites(self, db_session):
+        create_test_ingredient(db_session, stock=10)
+        current = datetime.utcnow().strftime('%Y-%m')
+
+        assert CostLayerEngine.close_period() == 1
+        with pytest.raises(ValueError):
+            CostLayerEngine.close_period(current)
+        with pytest.raises(ValueError):
+            CostLayerEngine.close_period('2020-01')
+        with pytest.raises(ValueError):
+            CostLayerEngine.close_period('2026-13')
+        assert CostLayerEngine.close_period(current, overwrite=True) == 1